@@ -0,0 +1,189 @@
+"""
+Synthetic data and measurement helpers behind the seed_bench and run_bench
+commands.
+"""
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from . import search
+from .bulk import create_restaurants
+from .models import Report, Restaurant, RestaurantRequest, Review
+from .stats import rebuild_crowdedness, rebuild_restaurant_stats
+from .urls import app_name, urlpatterns
+
+
+BENCH_EMAIL_DOMAIN = 'bench.example'
+BENCH_NAME_PREFIX = 'Bench '
+ADMIN_EMAIL = f'admin@{BENCH_EMAIL_DOMAIN}'
+
+# Around Grounds
+CENTER = (38.0336, -78.5080)
+SPREAD_DEGREES = 0.03
+
+NAME_WORDS = ['Corner', 'Grill', 'Market', 'Cafe', 'Kitchen', 'Deli', 'Noodle', 'Taco', 'Pizza', 'Bagel',
+              'Burger', 'Curry', 'Sushi', 'Dumpling', 'Bakery', 'Diner', 'Bistro', 'Tea', 'Salad', 'Wings']
+MENU_WORDS = ['pizza', 'salad', 'burrito', 'ramen', 'curry', 'sandwich', 'bagel', 'coffee', 'smoothie',
+              'dumplings', 'fries', 'wings', 'tacos', 'pho', 'sushi', 'pasta', 'soup', 'waffles']
+# Dining halls get most of the traffic at meal times
+MEAL_HOURS = [8, 12, 13, 18, 19]
+
+
+def clear_bench_data():
+    get_user_model().objects.filter(email__endswith='@' + BENCH_EMAIL_DOMAIN).delete()
+    restaurants = Restaurant.objects.filter(name__startswith=BENCH_NAME_PREFIX)
+    Group.objects.filter(restaurant__in=restaurants).delete()
+    restaurants.delete()
+
+
+def seed(restaurants=200, users=500, reviews=5000, reports=20000, requests=100, seed=0):
+    """
+    Create a deterministic data set for benchmarking. Popularity follows a
+    Zipf-like curve, so a few restaurants get most of the reviews and reports,
+    and every restaurant has its own typical rating.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    User = get_user_model()
+
+    with transaction.atomic():
+        created_restaurants = create_restaurants([
+            Restaurant(
+                name=f'{BENCH_NAME_PREFIX}{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {number}',
+                address=f'{rng.randint(1, 2000)} University Ave',
+                latitude=CENTER[0] + rng.gauss(0, SPREAD_DEGREES),
+                longitude=CENTER[1] + rng.gauss(0, SPREAD_DEGREES),
+                contact_info=f'434-555-{number % 10000:04d}',
+                menu_text=', '.join(rng.sample(MENU_WORDS, 4)),
+            ) for number in range(restaurants)
+        ])
+        created_users = User.objects.bulk_create([
+            User(email=f'user{number}@{BENCH_EMAIL_DOMAIN}', password=make_password(None))
+            for number in range(users)
+        ], batch_size=1000)
+
+        popularity = [1 / (rank + 1) for rank in range(restaurants)]
+        quality = [rng.uniform(2, 4.5) for _ in range(restaurants)]
+
+        def rating_for(index):
+            return max(1, min(5, round(rng.gauss(quality[index], 1))))
+
+        def pick_restaurant():
+            return rng.choices(range(restaurants), weights=popularity)[0]
+
+        review_rows = []
+        for _ in range(reviews):
+            index = pick_restaurant()
+            review_rows.append(Review(
+                user=rng.choice(created_users), restaurant=created_restaurants[index], rating=rating_for(index),
+                review_text=' '.join(rng.choices(MENU_WORDS, k=12)),
+            ))
+        Review.objects.bulk_create(review_rows, batch_size=1000)
+
+        report_types = [choice for choice, _ in Report.ReportType.choices]
+        report_rows = []
+        for _ in range(reports):
+            index = pick_restaurant()
+            day = now - timedelta(days=rng.randrange(28))
+            timestamp = day.replace(hour=rng.choice(MEAL_HOURS), minute=rng.randrange(60))
+            report_rows.append(Report(
+                user=rng.choice(created_users), restaurant=created_restaurants[index], rating=rating_for(index),
+                report_type=rng.choice(report_types), timestamp=min(timestamp, now),
+            ))
+        Report.objects.bulk_create(report_rows, batch_size=1000)
+
+        RestaurantRequest.objects.bulk_create([
+            RestaurantRequest(
+                requester=rng.choice(created_users),
+                corresponding_restaurant=rng.choice([None, rng.choice(created_restaurants)]),
+                name=f'{BENCH_NAME_PREFIX}Request {number}', address='1 Main St',
+                latitude=CENTER[0], longitude=CENTER[1], menu_text=rng.choice(MENU_WORDS),
+            ) for number in range(requests)
+        ])
+
+        # Staff, an admin of everything, and running the most popular restaurant
+        admin = User.objects.create(email=ADMIN_EMAIL, password=make_password(None), is_staff=True)
+        everything, _ = Group.objects.get_or_create(name="admin of everything")
+        admin.groups.add(everything, created_restaurants[0].admin_group)
+
+    # bulk_create skips the signal handlers that keep these up to date
+    ids = [restaurant.pk for restaurant in created_restaurants]
+    rebuild_restaurant_stats(ids)
+    rebuild_crowdedness(ids)
+    search.get_backend().rebuild()
+    return created_restaurants
+
+
+BENCH_QUERIES = {
+    'restaurants_json': {'bbox': f'{CENTER[1] - 0.05},{CENTER[0] - 0.05},{CENTER[1] + 0.05},{CENTER[0] + 0.05}'},
+    'nearest_restaurants': {'lat': CENTER[0], 'lng': CENTER[1], 'k': 20},
+    'search': {'q': 'bench'},
+    'dish_search': {'q': 's'},
+}
+# POST-only, or (logout) would end the benchmark user's session
+SKIPPED_URLS = {
+    'logout', 'approve_request', 'reject_request', 'bulk_moderate_requests', 'read_messages', 'read_message',
+}
+
+
+def get_bench_urls():
+    """Return [(name, path, query)] for every GET-able URL in app/urls.py."""
+    restaurant = Restaurant.objects.filter(name__startswith=BENCH_NAME_PREFIX).order_by('pk').first()
+    review = Review.objects.filter(restaurant=restaurant).order_by('pk').first()
+    arguments = {
+        'pk': restaurant.pk if restaurant else 1,
+        'restaurant_id': restaurant.pk if restaurant else 1,
+    }
+    urls = []
+    for pattern in urlpatterns:
+        if not isinstance(pattern, URLPattern) or pattern.name in SKIPPED_URLS:
+            continue
+        kwargs = {name: arguments[name] for name in pattern.pattern.converters}
+        if pattern.name == 'review_detail':
+            kwargs['pk'] = review.pk if review else 1
+        path = reverse(f'{app_name}:{pattern.name}', kwargs=kwargs)
+        urls.append((pattern.name, path, BENCH_QUERIES.get(pattern.name, {})))
+    return urls
+
+
+def get_bench_client(server_name='localhost'):
+    # The test client's default host isn't in ALLOWED_HOSTS outside of tests, and
+    # a failing page should show up as a 500 in the results instead of stopping the run
+    client = Client(SERVER_NAME=server_name, raise_request_exception=False)
+    admin = get_user_model().objects.filter(email=ADMIN_EMAIL).first()
+    if admin is not None:
+        client.force_login(admin)
+    return client
+
+
+def measure(client, path, query=None, repeat=10):
+    """
+    Request path repeat times and return its status, p50/p95 latency in ms,
+    query count and response size.
+    """
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(path, query or {})
+            content = b''.join(response) if response.streaming else response.content
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'path': path,
+        'status': response.status_code,
+        'p50_ms': round(timings[len(timings) // 2], 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        # From the last, warm, request
+        'queries': len(queries),
+        'bytes': len(content),
+    }
@@ -0,0 +1,106 @@
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.forms import ValidationError
+
+from . import caching, menus, notifications, search
+from .geo import encode_geohash
+from .models import RejectionMessage, Restaurant, RestaurantRequest, validate_coordinates
+
+# Fields a bulk update may change; the running totals are never written this way
+EDITABLE_FIELDS = ['name', 'address', 'latitude', 'longitude', 'contact_info', 'menu_text']
+
+
+def _restaurants_changed(restaurants):
+    # Bulk writes skip the post_save signals, so do their work here
+    search.get_backend().index(restaurants)
+    menus.index_menus(restaurants)
+    caching.bump_versions([
+        caching.RESTAURANT_MAP, caching.RESTAURANT_LOCATIONS, caching.model_version(Restaurant),
+        *(caching.restaurant_version(restaurant.pk) for restaurant in restaurants),
+    ])
+
+
+def create_restaurants(restaurants, batch_size=500):
+    """
+    Insert restaurants and their "<pk> admin" groups with a handful of
+    queries instead of several per row. Coordinates must already be valid.
+    """
+    if not restaurants:
+        return []
+    for restaurant in restaurants:
+        restaurant.geohash = encode_geohash(restaurant.latitude, restaurant.longitude)
+
+    with transaction.atomic():
+        restaurants = Restaurant.objects.bulk_create(restaurants, batch_size=batch_size)
+        names = [str(restaurant.pk) + ' admin' for restaurant in restaurants]
+        Group.objects.bulk_create([Group(name=name) for name in names], batch_size=batch_size, ignore_conflicts=True)
+        groups = dict(Group.objects.filter(name__in=names).values_list('name', 'pk'))
+        for restaurant in restaurants:
+            restaurant.admin_group_id = groups[str(restaurant.pk) + ' admin']
+        Restaurant.objects.bulk_update(restaurants, ['admin_group'], batch_size=batch_size)
+        _restaurants_changed(restaurants)
+    return restaurants
+
+
+def update_restaurants(restaurants, batch_size=500):
+    """Write the editable fields of already saved restaurants in bulk."""
+    if not restaurants:
+        return
+    for restaurant in restaurants:
+        restaurant.geohash = encode_geohash(restaurant.latitude, restaurant.longitude)
+
+    with transaction.atomic():
+        Restaurant.objects.bulk_update(restaurants, EDITABLE_FIELDS + ['geohash'], batch_size=batch_size)
+        _restaurants_changed(restaurants)
+
+
+def approve_requests(restaurant_requests):
+    """
+    Approve many RestaurantRequests in one transaction. Requests for new
+    restaurants are created together, edits are written with one bulk
+    update, and the requests are deleted with a single query. Requests with
+    invalid coordinates are left pending. Returns the approved requests.
+    """
+    approved = []
+    new_restaurants = []
+    changed = {}
+    # Oldest first, so the latest request for a restaurant wins
+    for restaurant_request in sorted(restaurant_requests, key=lambda r: r.pk):
+        try:
+            validate_coordinates(restaurant_request.latitude, restaurant_request.longitude)
+        except ValidationError:
+            continue
+        approved.append(restaurant_request)
+        values = {name: getattr(restaurant_request, name) for name in EDITABLE_FIELDS}
+        restaurant = restaurant_request.corresponding_restaurant
+        if restaurant is None:
+            new_restaurants.append(Restaurant(**values))
+            continue
+        restaurant = changed.setdefault(restaurant.pk, restaurant)
+        for name, value in values.items():
+            setattr(restaurant, name, value)
+
+    with transaction.atomic():
+        create_restaurants(new_restaurants)
+        update_restaurants(list(changed.values()))
+        _notify(approved, "Your request was approved.", RejectionMessage.Outcome.APPROVED)
+        RestaurantRequest.objects.filter(pk__in=[r.pk for r in approved]).delete()
+    return approved
+
+
+def _notify(restaurant_requests, message, outcome):
+    messages = RejectionMessage.objects.bulk_create([
+        RejectionMessage(recipient_id=r.requester_id, for_what=r.name, message=message, outcome=outcome)
+        for r in restaurant_requests if r.requester_id is not None
+    ])
+    notifications.messages_changed(message.recipient_id for message in messages)
+
+
+def reject_requests(restaurant_requests, message):
+    """
+    Reject many RestaurantRequests in one transaction, sending every
+    requester the same message.
+    """
+    with transaction.atomic():
+        _notify(restaurant_requests, message, RejectionMessage.Outcome.REJECTED)
+        RestaurantRequest.objects.filter(pk__in=[r.pk for r in restaurant_requests]).delete()
@@ -0,0 +1,191 @@
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpRequest
+
+from .routing import read_database, reads_from_primary
+
+
+RESTAURANT_MAP = 'restaurant-map'
+# Only changes when a restaurant is added, moved or removed
+RESTAURANT_LOCATIONS = 'restaurant-locations'
+
+# Tells a miss apart from a cached None
+_MISSING = object()
+
+
+def _version_key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    """
+    Return the current version token for name. Cache keys built from it
+    change whenever bump_version(name) is called.
+    """
+    return get_versions([name])[0]
+
+
+def get_versions(names):
+    """Return the version tokens of names, in order, with one cache round trip when they all exist."""
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # add() keeps whichever token another worker set first
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
+
+
+def bump_version(name):
+    bump_versions([name])
+
+
+def bump_versions(names):
+    names = set(names)
+    if not names:
+        return
+
+    def bump():
+        cache.set_many({_version_key(name): uuid.uuid4().hex for name in names}, None)
+
+    bump()
+    # Bump again once the write is visible to other connections, otherwise a
+    # reader could cache pre-commit data under the new version
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        transaction.on_commit(bump)
+
+
+def get_versioned(name, key, build, timeout=None):
+    """
+    Return build() cached under key for the current version of name.
+    """
+    return get_cached([name], key, build, timeout)
+
+
+def get_cached(tags, key, build, timeout=None):
+    """
+    Return build() cached under key for the current versions of tags. Any
+    of the tags being bumped makes it miss, so nothing is ever deleted.
+    """
+    versioned_key = ':'.join([key, *get_versions(tags)])
+    value = cache.get(versioned_key, _MISSING)
+    if value is _MISSING:
+        with reads_from_primary():
+            value = build()
+        cache.set(versioned_key, value, timeout)
+    return value
+
+
+def cached(tags, key=None, timeout=None):
+    """
+    Decorator caching a function's return value with get_cached. tags, and
+    key if given, may be callables taking the function's arguments. The
+    default key is built from the function's name and repr() of its
+    arguments. Querysets should be returned as lists.
+
+        @cached(lambda restaurant_id: [restaurant_version(restaurant_id)])
+        def top_reviews(restaurant_id): ...
+
+    A request's repr() leaves out its query string and user, so views need
+    a key function, and raise TypeError without one.
+    """
+    def decorator(func):
+        name = f'cached:{func.__module__}.{func.__qualname__}'
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            func_tags = tags(*args, **kwargs) if callable(tags) else tags
+            if key is None:
+                if any(isinstance(arg, HttpRequest) for arg in (*args, *kwargs.values())):
+                    raise TypeError(f"{func.__qualname__} takes a request, so cached() needs a key function")
+                arguments = hashlib.md5(repr((args, sorted(kwargs.items()))).encode()).hexdigest()
+                func_key = f'{name}:{arguments}'
+            else:
+                func_key = f'{name}:{key(*args, **kwargs) if callable(key) else key}'
+            return get_cached(func_tags, func_key, lambda: func(*args, **kwargs), timeout)
+        return wrapper
+    return decorator
+
+
+def restaurant_version(restaurant_id):
+    # Bumped by any write to the restaurant or its reviews, reports and requests
+    return f'restaurant:{restaurant_id}'
+
+
+def model_version(model):
+    # Bumped by any write to a row of model
+    return f'model:{model._meta.label_lower}'
+
+
+def user_version(user_id):
+    # Bumped by any write to the user's reviews, reports and restaurant requests
+    return f'user:{user_id}'
+
+
+FRAGMENT_TIMEOUT = 5 * 60
+# How long past its expiry a fragment may still be served while it is rebuilt
+FRAGMENT_STALE_TIMEOUT = 60 * 60
+FRAGMENT_LOCK_TIMEOUT = 30
+FRAGMENT_STATS = ('hit', 'stale', 'miss')
+
+
+def _count(stat):
+    key = f'fragment-stats:{stat}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Lost to a concurrent add at worst, which only drops one count
+        cache.add(key, 1, None)
+
+
+def get_fragment_stats():
+    return {stat: cache.get(f'fragment-stats:{stat}', 0) for stat in FRAGMENT_STATS}
+
+
+def get_fragment(name, key, build, timeout=FRAGMENT_TIMEOUT):
+    """
+    Return build() cached under key for the current version of name.
+
+    Unlike get_versioned, an outdated or expired copy is kept around. When
+    it needs rebuilding one caller takes a lock and calls build() while
+    everyone else keeps serving the old copy, so a hot fragment expiring
+    doesn't send every worker to the database at once. With no copy at all
+    the others build their own without caching it, rather than waiting, so
+    only the lock holder writes to the cache.
+    """
+    fragment_key = f'fragment:{key}'
+    lock_key = fragment_key + ':lock'
+    version = get_version(name)
+    entry = cache.get(fragment_key)
+    if entry is not None:
+        entry_version, expires, value = entry
+        if entry_version == version and expires > time.time():
+            _count('hit')
+            return value
+        if not cache.add(lock_key, 1, FRAGMENT_LOCK_TIMEOUT):
+            _count('stale')
+            return value
+    elif not cache.add(lock_key, 1, FRAGMENT_LOCK_TIMEOUT):
+        _count('miss')
+        return build()
+
+    _count('miss')
+    if read_database.get() is not None:
+        # The template context, such as the page's restaurant, may have come from a replica
+        timeout = min(timeout, settings.REPLICA_PIN_SECONDS)
+    try:
+        with reads_from_primary():
+            value = build()
+        cache.set(fragment_key, (version, time.time() + timeout, value), timeout + FRAGMENT_STALE_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return value
@@ -0,0 +1,154 @@
+"""
+Likely duplicates of new restaurant requests. Candidates are the
+restaurants within DUPLICATE_RADIUS_KM, found with range lookups on the
+geohash index, so only the few rows nearby are read however many
+restaurants there are. They are then ranked in Python by the trigram
+similarity of their normalized names, weighted by distance.
+"""
+import math
+import re
+import unicodedata
+from dataclasses import dataclass
+
+from django.db.models import Q
+
+from .geo import GEOHASH_ALPHABET, GEOHASH_PRECISION, bbox_geohash_prefixes
+from .models import Restaurant
+from .spatial import EARTH_RADIUS_KM, chord_to_km, to_unit_vector
+
+
+DUPLICATE_RADIUS_KM = 0.25
+# Trigram similarity a name needs to count as a match, like pg_trgm's default threshold
+MIN_NAME_SIMILARITY = 0.3
+MAX_MATCHES = 3
+# Words that say nothing about which restaurant it is
+NAME_STOP_WORDS = {'the', 'and', 'restaurant', 'cafe', 'co'}
+
+
+@dataclass(frozen=True)
+class DuplicateMatch:
+    restaurant_id: int
+    name: str
+    distance_km: float
+    similarity: float
+    score: float
+
+    @property
+    def distance_m(self):
+        return round(self.distance_km * 1000)
+
+
+def normalize_name(name):
+    """Return the words of name without case, accents, punctuation or stop words."""
+    name = unicodedata.normalize('NFKD', name.lower())
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    # "Bodo's" and "Bodos" are the same place
+    words = re.findall(r'\w+', re.sub(r"['’]", '', name.replace('&', ' and ')))
+    return [word for word in words if word not in NAME_STOP_WORDS] or words
+
+
+def get_trigrams(name):
+    # Padded like pg_trgm, so the start of each word counts for more
+    trigrams = set()
+    for word in normalize_name(name):
+        padded = f'  {word} '
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def name_similarity(trigrams, other_trigrams):
+    if not trigrams or not other_trigrams:
+        return 0.0
+    return len(trigrams & other_trigrams) / len(trigrams | other_trigrams)
+
+
+def distance_km(latitude, longitude, other_latitude, other_longitude):
+    a = to_unit_vector(latitude, longitude)
+    b = to_unit_vector(other_latitude, other_longitude)
+    return chord_to_km(sum((x - y) ** 2 for x, y in zip(a, b)))
+
+
+def _has_location(restaurant_request):
+    latitude, longitude = restaurant_request.latitude, restaurant_request.longitude
+    return latitude is not None and longitude is not None and -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+def _nearby(latitude, longitude):
+    """
+    Return a condition matching every restaurant in a box around the circle,
+    as geohash index range lookups. The box fits in a few cells, which are
+    quicker to build and scan than the many finer ones in_bbox would use.
+    """
+    lat_delta = math.degrees(DUPLICATE_RADIUS_KM / EARTH_RADIUS_KM)
+    lng_delta = lat_delta / max(math.cos(math.radians(latitude)), 0.01)
+    min_lat, max_lat = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+    min_lng, max_lng = longitude - lng_delta, longitude + lng_delta
+    # A box crossing the antimeridian is split into its two halves
+    if lng_delta >= 180:
+        boxes = [(-180.0, min_lat, 180.0, max_lat)]
+    elif min_lng < -180:
+        boxes = [(min_lng + 360, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lng, max_lat)]
+    elif max_lng > 180:
+        boxes = [(min_lng, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lng - 360, max_lat)]
+    else:
+        boxes = [(min_lng, min_lat, max_lng, max_lat)]
+
+    condition = Q()
+    for box in boxes:
+        box_condition = Q(longitude__gte=box[0], latitude__gte=box[1], longitude__lte=box[2], latitude__lte=box[3])
+        prefixes = bbox_geohash_prefixes(*box, max_cells=4)
+        if prefixes is None:
+            # Only near the poles
+            condition |= box_condition
+            continue
+        # Each term is an index range narrowed to the box, so OR-ing them together still uses the index
+        for prefix in prefixes:
+            padding = GEOHASH_ALPHABET[-1] * (GEOHASH_PRECISION - len(prefix))
+            condition |= box_condition & Q(geohash__gte=prefix, geohash__lte=prefix + padding)
+    return condition
+
+
+def _rank(restaurant_request, candidates):
+    trigrams = get_trigrams(restaurant_request.name)
+    matches = []
+    for pk, name, latitude, longitude, candidate_trigrams in candidates:
+        distance = distance_km(restaurant_request.latitude, restaurant_request.longitude, latitude, longitude)
+        if distance > DUPLICATE_RADIUS_KM:
+            continue
+        similarity = name_similarity(trigrams, candidate_trigrams)
+        if similarity < MIN_NAME_SIMILARITY:
+            continue
+        # A similar name right next door beats a more similar one down the street
+        score = similarity * (1 - 0.5 * distance / DUPLICATE_RADIUS_KM)
+        matches.append(DuplicateMatch(pk, name, distance, similarity, score))
+    matches.sort(key=lambda match: (-match.score, match.restaurant_id))
+    return matches[:MAX_MATCHES]
+
+
+def find_duplicates(restaurant_request):
+    """Return the DuplicateMatches for a new restaurant request, most likely first."""
+    return get_duplicates([restaurant_request]).get(restaurant_request.pk, [])
+
+
+def get_duplicates(restaurant_requests):
+    """
+    Return {request.pk: [DuplicateMatch, ...]} for new restaurant requests,
+    with one query however many there are. Requests that edit an existing
+    restaurant, or have no name or location, are skipped.
+    """
+    restaurant_requests = [
+        r for r in restaurant_requests
+        if r.corresponding_restaurant_id is None and r.name and _has_location(r)
+    ]
+    if not restaurant_requests:
+        return {}
+    condition = Q()
+    for restaurant_request in restaurant_requests:
+        condition |= _nearby(restaurant_request.latitude, restaurant_request.longitude)
+    candidates = [
+        (pk, name, latitude, longitude, get_trigrams(name))
+        for pk, name, latitude, longitude in Restaurant.objects.filter(condition).values_list(
+            'pk', 'name', 'latitude', 'longitude'
+        )
+    ]
+    return {r.pk: _rank(r, candidates) for r in restaurant_requests}
@@ -0,0 +1,121 @@
+"""
+Streaming exports of reviews and reports for analytics. Rows are read
+with values_list and iterator(chunk_size=...) and encoded as they are
+read, so memory use doesn't depend on how many rows are exported.
+
+Exports are ordered by id and take an opaque cursor: pass the cursor an
+export returned to the next one to get only rows added since.
+
+Ids are handed out when a row is inserted but become visible when its
+transaction commits, so on PostgreSQL a slow transaction can commit an id
+below one already exported. Exports therefore stop at the newest row that
+is EXPORT_SETTLE_SECONDS old, and only a transaction open for longer than
+that can still be skipped. That assumes timestamps are set at insert time;
+write-behind reports keep their submission time, but they are inserted by
+a single flush_reports worker at a time.
+"""
+import csv
+import json
+from datetime import timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Report, Review
+from .pagination import decode_cursor, encode_cursor
+
+
+EXPORT_CHUNK_SIZE = 2000
+# Rows newer than this are left for the next export
+EXPORT_SETTLE_SECONDS = 60
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORTS = {
+    'reviews': (Review, ('id', 'restaurant_id', 'user_id', 'rating', 'review_text', 'timestamp')),
+    'reports': (Report, ('id', 'restaurant_id', 'user_id', 'report_type', 'rating', 'timestamp')),
+}
+
+
+def _parse_timestamp(value, name):
+    timestamp = parse_datetime(value)
+    if timestamp is None:
+        raise ValueError(f"{name} must be an ISO 8601 date and time")
+    return timestamp
+
+
+def get_export(kind, restaurant=None, report_type=None, since=None, until=None, cursor=None):
+    """
+    Return (fields, rows, next_cursor) for an export. rows is an unevaluated
+    values_list queryset. Raises ValueError for bad filters.
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f"Unknown export {kind!r}")
+    model, fields = EXPORTS[kind]
+    rows = model.objects.all()
+    if restaurant:
+        rows = rows.filter(restaurant=int(restaurant))
+    if report_type:
+        if model is not Report or report_type not in Report.ReportType.values:
+            raise ValueError("type must be a report type, and only applies to reports")
+        rows = rows.filter(report_type=report_type)
+    if since:
+        rows = rows.filter(timestamp__gte=_parse_timestamp(since, 'since'))
+    if until:
+        rows = rows.filter(timestamp__lt=_parse_timestamp(until, 'until'))
+
+    # Fix the upper end now, so rows added while streaming go to the next export
+    settled = timezone.now() - timedelta(seconds=EXPORT_SETTLE_SECONDS)
+    last_id = model.objects.filter(timestamp__lt=settled).order_by('-id').values_list('id', flat=True).first() or 0
+    after = 0
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 1 or not isinstance(values[0], int):
+            raise ValueError("Invalid cursor")
+        after = values[0]
+        last_id = max(last_id, after)
+    rows = rows.filter(id__gt=after, id__lte=last_id).order_by('id').values_list(*fields)
+    return fields, rows, encode_cursor([last_id])
+
+
+class _Echo:
+    # csv.writer only needs write(); return the line instead of buffering it
+    def write(self, value):
+        return value
+
+
+def _encode_csv(fields):
+    writer = csv.writer(_Echo())
+    return writer.writerow
+
+
+def _encode_ndjson(fields):
+    def encode(row):
+        return json.dumps(dict(zip(fields, row)), default=str) + '\n'
+    return encode
+
+
+ENCODERS = {'csv': _encode_csv, 'ndjson': _encode_ndjson}
+
+
+def stream_export(fields, rows, fmt):
+    """Yield the export as text, one row at a time."""
+    encode = ENCODERS[fmt](fields)
+    if fmt == 'csv':
+        yield encode(fields)
+    for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield encode(row)
+
+
+async def astream_export(fields, rows, fmt):
+    # For ASGI, which would otherwise read a sync iterator into memory before
+    # sending it. values_list().aiterator() runs its query on the event loop in
+    # Django 4.2, so read the sync iterator a chunk at a time in a thread instead.
+    encode = ENCODERS[fmt](fields)
+    if fmt == 'csv':
+        yield encode(fields)
+    iterator = rows.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    next_chunk = sync_to_async(lambda: list(islice(iterator, EXPORT_CHUNK_SIZE)))
+    while chunk := await next_chunk():
+        for row in chunk:
+            yield encode(row)
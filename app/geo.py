@@ -0,0 +1,89 @@
+import math
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+# 9 characters is roughly a 5m x 5m cell
+GEOHASH_PRECISION = 9
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        value, value_range = (longitude, lng_range) if even else (latitude, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+def geohash_cell_size(precision):
+    """Return the (latitude, longitude) size in degrees of a geohash cell."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def _cell_centers(minimum, maximum, size, origin):
+    start = math.floor((minimum - origin) / size) * size + origin
+    center = start + size / 2
+    while center - size / 2 <= maximum:
+        yield center
+        center += size
+
+
+def bbox_geohash_prefixes(min_lng, min_lat, max_lng, max_lat, max_cells=32):
+    """
+    Return the geohash prefixes of the cells covering a bounding box that
+    does not cross the antimeridian, using the finest precision that needs
+    at most max_cells cells. Returns None if even one character is too many.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_size, lng_size = geohash_cell_size(precision)
+        rows = math.floor((max_lat + 90) / lat_size) - math.floor((min_lat + 90) / lat_size) + 1
+        columns = math.floor((max_lng + 180) / lng_size) - math.floor((min_lng + 180) / lng_size) + 1
+        if rows * columns <= max_cells:
+            break
+    else:
+        return None
+
+    prefixes = set()
+    for latitude in _cell_centers(min_lat, max_lat, lat_size, -90.0):
+        for longitude in _cell_centers(min_lng, max_lng, lng_size, -180.0):
+            if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+                prefixes.add(encode_geohash(latitude, longitude, precision))
+    return sorted(prefixes)
+
+
+def parse_bbox(value):
+    """
+    Parse a "minLng,minLat,maxLng,maxLat" string. Raises ValueError if it is
+    malformed or out of range.
+    """
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError("bbox must be minLng,minLat,maxLng,maxLat")
+    min_lng, min_lat, max_lng, max_lat = (float(part) for part in parts)
+    if not all(math.isfinite(part) for part in (min_lng, min_lat, max_lng, max_lat)):
+        raise ValueError("bbox must contain finite numbers")
+    if not (-90 <= min_lat <= max_lat <= 90):
+        raise ValueError("bbox latitudes must be between -90 and 90 with minLat <= maxLat")
+    if not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180):
+        raise ValueError("bbox longitudes must be between -180 and 180")
+    return min_lng, min_lat, max_lng, max_lat
@@ -0,0 +1,177 @@
+"""
+Per-request timing: SQL query count and time, template render time and
+total view time, logged as a JSON line on the app.requests logger for
+every request. It's also sent as a Server-Timing header, but only with
+DEBUG on or to staff, since it would give anyone else a timing oracle into
+the database. Requests that repeat one SQL shape more than
+N_PLUS_ONE_THRESHOLD times, or take longer than SLOW_REQUEST_MS, are logged
+as warnings with their most expensive queries.
+"""
+import contextvars
+import json
+import logging
+import re
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+logger = logging.getLogger('app.requests')
+
+# Set for the duration of a request; sync_to_async copies it into worker threads
+current_stats = contextvars.ContextVar('request_stats', default=None)
+
+PLACEHOLDER_LISTS = re.compile(r'%s(?:\s*,\s*%s)+')
+NUMBERS = re.compile(r'\b\d+\b')
+
+
+def get_sql_shape(sql):
+    # IN lists of any length and literal limits/offsets count as the same query
+    return NUMBERS.sub('N', PLACEHOLDER_LISTS.sub('%s, ...', sql))
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+        # Keyed by the raw SQL so the hot path doesn't normalise anything
+        self.sql = defaultdict(lambda: [0, 0.0])
+
+    def get_shapes(self):
+        """Return [(shape, count, seconds)], most expensive first."""
+        shapes = defaultdict(lambda: [0, 0.0])
+        for sql, (count, elapsed) in self.sql.items():
+            shape = shapes[get_sql_shape(sql)]
+            shape[0] += count
+            shape[1] += elapsed
+        return sorted(((shape, count, elapsed) for shape, (count, elapsed) in shapes.items()),
+                      key=lambda item: item[2], reverse=True)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper, installed on every connection from signals.py."""
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_time += elapsed
+        entry = stats.sql[sql]
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = current_stats.get()
+        # Nested renders (fragments, render_to_string in a tag) are already being timed
+        if stats is None or stats.rendering:
+            return super().render(context, request)
+        stats.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+            stats.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing renders for RequestTimingMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def show_timing(request):
+    user = getattr(request, 'user', None)
+    return settings.DEBUG or (user is not None and user.is_staff)
+
+
+class RequestTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.report(request, response, stats, show_timing(request))
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        # Loading the user is sync-only
+        self.report(request, response, stats, settings.DEBUG or await sync_to_async(show_timing)(request))
+        return response
+
+    def report(self, request, response, stats, send_header):
+        total_ms = (time.perf_counter() - stats.started) * 1000
+        db_ms = stats.db_time * 1000
+        template_ms = stats.template_time * 1000
+        timing = (
+            f'db;dur={db_ms:.1f};desc="{stats.queries} queries", '
+            f'tpl;dur={template_ms:.1f}, view;dur={total_ms:.1f}'
+        )
+        if send_header:
+            if response.has_header('Server-Timing'):
+                timing = response['Server-Timing'] + ', ' + timing
+            response['Server-Timing'] = timing
+
+        line = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 1),
+            'db_ms': round(db_ms, 1),
+            'template_ms': round(template_ms, 1),
+            'queries': stats.queries,
+        }
+        logger.info(json.dumps(line))
+
+        slow = total_ms > settings.SLOW_REQUEST_MS
+        if not slow and stats.queries <= settings.N_PLUS_ONE_THRESHOLD:
+            return
+        shapes = stats.get_shapes()
+        repeated = [(shape, count) for shape, count, _ in shapes if count > settings.N_PLUS_ONE_THRESHOLD]
+        for shape, count in repeated:
+            logger.warning(json.dumps({**line, 'event': 'n_plus_one', 'count': count, 'sql': shape}))
+        if slow:
+            logger.warning(json.dumps({**line, 'event': 'slow_request', 'top_queries': [
+                {'sql': shape, 'count': count, 'ms': round(elapsed * 1000, 1)}
+                for shape, count, elapsed in shapes[:5]
+            ]}))
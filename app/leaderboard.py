@@ -0,0 +1,69 @@
+"""
+Restaurants ranked by the Bayesian average of their reviews, or of one
+report type. app.stats keeps each restaurant's <prefix>_score up to date in
+the same UPDATE as its running totals, and a partial index on
+(-score, id) keeps the order, so the top k is an index scan and a rank is
+an index range count; nothing is ever sorted at query time.
+
+A B-tree doesn't store subtree sizes, so a range count still walks every
+entry above the restaurant: the top k is O(log N + k) but a rank is
+O(log N + rank), not O(log N). Across a region's thousands of restaurants
+a rank near the bottom reads thousands of index entries, without touching
+the table, and ranks are cached until the next review, report or
+restaurant write. A true O(log N) rank needs an order-statistic
+structure, such as per-score-bucket counts kept by app.stats next to the
+scores.
+"""
+from . import caching
+from .models import Report, Restaurant, Review
+from .stats import get_stat_prefix
+
+
+DEFAULT_K = 10
+MAX_K = 100
+
+
+def get_board_prefix(report_type=None):
+    """Return the stat prefix ranked by a leaderboard. Raises ValueError for an unknown report type."""
+    if report_type and report_type not in Report.ReportType.values:
+        raise ValueError(f"Unknown report type {report_type!r}")
+    return get_stat_prefix(report_type or None)
+
+
+def _ranked(prefix):
+    # Matches the partial index, so unrated restaurants never appear
+    return Restaurant.objects.filter(**{prefix + '_count__gt': 0})
+
+
+def get_board_tags(*args, **kwargs):
+    # Every review or report moves a score, and restaurants can be renamed or removed
+    return [caching.model_version(Restaurant), caching.model_version(Review), caching.model_version(Report)]
+
+
+@caching.cached(get_board_tags)
+def get_top(report_type=None, k=DEFAULT_K):
+    """Return the k highest scoring restaurants, best first."""
+    prefix = get_board_prefix(report_type)
+    return list(_ranked(prefix).order_by(f'-{prefix}_score', 'id')[:k])
+
+
+def _rank_key(restaurant, report_type=None):
+    # The rank is for the score the caller loaded, which may predate the current versions
+    score = getattr(restaurant, get_board_prefix(report_type) + '_score')
+    return f'{restaurant.pk}:{report_type or ""}:{score}'
+
+
+@caching.cached(get_board_tags, key=_rank_key)
+def get_rank(restaurant, report_type=None):
+    """
+    Return restaurant's 1-based position on a leaderboard, or None if it
+    hasn't been rated. Reads every index entry ranked above it.
+    """
+    prefix = get_board_prefix(report_type)
+    if not getattr(restaurant, prefix + '_count'):
+        return None
+    score = getattr(restaurant, prefix + '_score')
+    # Two range counts rather than one OR, which would scan the whole index
+    higher = _ranked(prefix).filter(**{prefix + '_score__gt': score}).count()
+    tied = _ranked(prefix).filter(**{prefix + '_score': score, 'id__lt': restaurant.pk}).count()
+    return higher + tied + 1
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.snapshot import build_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the precompressed map snapshot now. Pages also start a rebuild in the background, at most "
+        "every MAP_SNAPSHOT_DEBOUNCE seconds, so this is only needed to have it ready before the first visitor."
+    )
+
+    def handle(self, *args, **options):
+        manifest = build_snapshot()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {settings.MAP_SNAPSHOT_URL}{manifest['name']}"))
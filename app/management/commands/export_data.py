@@ -0,0 +1,49 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import export
+from app.models import Report
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream reviews or reports as CSV or NDJSON without loading them into memory. With --cursor-file, "
+        "each run only exports rows added since the previous one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(export.EXPORTS))
+        parser.add_argument('--format', dest='fmt', choices=sorted(export.FORMATS), default='csv')
+        parser.add_argument('--output', help="File to write to instead of stdout")
+        parser.add_argument('--restaurant', type=int)
+        parser.add_argument('--type', choices=Report.ReportType.values, help="Report type, for reports")
+        parser.add_argument('--since', help="Only rows with a timestamp at or after this ISO 8601 time")
+        parser.add_argument('--until', help="Only rows with a timestamp before this ISO 8601 time")
+        parser.add_argument('--cursor', help="Only rows added after the export that returned this cursor")
+        parser.add_argument('--cursor-file', help="Read the cursor from this file, and save the next one to it")
+
+    def handle(self, *args, **options):
+        cursor = options['cursor']
+        cursor_file = Path(options['cursor_file']) if options['cursor_file'] else None
+        if cursor is None and cursor_file is not None and cursor_file.exists():
+            cursor = cursor_file.read_text().strip()
+        try:
+            fields, rows, next_cursor = export.get_export(
+                options['kind'], options['restaurant'], options['type'], options['since'], options['until'], cursor,
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        lines = export.stream_export(fields, rows, options['fmt'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
+
+        # Only move the cursor on once everything up to it has been written
+        if cursor_file is not None:
+            cursor_file.write_text(next_cursor)
+        self.stderr.write(f"Next cursor: {next_cursor}")
@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app import writebehind
+
+
+class Command(BaseCommand):
+    help = (
+        "Insert reports spooled by the write-behind buffer. Runs until stopped, flushing whenever "
+        "--batch-size reports are waiting or --interval seconds have passed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.REPORT_FLUSH_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.REPORT_FLUSH_INTERVAL)
+        parser.add_argument('--once', action='store_true', help="Flush what is spooled now and exit")
+
+    def handle(self, *args, **options):
+        try:
+            with writebehind.locked(writebehind.get_spool_dir(), 'flush.lock', blocking=False):
+                self.run(options)
+        except BlockingIOError:
+            raise CommandError("Another flush_reports worker is using this spool")
+
+    def run(self, options):
+        last_flush = time.monotonic()
+        # Checked every half second, so each check only reads what was appended since the last
+        pending = writebehind.PendingCounter()
+        while True:
+            if (options['once'] or pending.count() >= options['batch_size']
+                    or time.monotonic() - last_flush >= options['interval']):
+                inserted = writebehind.flush(options['batch_size'])
+                pending.reset()
+                last_flush = time.monotonic()
+                if inserted:
+                    self.stdout.write(f"Flushed {inserted} report{'s' if inserted != 1 else ''}")
+            if options['once']:
+                return
+            time.sleep(0.5)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app.caching import get_fragment_stats
+
+
+class Command(BaseCommand):
+    help = "Print hit, stale and miss counts for the restaurant page fragment cache."
+
+    def handle(self, *args, **options):
+        stats = get_fragment_stats()
+        total = sum(stats.values())
+        for stat, count in stats.items():
+            self.stdout.write(f"{stat}: {count}")
+        if total:
+            self.stdout.write(f"hit rate: {(stats['hit'] + stats['stale']) / total:.1%}")
@@ -0,0 +1,158 @@
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.forms import ValidationError
+
+from app.bulk import EDITABLE_FIELDS, create_restaurants, update_restaurants
+from app.models import Restaurant, validate_coordinates
+
+
+REQUIRED_FIELDS = ['name', 'address', 'latitude', 'longitude']
+
+
+def iter_rows(source, file_format):
+    if file_format == 'csv':
+        return csv.DictReader(source)
+    # JSON is decoded per row so one bad line is reported instead of ending the import
+    return (line for line in source)
+
+
+def parse_row(row):
+    """Build an unsaved Restaurant from a row, or raise ValueError."""
+    if isinstance(row, str):
+        row = json.loads(row)
+    if not isinstance(row, dict):
+        raise ValueError("row is not an object")
+    missing = [name for name in REQUIRED_FIELDS if row.get(name) in (None, '')]
+    if missing:
+        raise ValueError("missing " + ", ".join(missing))
+
+    values = {}
+    for name in EDITABLE_FIELDS:
+        value = row.get(name)
+        if name in ('latitude', 'longitude'):
+            values[name] = float(value)
+            continue
+        value = '' if value is None else str(value).strip()
+        max_length = Restaurant._meta.get_field(name).max_length
+        if len(value) > max_length:
+            raise ValueError(f"{name} is longer than {max_length} characters")
+        values[name] = value
+
+    # Same rule Restaurant.save() enforces
+    try:
+        validate_coordinates(values['latitude'], values['longitude'])
+    except ValidationError as error:
+        raise ValueError(error.messages[0])
+    return Restaurant(**values)
+
+
+def write_chunk(chunk):
+    """
+    Create or update the chunk's restaurants, matching existing ones on
+    (name, address). Returns (created, updated).
+    """
+    # Later rows win when the same restaurant appears twice
+    incoming = {(restaurant.name, restaurant.address): restaurant for restaurant in chunk}
+    existing = {
+        (restaurant.name, restaurant.address): restaurant
+        for restaurant in Restaurant.objects.filter(name__in={name for name, _ in incoming}).only(
+            'pk', 'geohash', *EDITABLE_FIELDS
+        )
+    }
+
+    to_create = []
+    to_update = []
+    for key, restaurant in incoming.items():
+        current = existing.get(key)
+        if current is None:
+            to_create.append(restaurant)
+            continue
+        for name in EDITABLE_FIELDS:
+            setattr(current, name, getattr(restaurant, name))
+        to_update.append(current)
+
+    create_restaurants(to_create)
+    update_restaurants(to_update)
+    return len(to_create), len(to_update)
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream restaurants from a CSV or JSON Lines file into the database, updating restaurants that "
+        "match on name and address. Progress is checkpointed so an interrupted import can be rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV with a header row, or one JSON object per line")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--checkpoint', help="Progress file, defaults to <path>.checkpoint")
+        parser.add_argument('--restart', action='store_true', help="Ignore any saved progress")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        checkpoint = options['checkpoint'] or path + '.checkpoint'
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        done = 0
+        if os.path.exists(checkpoint) and not options['restart']:
+            with open(checkpoint) as checkpoint_file:
+                done = int(checkpoint_file.read().strip() or 0)
+            self.stdout.write(f"Resuming after row {done}")
+
+        started = time.monotonic()
+        created = updated = invalid = processed = 0
+        chunk = []
+        row_number = done
+        try:
+            source = open(path, newline='', encoding='utf-8')
+        except OSError as error:
+            raise CommandError(error)
+        with source:
+            for row_number, row in enumerate(iter_rows(source, file_format), 1):
+                if row_number <= done or (isinstance(row, str) and not row.strip()):
+                    continue
+                processed += 1
+                try:
+                    chunk.append(parse_row(row))
+                except (ValueError, TypeError) as error:
+                    invalid += 1
+                    self.stderr.write(f"Row {row_number}: {error}")
+                if len(chunk) >= chunk_size:
+                    chunk_created, chunk_updated = write_chunk(chunk)
+                    created += chunk_created
+                    updated += chunk_updated
+                    chunk = []
+                    self._save_checkpoint(checkpoint, row_number)
+                    self._report(processed, started)
+
+        if chunk:
+            chunk_created, chunk_updated = write_chunk(chunk)
+            created += chunk_created
+            updated += chunk_updated
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {processed} rows in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.0f} rows/s): "
+            f"{created} created, {updated} updated, {invalid} invalid"
+        ))
+
+    def _save_checkpoint(self, checkpoint, row_number):
+        # Written only after the chunk is committed; replaying a chunk is harmless because rows upsert
+        temporary = checkpoint + '.tmp'
+        with open(temporary, 'w') as checkpoint_file:
+            checkpoint_file.write(str(row_number))
+        os.replace(temporary, checkpoint)
+
+    def _report(self, processed, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{processed} rows ({processed / max(elapsed, 1e-9):.0f} rows/s)")
@@ -0,0 +1,118 @@
+import asyncio
+import importlib.util
+import os
+import socket
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+DEFAULT_PATHS = ['/api/restaurants.json', '/api/search?q=a', '/api/restaurants/nearest?lat=38.03&lng=-78.5']
+
+
+def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+async def fetch(port, path, client_delay):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        # A slow client holds its connection open before the request arrives
+        if client_delay:
+            await asyncio.sleep(client_delay)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def run_load(port, paths, concurrency, duration, client_delay):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def client(number):
+        nonlocal errors
+        request_number = number
+        while time.monotonic() < deadline:
+            path = paths[request_number % len(paths)]
+            request_number += 1
+            started = time.monotonic()
+            try:
+                status = await fetch(port, path, client_delay)
+            except (OSError, ValueError, IndexError):
+                errors += 1
+                continue
+            if status >= 400:
+                errors += 1
+            else:
+                latencies.append(time.monotonic() - started)
+
+    await asyncio.gather(*(client(number) for number in range(concurrency)))
+    return latencies, errors
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the current database with gunicorn in WSGI and then ASGI mode and compare "
+        "throughput and latency for the same requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+        parser.add_argument('--path', action='append', dest='paths', help="Repeatable; defaults to the read APIs")
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds of load per mode")
+        parser.add_argument('--client-delay', type=float, default=0.0,
+                            help="Seconds each client waits after connecting, to mimic slow mobile clients")
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        if 'asgi' in options['modes'] and importlib.util.find_spec('uvicorn') is None:
+            raise CommandError("ASGI mode needs uvicorn; install it from requirements.txt")
+        paths = options['paths'] or DEFAULT_PATHS
+
+        results = []
+        for mode in options['modes']:
+            self.stdout.write(f"{mode}: {options['concurrency']} clients for {options['duration']:.0f}s")
+            results.append((mode, self.run_mode(mode, paths, options)))
+
+        self.stdout.write(f"{'mode':<6}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for mode, (latencies, errors) in results:
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+            p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+            self.stdout.write(
+                f"{mode:<6}{len(latencies):>10}{errors:>8}{len(latencies) / options['duration']:>10.1f}"
+                f"{p50:>10.1f}{p99:>10.1f}"
+            )
+
+    def run_mode(self, mode, paths, options):
+        port = options['port']
+        env = dict(os.environ, SERVER_MODE=mode)
+        server = subprocess.Popen(
+            ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(options['workers'])],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            if not wait_for_port(port, timeout=30):
+                raise CommandError(f"gunicorn didn't start in {mode} mode")
+            return asyncio.run(run_load(
+                port, paths, options['concurrency'], options['duration'], options['client_delay']
+            ))
+        finally:
+            server.terminate()
+            server.wait()
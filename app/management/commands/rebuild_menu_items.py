@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app.menus import rebuild_menus
+
+
+class Command(BaseCommand):
+    help = "Reparse every restaurant's menu_text into menu items and rebuild the dish search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_menus(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Reparsed the menus of {rebuilt} restaurants"))
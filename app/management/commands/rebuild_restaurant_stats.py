@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from app.stats import rebuild_crowdedness, rebuild_restaurant_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute every restaurant's running review and report totals and crowdedness baselines from scratch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('restaurant_ids', nargs='*', type=int, help="Only rebuild these restaurants")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        restaurant_ids = options['restaurant_ids'] or None
+        rebuilt = rebuild_restaurant_stats(restaurant_ids, batch_size=options['batch_size'])
+        rebuild_crowdedness(restaurant_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {rebuilt} restaurant(s)"))
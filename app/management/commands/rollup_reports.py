@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app.rollups import compact, roll_up
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold new reports into the hourly and daily rollups, resuming from where the last run stopped. "
+        "With --compact-days (or REPORT_RETENTION_DAYS), then delete rolled up reports older than that."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--compact-days', type=int, default=settings.REPORT_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        days = options['compact_days']
+        if days is not None and days < 1:
+            # Reports from the last day still feed the live crowdedness state
+            raise CommandError("--compact-days must be at least 1")
+
+        rolled_up = roll_up(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {rolled_up} reports"))
+        if days is not None:
+            deleted = compact(timezone.now() - timedelta(days=days), options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Compacted {deleted} reports older than {days} days"))
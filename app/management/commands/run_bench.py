@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import bench
+
+
+class Command(BaseCommand):
+    help = (
+        "Request every URL in app/urls.py with the test client and record p50/p95 latency, query count "
+        "and response size as JSON. Run seed_bench first. --compare diffs against an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Write the results to this file")
+        parser.add_argument('--compare', help="Earlier results to diff against")
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        baseline = {}
+        if options['compare']:
+            try:
+                with open(options['compare']) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Can't read {options['compare']}: {error}")
+
+        client = bench.get_bench_client()
+        results = {}
+        for name, path, query in bench.get_bench_urls():
+            results[name] = bench.measure(client, path, query, options['repeat'])
+
+        self.stdout.write(f"{'url':<24}{'status':>7}{'p50 ms':>9}{'p95 ms':>9}{'queries':>9}{'bytes':>10}")
+        for name, result in results.items():
+            line = (f"{name:<24}{result['status']:>7}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}"
+                    f"{result['queries']:>9}{result['bytes']:>10}")
+            previous = baseline.get(name)
+            if previous:
+                line += f"  p50 {result['p50_ms'] - previous['p50_ms']:+.1f}ms"
+                if result['queries'] != previous['queries']:
+                    line += f", queries {previous['queries']} -> {result['queries']}"
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
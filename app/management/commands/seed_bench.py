@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import bench
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with a deterministic benchmark data set. The same --seed always "
+        "produces the same restaurants, users, reviews and reports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=200)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--reviews', type=int, default=5000)
+        parser.add_argument('--reports', type=int, default=20000)
+        parser.add_argument('--requests', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Don't delete earlier benchmark data first")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if not options['keep']:
+            bench.clear_bench_data()
+        bench.seed(
+            restaurants=options['restaurants'], users=options['users'], reviews=options['reviews'],
+            reports=options['reports'], requests=options['requests'], seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {options['restaurants']} restaurants, {options['users']} users, {options['reviews']} reviews "
+            f"and {options['reports']} reports in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,126 @@
+"""
+Structured menus. Restaurant.menu_text is parsed into MenuItems, and every
+word of an item's name and tags gets a MenuToken row. Dish search turns
+each query word into a range scan of the (token, item) index, so it
+matches prefixes without reading any menu text.
+"""
+import re
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .models import MenuItem, MenuToken, Restaurant
+from .search import tokenize
+
+
+# Items are separated by newlines, semicolons, or commas outside parentheses
+ITEM_SEPARATOR = re.compile(r'[\n;]|,(?![^()]*\))')
+TAGS = re.compile(r'\(([^)]*)\)')
+# "$4", "$ 4.50" or "4.50"; a bare whole number is more likely part of the name
+PRICE = re.compile(r'\$\s*(\d{1,5}(?:\.\d{1,2})?)|\b(\d{1,5}\.\d{2})\b')
+MAX_TOKEN_LENGTH = 50
+DISH_SEARCH_LIMIT = 20
+
+
+def parse_menu(menu_text):
+    """Return unsaved MenuItems for menu_text, in menu order."""
+    items = []
+    for chunk in ITEM_SEPARATOR.split(menu_text or ''):
+        tags = [tag.strip().lower() for match in TAGS.findall(chunk) for tag in match.split(',')]
+        chunk = TAGS.sub(' ', chunk)
+        price = None
+        match = PRICE.search(chunk)
+        if match:
+            price = Decimal(match.group(1) or match.group(2))
+            chunk = chunk[:match.start()] + ' ' + chunk[match.end():]
+        name = ' '.join(chunk.split()).strip(' -:')
+        if not name:
+            continue
+        items.append(MenuItem(
+            position=len(items), name=name[:100], price=price,
+            tags=' '.join(tag for tag in tags if tag)[:200],
+        ))
+    return items
+
+
+def get_item_tokens(item):
+    return {token[:MAX_TOKEN_LENGTH] for token in tokenize(f'{item.name} {item.tags}')}
+
+
+def index_menus(restaurants):
+    """Replace the menu items and tokens of restaurants with ones parsed from their menu_text."""
+    restaurants = list(restaurants)
+    if not restaurants:
+        return
+    items = []
+    for restaurant in restaurants:
+        for item in parse_menu(restaurant.menu_text):
+            item.restaurant_id = restaurant.pk
+            items.append(item)
+        restaurant._menu_snapshot = restaurant.menu_text
+
+    with transaction.atomic():
+        ids = [restaurant.pk for restaurant in restaurants]
+        MenuToken.objects.filter(restaurant__in=ids).delete()
+        MenuItem.objects.filter(restaurant__in=ids).delete()
+        items = MenuItem.objects.bulk_create(items, batch_size=500)
+        MenuToken.objects.bulk_create([
+            MenuToken(token=token, item_id=item.pk, restaurant_id=item.restaurant_id)
+            for item in items for token in get_item_tokens(item)
+        ], batch_size=1000)
+
+
+def rebuild_menus(batch_size=500):
+    """Reparse every restaurant's menu. Returns the number of restaurants."""
+    rebuilt = 0
+    batch = []
+    for restaurant in Restaurant.objects.only('pk', 'menu_text').order_by('pk').iterator(chunk_size=batch_size):
+        batch.append(restaurant)
+        if len(batch) >= batch_size:
+            index_menus(batch)
+            rebuilt += len(batch)
+            batch = []
+    index_menus(batch)
+    return rebuilt + len(batch)
+
+
+def _token_range(token):
+    # A range rather than startswith, which can't use the index under SQLite's case-insensitive LIKE.
+    # It ends at the prefix with its last character incremented rather than padded with a high
+    # character, which some collations don't sort last.
+    prefix = token[:MAX_TOKEN_LENGTH]
+    return MenuToken.objects.filter(token__gte=prefix, token__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def _matching_item_ids(query, limit):
+    """
+    Walk the index range of the first word in (token, item) order, keeping
+    items that also match the other words, and stop after limit matches.
+    Shorter, alphabetically earlier words come first, so "bag" ranks an item
+    called "bag" before "bagel".
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return MenuToken.objects.none()
+    matches = _token_range(tokens[0])
+    for token in tokens[1:]:
+        matches = matches.filter(Exists(_token_range(token).filter(item=OuterRef('item'))))
+    # An item can match the first word through more than one of its tokens
+    return matches.order_by('token', 'item_id').values_list('item_id', flat=True)[:limit * 2]
+
+
+def _in_order(ids, items, limit):
+    ids = list(dict.fromkeys(ids))[:limit]
+    return [items[pk] for pk in ids if pk in items]
+
+
+def search_dishes(query, limit=DISH_SEARCH_LIMIT):
+    """Return menu items matching every word of query as a prefix, with their restaurants."""
+    ids = list(_matching_item_ids(query, limit))
+    return _in_order(ids, MenuItem.objects.select_related('restaurant').in_bulk(ids), limit)
+
+
+async def asearch_dishes(query, limit=DISH_SEARCH_LIMIT):
+    ids = [pk async for pk in _matching_item_ids(query, limit)]
+    return _in_order(ids, await MenuItem.objects.select_related('restaurant').ain_bulk(ids), limit)
@@ -0,0 +1,89 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:02
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+REPORT_STAT_PREFIXES = {
+    'CL': 'cleanliness',
+    'CR': 'crowdedness',
+    'FR': 'friendliness',
+    'MQ': 'menu_quality',
+}
+
+
+def fill_restaurant_stats(apps, schema_editor):
+    Restaurant = apps.get_model('app', 'Restaurant')
+    Review = apps.get_model('app', 'Review')
+    Report = apps.get_model('app', 'Report')
+
+    for row in Review.objects.values('restaurant').annotate(count=Count('pk'), total=Sum('rating')):
+        Restaurant.objects.filter(pk=row['restaurant']).update(
+            review_count=row['count'], review_sum=row['total'],
+        )
+    for row in Report.objects.values('restaurant', 'report_type').annotate(count=Count('pk'), total=Sum('rating')):
+        prefix = REPORT_STAT_PREFIXES[row['report_type']]
+        Restaurant.objects.filter(pk=row['restaurant']).update(**{
+            prefix + '_count': row['count'], prefix + '_sum': row['total'],
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_alter_restaurant_latitude_alter_restaurant_longitude_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='cleanliness_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='cleanliness_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='crowdedness_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='crowdedness_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='friendliness_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='friendliness_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='menu_quality_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='menu_quality_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='review_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_restaurant_stats, migrations.RunPython.noop),
+    ]
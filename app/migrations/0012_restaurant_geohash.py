@@ -0,0 +1,29 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+from app.geo import encode_geohash
+
+
+def fill_geohashes(apps, schema_editor):
+    Restaurant = apps.get_model('app', 'Restaurant')
+    restaurants = list(Restaurant.objects.only('pk', 'latitude', 'longitude'))
+    for restaurant in restaurants:
+        restaurant.geohash = encode_geohash(restaurant.latitude, restaurant.longitude)
+    Restaurant.objects.bulk_update(restaurants, ['geohash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_restaurant_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(fill_geohashes, migrations.RunPython.noop),
+    ]
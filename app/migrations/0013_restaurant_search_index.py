@@ -0,0 +1,47 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:20
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA compile_options")
+            if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+                # app.search falls back to plain LIKE queries without FTS5
+                return
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE app_restaurant_fts USING fts5("
+            "name, address, menu_text, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            "INSERT INTO app_restaurant_fts (rowid, name, address, menu_text) "
+            "SELECT id, name, address, menu_text FROM app_restaurant"
+        )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX app_restaurant_search_idx ON app_restaurant USING GIN (("
+            "setweight(to_tsvector('simple', name), 'A') || "
+            "setweight(to_tsvector('simple', address), 'B') || "
+            "setweight(to_tsvector('simple', menu_text), 'C')))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS app_restaurant_fts")
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS app_restaurant_search_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_restaurant_geohash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_restaurant_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['restaurant', '-timestamp', '-id'], name='app_review_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['restaurant', '-rating', '-timestamp', '-id'], name='app_review_rating_idx'),
+        ),
+    ]
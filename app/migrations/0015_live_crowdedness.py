@@ -0,0 +1,63 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:10
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+import django.db.models.deletion
+
+
+def fill_baselines(apps, schema_editor):
+    Report = apps.get_model('app', 'Report')
+    CrowdednessBaseline = apps.get_model('app', 'CrowdednessBaseline')
+    hourly = Report.objects.filter(report_type='CR').annotate(
+        weekday=ExtractIsoWeekDay('timestamp'), hour=ExtractHour('timestamp')
+    ).values('restaurant', 'weekday', 'hour').annotate(count=Count('pk'), total=Sum('rating')).order_by()
+    CrowdednessBaseline.objects.bulk_create([
+        CrowdednessBaseline(
+            restaurant_id=row['restaurant'],
+            hour_of_week=(row['weekday'] - 1) * 24 + row['hour'],
+            count=row['count'],
+            sum=row['total'],
+        ) for row in hourly
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_review_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='crowdedness_decayed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='crowdedness_decayed_sum',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='crowdedness_decayed_weight',
+            field=models.FloatField(default=0),
+        ),
+        migrations.CreateModel(
+            name='CrowdednessBaseline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour_of_week', models.PositiveSmallIntegerField(validators=[django.core.validators.MaxValueValidator(167)])),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('sum', models.PositiveIntegerField(default=0)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='crowdedness_baselines', to='app.restaurant')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='crowdednessbaseline',
+            constraint=models.UniqueConstraint(fields=('restaurant', 'hour_of_week'), name='app_unique_baseline_hour'),
+        ),
+        migrations.RunPython(fill_baselines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_report_write_behind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rejectionmessage',
+            name='outcome',
+            field=models.CharField(choices=[('AP', 'Approved'), ('RE', 'Rejected')], default='RE', max_length=2),
+        ),
+        migrations.AddField(
+            model_name='rejectionmessage',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='rejectionmessage',
+            index=models.Index(fields=['recipient', 'read', '-id'], name='app_message_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rejectionmessage',
+            index=models.Index(fields=['recipient', '-id'], name='app_message_inbox_idx'),
+        ),
+    ]
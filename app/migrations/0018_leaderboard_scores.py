@@ -0,0 +1,85 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+PREFIXES = ('review', 'cleanliness', 'crowdedness', 'friendliness', 'menu_quality')
+# app.models.RATING_PRIOR_MEAN and RATING_PRIOR_WEIGHT when this migration was written
+PRIOR_MEAN = 3.0
+PRIOR_WEIGHT = 5
+BATCH_SIZE = 500
+
+
+def bayesian_score(count, total):
+    return (PRIOR_WEIGHT * PRIOR_MEAN + total) / (PRIOR_WEIGHT + count)
+
+
+def fill_scores(apps, schema_editor):
+    Restaurant = apps.get_model('app', 'Restaurant')
+    fields = [prefix + suffix for prefix in PREFIXES for suffix in ('_count', '_sum')]
+    batch = []
+    for restaurant in Restaurant.objects.only('pk', *fields).order_by('pk').iterator(chunk_size=BATCH_SIZE):
+        for prefix in PREFIXES:
+            setattr(restaurant, prefix + '_score', bayesian_score(
+                getattr(restaurant, prefix + '_count'), getattr(restaurant, prefix + '_sum')
+            ))
+        batch.append(restaurant)
+        if len(batch) >= BATCH_SIZE:
+            Restaurant.objects.bulk_update(batch, [prefix + '_score' for prefix in PREFIXES])
+            batch = []
+    Restaurant.objects.bulk_update(batch, [prefix + '_score' for prefix in PREFIXES])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_notification_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='cleanliness_score',
+            field=models.FloatField(default=3.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='crowdedness_score',
+            field=models.FloatField(default=3.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='friendliness_score',
+            field=models.FloatField(default=3.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='menu_quality_score',
+            field=models.FloatField(default=3.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='review_score',
+            field=models.FloatField(default=3.0, editable=False),
+        ),
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(condition=models.Q(('review_count__gt', 0)), fields=['-review_score', 'id'], name='app_rank_review_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(condition=models.Q(('cleanliness_count__gt', 0)), fields=['-cleanliness_score', 'id'], name='app_rank_cleanliness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(condition=models.Q(('crowdedness_count__gt', 0)), fields=['-crowdedness_score', 'id'], name='app_rank_crowdedness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(condition=models.Q(('friendliness_count__gt', 0)), fields=['-friendliness_score', 'id'], name='app_rank_friendliness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(condition=models.Q(('menu_quality_count__gt', 0)), fields=['-menu_quality_score', 'id'], name='app_rank_menu_quality_idx'),
+        ),
+    ]
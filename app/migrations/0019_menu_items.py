@@ -0,0 +1,88 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:33
+
+import re
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# A copy of app.menus as it was when this migration was written, so later changes to it can't change this
+ITEM_SEPARATOR = re.compile(r'[\n;]|,(?![^()]*\))')
+TAGS = re.compile(r'\(([^)]*)\)')
+PRICE = re.compile(r'\$\s*(\d{1,5}(?:\.\d{1,2})?)|\b(\d{1,5}\.\d{2})\b')
+MAX_TOKEN_LENGTH = 50
+
+
+def parse_menu(menu_text):
+    """Return (name, price, tags) for each item of menu_text, in menu order."""
+    items = []
+    for chunk in ITEM_SEPARATOR.split(menu_text or ''):
+        tags = [tag.strip().lower() for match in TAGS.findall(chunk) for tag in match.split(',')]
+        chunk = TAGS.sub(' ', chunk)
+        price = None
+        match = PRICE.search(chunk)
+        if match:
+            price = Decimal(match.group(1) or match.group(2))
+            chunk = chunk[:match.start()] + ' ' + chunk[match.end():]
+        name = ' '.join(chunk.split()).strip(' -:')
+        if name:
+            items.append((name[:100], price, ' '.join(tag for tag in tags if tag)[:200]))
+    return items
+
+
+def get_item_tokens(name, tags):
+    return {token[:MAX_TOKEN_LENGTH] for token in re.findall(r'\w+', f'{name} {tags}'.lower())}
+
+
+def fill_menu_items(apps, schema_editor):
+    Restaurant = apps.get_model('app', 'Restaurant')
+    MenuItem = apps.get_model('app', 'MenuItem')
+    MenuToken = apps.get_model('app', 'MenuToken')
+    for restaurant_id, menu_text in Restaurant.objects.values_list('pk', 'menu_text').iterator():
+        parsed = parse_menu(menu_text)
+        items = MenuItem.objects.bulk_create([
+            MenuItem(restaurant_id=restaurant_id, position=position, name=name, price=price, tags=tags)
+            for position, (name, price, tags) in enumerate(parsed)
+        ])
+        MenuToken.objects.bulk_create([
+            MenuToken(token=token, item_id=item.pk, restaurant_id=restaurant_id)
+            for item, (name, price, tags) in zip(items, parsed) for token in get_item_tokens(name, tags)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_leaderboard_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('name', models.CharField(max_length=100)),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True)),
+                ('tags', models.CharField(blank=True, max_length=200)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='menu_items', to='app.restaurant')),
+            ],
+            options={
+                'ordering': ['restaurant', 'position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MenuToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=50)),
+                ('item', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='app.menuitem')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.restaurant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'item'], name='app_menu_token_idx'), models.Index(fields=['item', 'token'], name='app_menu_item_token_idx')],
+            },
+        ),
+        migrations.RunPython(fill_menu_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_menu_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('position', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReportRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report_type', models.CharField(choices=[('CL', 'Cleanliness'), ('CR', 'Crowdedness'), ('FR', 'Friendliness'), ('MQ', 'Menu Quality')], max_length=2)),
+                ('period', models.CharField(choices=[('H', 'Hour'), ('D', 'Day')], max_length=1)),
+                ('start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('sum', models.PositiveIntegerField(default=0)),
+                ('rated_1', models.PositiveIntegerField(default=0)),
+                ('rated_2', models.PositiveIntegerField(default=0)),
+                ('rated_3', models.PositiveIntegerField(default=0)),
+                ('rated_4', models.PositiveIntegerField(default=0)),
+                ('rated_5', models.PositiveIntegerField(default=0)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_rollups', to='app.restaurant')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='reportrollup',
+            constraint=models.UniqueConstraint(fields=('restaurant', 'report_type', 'period', 'start'), name='app_unique_report_rollup'),
+        ),
+    ]
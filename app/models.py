@@ -1,7 +1,12 @@
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models import Count, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.forms import ValidationError
 from django.utils import timezone
 from django.contrib.auth.models import Group
@@ -9,6 +14,8 @@ from django.core.serializers import serialize
 from django.utils.translation import gettext_lazy
 import json
 
+from .geo import GEOHASH_ALPHABET, GEOHASH_PRECISION, bbox_geohash_prefixes, encode_geohash
+
 
 class UserManager(BaseUserManager):
     def _create_user(self, email, password, is_staff, is_superuser, name=None, **extra_fields):
@@ -55,6 +62,123 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.email
 
 
+# A crowdedness report counts half as much after this long
+CROWDEDNESS_HALF_LIFE = timedelta(minutes=30)
+# How many fresh reports it takes to outweigh the hour-of-week baseline
+CROWDEDNESS_PRIOR_WEIGHT = 1.0
+
+
+def crowdedness_decay(elapsed):
+    return 0.5 ** (max(elapsed.total_seconds(), 0) / CROWDEDNESS_HALF_LIFE.total_seconds())
+
+
+def get_hour_of_week(timestamp):
+    local = timezone.localtime(timestamp)
+    return local.weekday() * 24 + local.hour
+
+
+def validate_coordinates(latitude, longitude):
+    if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
+        raise ValidationError(
+            "Invalid coordinates: Latitude must be between -90 and 90 and longitude must be between -180 and 180."
+        )
+
+
+def _average(count, total):
+    if count == 0:
+        return "N/A"
+    return round(total / count, 2)
+
+
+# Leaderboard scores pull every average towards RATING_PRIOR_MEAN as if each
+# restaurant already had RATING_PRIOR_WEIGHT ratings of it, so a single 5 star
+# review doesn't beat a hundred 4.8 averages. Changing either needs
+# rebuild_restaurant_stats to rescore everything.
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 5
+
+
+def bayesian_score(count, total):
+    return (RATING_PRIOR_WEIGHT * RATING_PRIOR_MEAN + total) / (RATING_PRIOR_WEIGHT + count)
+
+
+@dataclass(frozen=True)
+class ReportSummary:
+    rating: object
+    rating_count: int
+    cleanliness: object
+    cleanliness_count: int
+    crowdedness: object
+    crowdedness_count: int
+    friendliness: object
+    friendliness_count: int
+    menu_quality: object
+    menu_quality_count: int
+
+    @classmethod
+    def from_totals(cls, totals):
+        # totals maps a stat prefix ('review', 'cleanliness', ...) to (count, sum)
+        values = {}
+        for prefix, (count, total) in totals.items():
+            name = 'rating' if prefix == 'review' else prefix
+            values[name] = _average(count, total)
+            values[name + '_count'] = count
+        return cls(**values)
+
+    def as_dict(self):
+        return asdict(self)
+
+
+class RestaurantQuerySet(models.QuerySet):
+    def with_report_summary(self, reports_after=None):
+        """
+        Annotate live review and report totals computed from the Review and
+        Report tables in a single grouped query. With reports_after, only
+        reports with a greater id are counted.
+        """
+        annotations = {}
+        for report_type, prefix in Restaurant.REPORT_STAT_PREFIXES.items():
+            condition = Q(reports__report_type=report_type)
+            if reports_after is not None:
+                condition &= Q(reports__id__gt=reports_after)
+            annotations[f'summary_{prefix}_count'] = Count('reports', filter=condition)
+            annotations[f'summary_{prefix}_sum'] = Coalesce(Sum('reports__rating', filter=condition), Value(0))
+
+        # Reviews come from a subquery so they don't multiply the report join
+        reviews = Review.objects.filter(restaurant=OuterRef('pk')).order_by().values('restaurant')
+        annotations['summary_review_count'] = Coalesce(
+            Subquery(reviews.annotate(count=Count('pk')).values('count')), Value(0)
+        )
+        annotations['summary_review_sum'] = Coalesce(
+            Subquery(reviews.annotate(total=Sum('rating')).values('total')), Value(0)
+        )
+        return self.annotate(**annotations)
+
+    def in_bbox(self, min_lng, min_lat, max_lng, max_lat):
+        # A box crossing the antimeridian is split into its two halves
+        if min_lng > max_lng:
+            boxes = [(min_lng, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lng, max_lat)]
+        else:
+            boxes = [(min_lng, min_lat, max_lng, max_lat)]
+
+        condition = Q()
+        for box in boxes:
+            box_condition = Q(
+                longitude__gte=box[0], latitude__gte=box[1],
+                longitude__lte=box[2], latitude__lte=box[3],
+            )
+            # Narrow the scan to the covering geohash cells with index range lookups
+            prefixes = bbox_geohash_prefixes(*box)
+            if prefixes is not None:
+                cells = Q()
+                for prefix in prefixes:
+                    padding = GEOHASH_ALPHABET[-1] * (GEOHASH_PRECISION - len(prefix))
+                    cells |= Q(geohash__gte=prefix, geohash__lte=prefix + padding)
+                box_condition &= cells
+            condition |= box_condition
+        return self.filter(condition)
+
+
 class Restaurant(models.Model):
     # Django automatically adds an id field to the model
     name = models.CharField(max_length=100)
@@ -74,45 +198,148 @@ class Restaurant(models.Model):
     contact_info = models.CharField(max_length=200)
     menu_text = models.CharField(max_length=500, blank=True)
     admin_group = models.ForeignKey(Group, null=True, on_delete=models.SET_NULL)
+    # Derived from the coordinates in save() and indexed for viewport queries
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
+
+    # Running totals kept up to date by app.stats; see rebuild_restaurant_stats
+    review_count = models.PositiveIntegerField(default=0)
+    review_sum = models.PositiveIntegerField(default=0)
+    cleanliness_count = models.PositiveIntegerField(default=0)
+    cleanliness_sum = models.PositiveIntegerField(default=0)
+    crowdedness_count = models.PositiveIntegerField(default=0)
+    crowdedness_sum = models.PositiveIntegerField(default=0)
+    friendliness_count = models.PositiveIntegerField(default=0)
+    friendliness_sum = models.PositiveIntegerField(default=0)
+    menu_quality_count = models.PositiveIntegerField(default=0)
+    menu_quality_sum = models.PositiveIntegerField(default=0)
+    # Bayesian averages of the totals above, indexed for the leaderboards
+    review_score = models.FloatField(default=RATING_PRIOR_MEAN, editable=False)
+    cleanliness_score = models.FloatField(default=RATING_PRIOR_MEAN, editable=False)
+    crowdedness_score = models.FloatField(default=RATING_PRIOR_MEAN, editable=False)
+    friendliness_score = models.FloatField(default=RATING_PRIOR_MEAN, editable=False)
+    menu_quality_score = models.FloatField(default=RATING_PRIOR_MEAN, editable=False)
+
+    # Exponentially decayed crowdedness reports as of crowdedness_decayed_at
+    crowdedness_decayed_sum = models.FloatField(default=0)
+    crowdedness_decayed_weight = models.FloatField(default=0)
+    crowdedness_decayed_at = models.DateTimeField(null=True, blank=True)
+
+    # Report.ReportType value -> prefix of the matching running total fields
+    REPORT_STAT_PREFIXES = {
+        'CL': 'cleanliness',
+        'CR': 'crowdedness',
+        'FR': 'friendliness',
+        'MQ': 'menu_quality',
+    }
+    TOTAL_FIELDS = tuple(
+        prefix + suffix
+        for prefix in ('review', *REPORT_STAT_PREFIXES.values())
+        for suffix in ('_count', '_sum')
+    )
+    SCORE_FIELDS = tuple(prefix + '_score' for prefix in ('review', *REPORT_STAT_PREFIXES.values()))
+    STAT_FIELDS = TOTAL_FIELDS + SCORE_FIELDS + (
+        'crowdedness_decayed_sum', 'crowdedness_decayed_weight', 'crowdedness_decayed_at',
+    )
+
+    objects = RestaurantQuerySet.as_manager()
+
+    class Meta:
+        # Leaderboards only rank restaurants that have been rated
+        indexes = [
+            models.Index(
+                fields=[f'-{prefix}_score', 'id'], condition=Q(**{f'{prefix}_count__gt': 0}),
+                name=f'app_rank_{prefix}_idx',
+            )
+            for prefix in ('review', 'cleanliness', 'crowdedness', 'friendliness', 'menu_quality')
+        ]
+
+    # Remember the loaded menu and location so app.menus only reparses the
+    # menu, and the nearest-restaurant index is only rebuilt, when they change
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'menu_text' in field_names:
+            instance._menu_snapshot = instance.menu_text
+        if 'latitude' in field_names and 'longitude' in field_names:
+            instance._location_snapshot = (instance.latitude, instance.longitude)
+        return instance
+
+    def update_scores(self):
+        for prefix in ('review', *self.REPORT_STAT_PREFIXES.values()):
+            setattr(self, prefix + '_score', bayesian_score(
+                getattr(self, prefix + '_count'), getattr(self, prefix + '_sum')
+            ))
+
+    def _get_average(self, prefix):
+        return _average(getattr(self, prefix + '_count'), getattr(self, prefix + '_sum'))
 
     def get_average_rating(self):
-        reviews = self.reviews.all()
-        if len(reviews) == 0:
-            return "N/A"
-        return round(sum(review.rating for review in reviews) / len(reviews), 2)
+        return self._get_average('review')
 
     def get_average_cleanliness(self):
-        reports = self.reports.filter(report_type='CL')
-        if len(reports) == 0:
-            return "N/A"
-        return round(sum(report.rating for report in reports) / len(reports), 2)
+        return self._get_average('cleanliness')
 
     def get_average_crowdedness(self):
-        reports = self.reports.filter(report_type='CR')
-        if len(reports) == 0:
-            return "N/A"
-        return round(sum(report.rating for report in reports) / len(reports), 2)
+        return self._get_average('crowdedness')
 
     def get_average_friendliness(self):
-        reports = self.reports.filter(report_type='FR')
-        if len(reports) == 0:
-            return "N/A"
-        return round(sum(report.rating for report in reports) / len(reports), 2)
+        return self._get_average('friendliness')
 
     def get_average_menu_quality(self):
-        reports = self.reports.filter(report_type='MQ')
-        if len(reports) == 0:
+        return self._get_average('menu_quality')
+
+    def get_live_crowdedness(self, baseline=None, now=None):
+        """
+        Estimate crowdedness right now: recent reports weighted by how fresh
+        they are, blended with the typical crowdedness for this hour of the
+        week (or the all-time average when there is no baseline yet).
+        """
+        now = now or timezone.now()
+        weight = total = 0.0
+        if self.crowdedness_decayed_at is not None:
+            decay = crowdedness_decay(now - self.crowdedness_decayed_at)
+            weight = self.crowdedness_decayed_weight * decay
+            total = self.crowdedness_decayed_sum * decay
+
+        if baseline is not None and baseline.count:
+            prior = baseline.sum / baseline.count
+        elif self.crowdedness_count:
+            prior = self.crowdedness_sum / self.crowdedness_count
+        else:
+            prior = None
+
+        if prior is not None:
+            weight += CROWDEDNESS_PRIOR_WEIGHT
+            total += CROWDEDNESS_PRIOR_WEIGHT * prior
+        if weight == 0:
             return "N/A"
-        return round(sum(report.rating for report in reports) / len(reports), 2)
+        return round(total / weight, 2)
+
+    def get_report_summary(self):
+        # Prefer live totals from RestaurantQuerySet.with_report_summary() when present
+        source = 'summary_' if hasattr(self, 'summary_review_count') else ''
+        return ReportSummary.from_totals({
+            prefix: (getattr(self, f'{source}{prefix}_count'), getattr(self, f'{source}{prefix}_sum'))
+            for prefix in ('review', *self.REPORT_STAT_PREFIXES.values())
+        })
 
     # Don't let methods with invalid coordinates be saved to the database
     def save(self, *args, **kwargs):
-        if not (-90 <= self.latitude <= 90) or not (-180 <= self.longitude <= 180):
-            raise ValidationError(
-                "Invalid coordinates: Latitude must be between -90 and 90 and longitude must be between -180 and 180."
-            )
+        validate_coordinates(self.latitude, self.longitude)
+
+        self.geohash = encode_geohash(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = [*update_fields, 'geohash']
 
         is_new = self._state.adding
+        # The running totals are only ever changed with F() updates, so never
+        # write back a (possibly stale) in-memory copy of them
+        if not is_new and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.STAT_FIELDS
+            ]
         super(Restaurant, self).save(*args, **kwargs)
 
         if is_new or not self.admin_group:
@@ -126,6 +353,37 @@ class Restaurant(models.Model):
         return self.name
 
 
+class MenuItem(models.Model):
+    # Parsed from Restaurant.menu_text by app.menus; never edited directly
+    restaurant = models.ForeignKey(Restaurant, related_name='menu_items', on_delete=models.CASCADE)
+    position = models.PositiveSmallIntegerField()
+    name = models.CharField(max_length=100)
+    price = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
+    # Lowercase and space separated, from "(vegan, spicy)" after the dish name
+    tags = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ['restaurant', 'position']
+
+    def __str__(self):
+        return self.name
+
+
+class MenuToken(models.Model):
+    # Inverted index over menu item names and tags; restaurant is copied from the item
+    token = models.CharField(max_length=50)
+    item = models.ForeignKey(MenuItem, related_name='tokens', on_delete=models.CASCADE, db_index=False)
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            # Prefix lookups, in the order search results are returned
+            models.Index(fields=['token', 'item'], name='app_menu_token_idx'),
+            # Checking the other words of a query against one item; also covers deletes by item
+            models.Index(fields=['item', 'token'], name='app_menu_item_token_idx'),
+        ]
+
+
 class Review(models.Model):
     user = models.ForeignKey(get_user_model(), related_name='reviews', on_delete=models.CASCADE)
     restaurant = models.ForeignKey(Restaurant, related_name='reviews', on_delete=models.CASCADE)
@@ -140,6 +398,24 @@ class Review(models.Model):
     # Automatically set timestamp to current time and date
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    # Backs the keyset pagination of a restaurant's review feed
+    class Meta:
+        indexes = [
+            models.Index(fields=['restaurant', '-timestamp', '-id'], name='app_review_newest_idx'),
+            models.Index(fields=['restaurant', '-rating', '-timestamp', '-id'], name='app_review_rating_idx'),
+        ]
+
+    # Remember what was loaded so app.stats can apply edits as deltas
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'restaurant_id' in field_names and 'rating' in field_names:
+            instance._stats_snapshot = instance.get_stats_key()
+        return instance
+
+    def get_stats_key(self):
+        return (self.restaurant_id, None, self.rating)
+
     def __str__(self):
         return f"{self.user} rated {self.restaurant} {self.rating}/5\n" \
                f"{self.review_text[:20]}..."
@@ -161,12 +437,25 @@ class Report(models.Model):
             MaxValueValidator(5, message="Rating must be at most 5")
         ]
     )
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so reports flushed from the write-behind spool keep their submission time
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     report_type = models.CharField(
         max_length=2,
         choices=ReportType.choices,
         default=ReportType.CLEANLINESS
     )
+    # Set for spooled reports so a flush that is retried after a crash can't insert one twice
+    submission_id = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if {'restaurant_id', 'report_type', 'rating'} <= set(field_names):
+            instance._stats_snapshot = instance.get_stats_key()
+        return instance
+
+    def get_stats_key(self):
+        return (self.restaurant_id, self.report_type, self.rating)
 
     def get_report_type(self):
         return self.ReportType(self.report_type).label
@@ -175,6 +464,64 @@ class Report(models.Model):
         return f"{self.user} reported {self.restaurant}'s {self.get_report_type()} as {self.rating}/5\n"
 
 
+class CrowdednessBaseline(models.Model):
+    # Typical crowdedness per restaurant for each hour of the week (0 = Monday 00:00)
+    restaurant = models.ForeignKey(Restaurant, related_name='crowdedness_baselines', on_delete=models.CASCADE)
+    hour_of_week = models.PositiveSmallIntegerField(validators=[MaxValueValidator(167)])
+    count = models.PositiveIntegerField(default=0)
+    sum = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['restaurant', 'hour_of_week'], name='app_unique_baseline_hour'),
+        ]
+
+    def __str__(self):
+        return f"{self.restaurant} crowdedness at hour {self.hour_of_week}: {self.sum}/{self.count}"
+
+
+class ReportRollup(models.Model):
+    # Reports per restaurant, type and hour or day (UTC), filled by app.rollups
+    class Period(models.TextChoices):
+        HOUR = 'H', gettext_lazy('Hour')
+        DAY = 'D', gettext_lazy('Day')
+
+    restaurant = models.ForeignKey(Restaurant, related_name='report_rollups', on_delete=models.CASCADE)
+    report_type = models.CharField(max_length=2, choices=Report.ReportType.choices)
+    period = models.CharField(max_length=1, choices=Period.choices)
+    start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    sum = models.PositiveIntegerField(default=0)
+    # How many reports rated 1 to 5
+    rated_1 = models.PositiveIntegerField(default=0)
+    rated_2 = models.PositiveIntegerField(default=0)
+    rated_3 = models.PositiveIntegerField(default=0)
+    rated_4 = models.PositiveIntegerField(default=0)
+    rated_5 = models.PositiveIntegerField(default=0)
+
+    HISTOGRAM_FIELDS = ('rated_1', 'rated_2', 'rated_3', 'rated_4', 'rated_5')
+    TOTAL_FIELDS = ('count', 'sum') + HISTOGRAM_FIELDS
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['restaurant', 'report_type', 'period', 'start'], name='app_unique_report_rollup'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.restaurant} {self.get_report_type_display()} for the {self.get_period_display()} from {self.start}"
+
+
+class Watermark(models.Model):
+    # How far a background job has got, e.g. the last report id rolled up
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} at {self.position}"
+
+
 class RestaurantRequest(models.Model):
     corresponding_restaurant = models.ForeignKey(Restaurant, null=True, on_delete=models.SET_NULL)
     requester = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
@@ -240,14 +587,35 @@ class RestaurantRequest(models.Model):
                 menu_text=self.menu_text,
                 admin_group=None
             )
+        if self.requester_id is not None:
+            RejectionMessage.objects.create(
+                recipient_id=self.requester_id,
+                for_what=self.name,
+                message="Your request was approved.",
+                outcome=RejectionMessage.Outcome.APPROVED,
+            )
         self.delete()
 
 
 class RejectionMessage(models.Model):
+    # Despite the name, requesters are told about every outcome of their requests
+    class Outcome(models.TextChoices):
+        APPROVED = 'AP', gettext_lazy('Approved')
+        REJECTED = 'RE', gettext_lazy('Rejected')
+
     recipient = models.ForeignKey(User, on_delete=models.CASCADE)
     for_what = models.CharField(max_length=100, blank=True)
     message = models.CharField(max_length=500)
     read = models.BooleanField(default=False)
+    outcome = models.CharField(max_length=2, choices=Outcome.choices, default=Outcome.REJECTED)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Unread counts, and the inbox newest first
+            models.Index(fields=['recipient', 'read', '-id'], name='app_message_unread_idx'),
+            models.Index(fields=['recipient', '-id'], name='app_message_inbox_idx'),
+        ]
 
     def __str__(self):
         return self.message
@@ -0,0 +1,49 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import caching
+from .models import RejectionMessage
+
+
+INBOX_PAGE_SIZE = 20
+
+
+def user_messages_version(user_id):
+    # Bumped whenever one of the user's messages is created, read or deleted
+    return f'user-messages:{user_id}'
+
+
+def messages_changed(user_ids):
+    """For writes that skip the signal handlers, like bulk_create and update."""
+    for user_id in set(user_ids):
+        caching.bump_version(user_messages_version(user_id))
+
+
+def get_unread_count(user):
+    """
+    Return how many unread messages user has. Comes from the shared cache
+    until one of their messages changes, so it costs no queries on a hit.
+    """
+    if not user.is_authenticated:
+        return 0
+    if not hasattr(user, '_unread_count'):
+        user._unread_count = caching.get_versioned(
+            user_messages_version(user.pk), f'unread-messages:{user.pk}',
+            lambda: RejectionMessage.objects.filter(recipient=user, read=False).count()
+        )
+    return user._unread_count
+
+
+def mark_read(user, message_ids=None):
+    """Mark the user's messages, or only those in message_ids, as read. Returns how many changed."""
+    messages = RejectionMessage.objects.filter(recipient=user, read=False)
+    if message_ids is not None:
+        messages = messages.filter(pk__in=message_ids)
+    updated = messages.update(read=True)
+    if updated:
+        messages_changed([user.pk])
+    return updated
+
+
+def unread_messages(request):
+    """Context processor for the navbar's unread badge."""
+    return {'unread_count': SimpleLazyObject(lambda: get_unread_count(request.user))}
@@ -0,0 +1,72 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+
+
+def encode_cursor(values):
+    data = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Raises ValueError if the cursor wasn't made by encode_cursor."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (ValueError, TypeError) as error:
+        raise ValueError("Invalid cursor") from error
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _coerce_cursor(model, fields, values):
+    # A cursor comes from the client, so check every value against its field before filtering with it
+    if len(values) != len(fields):
+        raise ValueError("Invalid cursor")
+    coerced = []
+    for name, value in zip(fields, values):
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError("Invalid cursor")
+        try:
+            value = model._meta.get_field(name).to_python(value)
+        except (ValidationError, TypeError, ValueError) as error:
+            raise ValueError("Invalid cursor") from error
+        if value is None or (isinstance(value, datetime.datetime) and timezone.is_naive(value)):
+            raise ValueError("Invalid cursor")
+        coerced.append(value)
+    return coerced
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=20):
+    """
+    Return (items, next_cursor) for the page after cursor. ordering must end
+    in a unique field (normally the pk) so every row has a distinct position,
+    and should match an index for the query to stay fast at any depth.
+    """
+    fields = [name.lstrip('-') for name in ordering]
+    queryset = queryset.order_by(*ordering)
+
+    if cursor:
+        values = _coerce_cursor(queryset.model, fields, decode_cursor(cursor))
+        # (a, b, c) after (x, y, z) == a > x or (a == x and (b > y or (b == y and c > z)))
+        condition = Q()
+        for position, name in enumerate(ordering):
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            step = Q(**{f'{fields[position]}__{lookup}': values[position]})
+            for previous in range(position):
+                step &= Q(**{fields[previous]: values[previous]})
+            condition |= step
+        queryset = queryset.filter(condition)
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field) for field in fields])
+    return items, next_cursor
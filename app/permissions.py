@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+
+from django.utils.functional import SimpleLazyObject
+
+from . import caching
+
+
+GLOBAL_ADMIN_GROUP = "admin of everything"
+ADMIN_GROUP_SUFFIX = ' admin'
+# The file cache used on Heroku isn't shared between dynos, so a revoked
+# admin's scope can outlive the version bump on the others for this long
+ADMIN_SCOPE_TIMEOUT = 60
+
+
+def user_groups_version(user_id):
+    # Bumped from the signal handlers whenever the user's groups change
+    return f'user-groups:{user_id}'
+
+
+@dataclass(frozen=True)
+class AdminScope:
+    restaurant_ids: frozenset = frozenset()
+    is_global: bool = False
+
+    @classmethod
+    def from_group_names(cls, names):
+        restaurant_ids = set()
+        for name in names:
+            # Restaurant admin groups are named "<restaurant pk> admin"
+            prefix = name[:-len(ADMIN_GROUP_SUFFIX)]
+            if name.endswith(ADMIN_GROUP_SUFFIX) and prefix.isdigit():
+                restaurant_ids.add(int(prefix))
+        return cls(frozenset(restaurant_ids), GLOBAL_ADMIN_GROUP in names)
+
+    def administers(self, restaurant_id):
+        return restaurant_id in self.restaurant_ids
+
+    def can_moderate(self, restaurant_request):
+        if restaurant_request.corresponding_restaurant_id is None:
+            return self.is_global
+        return self.administers(restaurant_request.corresponding_restaurant_id)
+
+
+def load_admin_scope(user):
+    """Return the AdminScope for user from the database. Use it to authorize changes."""
+    if not user.is_authenticated:
+        return AdminScope()
+    return AdminScope.from_group_names(set(user.groups.values_list('name', flat=True)))
+
+
+def get_admin_scope(user):
+    """
+    Return the AdminScope for user, for deciding what to show. It is loaded
+    at most once per request and otherwise comes from the cache for up to
+    ADMIN_SCOPE_TIMEOUT seconds, or until the user's groups change.
+    """
+    if not user.is_authenticated:
+        return AdminScope()
+    # request.user is a fresh object for every request
+    if not hasattr(user, '_admin_scope'):
+        user._admin_scope = caching.get_versioned(
+            user_groups_version(user.pk), f'admin-scope:{user.pk}', lambda: load_admin_scope(user),
+            ADMIN_SCOPE_TIMEOUT,
+        )
+    return user._admin_scope
+
+
+def admin_scope(request):
+    """Context processor exposing the current user's AdminScope."""
+    return {'admin_scope': SimpleLazyObject(lambda: get_admin_scope(request.user))}
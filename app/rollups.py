@@ -0,0 +1,178 @@
+"""
+Hourly and daily report rollups.
+
+roll_up() folds reports into ReportRollup rows in id order and records the
+last id it folded in the "report-rollups" Watermark, in the same
+transaction as the rollups, so it can be stopped and rerun at any point
+without counting a report twice. Reports at or below the watermark that
+are later edited or deleted adjust their rollups from the stats signal
+handlers, so the rollups always match the reports they stand for.
+
+compact() then deletes raw reports older than a cutoff that are already
+rolled up, without touching the running totals. Anything that recomputes
+totals from the Report table adds the rollups for the ids at or below
+the watermark instead of counting those reports, so averages stay exact.
+
+Ids are handed out at insert but become visible at commit, so on
+PostgreSQL a slow transaction can commit an id below the watermark after
+it has moved on. roll_up() therefore stops at the newest report that is
+SETTLE_SECONDS old, the way app.export does, and only a transaction open
+for longer than that can still be missed.
+"""
+import datetime
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Report, ReportRollup, Watermark
+
+
+WATERMARK = 'report-rollups'
+HOUR = ReportRollup.Period.HOUR
+DAY = ReportRollup.Period.DAY
+TREND_PERIODS = {'hour': HOUR, 'day': DAY}
+DEFAULT_TREND_DAYS = 30
+MAX_TREND_DAYS = 366
+# Reports newer than this are left for the next roll_up()
+SETTLE_SECONDS = 60
+
+
+def get_watermark():
+    return Watermark.objects.filter(name=WATERMARK).values_list('position', flat=True).first() or 0
+
+
+def _bucket_starts(timestamp):
+    # Buckets are in UTC so they never overlap across daylight saving changes
+    hour = timestamp.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return {HOUR: hour, DAY: hour.replace(hour=0)}
+
+
+def _add(deltas, restaurant_id, report_type, hour, rating, count):
+    for period, start in _bucket_starts(hour).items():
+        totals = deltas[(restaurant_id, report_type, period, start)]
+        totals['count'] += count
+        totals['sum'] += count * rating
+        totals[f'rated_{rating}'] += count
+
+
+def apply_deltas(deltas):
+    """Add {(restaurant_id, report_type, period, start): {field: change}} to the rollups."""
+    deltas = {key: changes for key, changes in deltas.items() if any(changes.values())}
+    if not deltas:
+        return
+    existing = ReportRollup.objects.select_for_update().filter(
+        restaurant__in={key[0] for key in deltas}, start__in={key[3] for key in deltas},
+    )
+    rollups = {(r.restaurant_id, r.report_type, r.period, r.start): r for r in existing}
+    created = []
+    for key, changes in deltas.items():
+        rollup = rollups.get(key)
+        if rollup is None:
+            if changes['count'] <= 0:
+                # Its reports went with the rollup, e.g. a cascade from the restaurant
+                continue
+            restaurant_id, report_type, period, start = key
+            rollup = ReportRollup(restaurant_id=restaurant_id, report_type=report_type, period=period, start=start)
+            created.append(rollup)
+        for name, change in changes.items():
+            setattr(rollup, name, getattr(rollup, name) + change)
+    ReportRollup.objects.bulk_update([r for r in rollups.values() if r.pk], ReportRollup.TOTAL_FIELDS)
+    ReportRollup.objects.bulk_create(created)
+
+
+def get_settled_id():
+    """Return the highest report id that no transaction still open can commit below."""
+    settled = timezone.now() - datetime.timedelta(seconds=SETTLE_SECONDS)
+    return Report.objects.filter(timestamp__lt=settled).order_by('-pk').values_list('pk', flat=True).first() or 0
+
+
+def roll_up(batch_size=5000):
+    """Fold every settled report above the watermark into the rollups. Returns how many were folded in."""
+    rolled_up = 0
+    settled_id = get_settled_id()
+    while True:
+        with transaction.atomic():
+            watermark, _ = Watermark.objects.select_for_update().get_or_create(name=WATERMARK)
+            pending = Report.objects.filter(pk__gt=watermark.position, pk__lte=settled_id)
+            # Fix the upper id first, so reports inserted meanwhile are left for the next batch
+            last_id = pending.order_by('pk').values_list('pk', flat=True)[batch_size - 1:batch_size].first()
+            finished = last_id is None
+            if finished:
+                last_id = pending.order_by('-pk').values_list('pk', flat=True).first()
+                if last_id is None:
+                    return rolled_up
+            rows = pending.filter(pk__lte=last_id).annotate(
+                hour=TruncHour('timestamp', tzinfo=datetime.timezone.utc)
+            ).values('restaurant', 'report_type', 'hour', 'rating').annotate(count=Count('pk')).order_by()
+
+            deltas = defaultdict(lambda: dict.fromkeys(ReportRollup.TOTAL_FIELDS, 0))
+            for row in rows:
+                _add(deltas, row['restaurant'], row['report_type'], row['hour'], row['rating'], row['count'])
+                rolled_up += row['count']
+            apply_deltas(deltas)
+            watermark.position = last_id
+            watermark.save()
+        if finished:
+            return rolled_up
+
+
+def record_change(instance, keys_and_signs):
+    """Called by app.stats when a report's stats key changes or it is deleted."""
+    if instance.pk is None or instance.pk > get_watermark():
+        # Not rolled up yet; roll_up() will see its current state
+        return
+    deltas = defaultdict(lambda: dict.fromkeys(ReportRollup.TOTAL_FIELDS, 0))
+    for (restaurant_id, report_type, rating), sign in keys_and_signs:
+        _add(deltas, restaurant_id, report_type, instance.timestamp, rating, sign)
+    with transaction.atomic():
+        apply_deltas(deltas)
+
+
+def compact(before, batch_size=5000):
+    """
+    Delete reports from before the given time that are already rolled up.
+    The running totals and rollups keep counting them. Returns how many
+    were deleted.
+    """
+    roll_up()
+    watermark = get_watermark()
+    deleted = 0
+    while True:
+        ids = list(Report.objects.filter(pk__lte=watermark, timestamp__lt=before).order_by('pk').values_list(
+            'pk', flat=True
+        )[:batch_size])
+        if not ids:
+            return deleted
+        # Raw SQL, since a queryset delete would run the signal handlers that take them out of the totals
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {Report._meta.db_table} WHERE id IN ({", ".join(["%s"] * len(ids))})', ids
+            )
+        deleted += len(ids)
+
+
+def get_rollup_totals(restaurant_ids=None):
+    """Return {(restaurant_id, report_type): (count, sum)} for everything rolled up."""
+    rollups = ReportRollup.objects.filter(period=DAY)
+    if restaurant_ids is not None:
+        rollups = rollups.filter(restaurant__in=restaurant_ids)
+    return {
+        (row['restaurant'], row['report_type']): (row['count'], row['total'])
+        for row in rollups.values('restaurant', 'report_type').annotate(
+            count=Sum('count'), total=Sum('sum')
+        ).order_by()
+    }
+
+
+def get_trend(restaurant_id, report_type, period=DAY, since=None):
+    """
+    Return the rollups for one restaurant and report type, oldest first.
+    Reports that haven't been rolled up yet aren't included.
+    """
+    rollups = ReportRollup.objects.filter(restaurant=restaurant_id, report_type=report_type, period=period)
+    if since is not None:
+        rollups = rollups.filter(start__gte=_bucket_starts(since)[period])
+    return rollups.order_by('start')
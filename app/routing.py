@@ -0,0 +1,102 @@
+"""
+Read replica routing. Views wrapped in read_from_replica send their reads
+to one of settings.DATABASE_REPLICAS for the duration of the request, held
+in a context variable so it follows the request into sync_to_async
+threads. Everything else, and every write, uses the primary.
+
+Replicas lag behind the primary, so views wrapped in pins_primary set a
+short-lived cookie after a successful POST, and that user's reads go to the
+primary until it expires, so they see their own review or report straight
+away.
+
+Entries cached under a version token are built from the primary, see
+reads_from_primary.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.template.response import SimpleTemplateResponse
+
+# The database alias reads are routed to, or None for the primary
+read_database = contextvars.ContextVar('read_database', default=None)
+
+PIN_COOKIE = 'read_primary'
+# Logins and sessions must be read back straight after they are written
+PRIMARY_ONLY_APPS = {'auth', 'sessions'}
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_ONLY_APPS or model._meta.label == settings.AUTH_USER_MODEL:
+            return None
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+def get_read_database(request):
+    if request.method not in ('GET', 'HEAD') or not settings.DATABASE_REPLICAS or PIN_COOKIE in request.COOKIES:
+        return None
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+def read_from_replica(view):
+    """Route a read-only view's queries to a replica, unless the user is pinned to the primary."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            token = read_database.set(get_read_database(request))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                read_database.reset(token)
+        return wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = read_database.set(get_read_database(request))
+        try:
+            response = view(request, *args, **kwargs)
+            # Template responses query while rendering, which would otherwise happen after the reset
+            if isinstance(response, SimpleTemplateResponse):
+                response.render()
+            return response
+        finally:
+            read_database.reset(token)
+    return wrapper
+
+
+@contextmanager
+def reads_from_primary():
+    """
+    Send reads to the primary inside the block. Anything cached under a
+    version token is built this way, since a lagging replica would store
+    old rows under the new token.
+    """
+    token = read_database.set(None)
+    try:
+        yield
+    finally:
+        read_database.reset(token)
+
+
+def pins_primary(view):
+    """Send the user's reads to the primary for a while after the view handles a POST."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if request.method == 'POST' and response.status_code < 400 and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+    return wrapper
@@ -0,0 +1,183 @@
+import re
+
+from asgiref.sync import sync_to_async
+from django.db import connections, router
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import Restaurant
+
+
+FTS_TABLE = 'app_restaurant_fts'
+SEARCH_FIELDS = ('name', 'address', 'menu_text')
+# Weight of each field when ranking matches, in SEARCH_FIELDS order
+FIELD_WEIGHTS = (10.0, 2.0, 1.0)
+
+
+def tokenize(query):
+    return re.findall(r'\w+', query.lower())
+
+
+class BasicSearchBackend:
+    """
+    Fallback for databases without a full-text index. Every token must appear
+    in one of the fields, and name matches rank first.
+    """
+
+    def __init__(self, using):
+        self.using = using
+
+    def index(self, restaurants):
+        pass
+
+    def remove(self, pks):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, offset, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+        restaurants = Restaurant.objects.using(self.using)
+        for token in tokens:
+            restaurants = restaurants.filter(
+                Q(name__icontains=token) | Q(address__icontains=token) | Q(menu_text__icontains=token)
+            )
+        restaurants = restaurants.annotate(
+            name_match=Case(When(name__icontains=tokens[0], then=Value(0)), default=Value(1),
+                            output_field=IntegerField())
+        ).order_by('name_match', 'name', 'pk')
+        return restaurants.count(), list(restaurants.values_list('pk', flat=True)[offset:offset + limit])
+
+
+class SQLiteSearchBackend(BasicSearchBackend):
+    """
+    FTS5 table keyed by restaurant id, kept in sync from the Restaurant
+    signal handlers.
+    """
+
+    def _match_expression(self, tokens):
+        # Every token is a quoted prefix query, so user input can't inject FTS syntax
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def index(self, restaurants):
+        rows = [(r.pk, r.name, r.address, r.menu_text) for r in restaurants]
+        if not rows:
+            return
+        with connections[self.using].cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, address, menu_text) VALUES (%s, %s, %s, %s)', rows
+            )
+
+    def remove(self, pks):
+        with connections[self.using].cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in pks])
+
+    def rebuild(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, address, menu_text) '
+                f'SELECT id, name, address, menu_text FROM {Restaurant._meta.db_table}'
+            )
+
+    def search(self, query, offset, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+        match = self._match_expression(tokens)
+        weights = ', '.join(str(weight) for weight in FIELD_WEIGHTS)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}), rowid LIMIT %s OFFSET %s',
+                [match, limit, offset]
+            )
+            pks = [row[0] for row in cursor.fetchall()]
+        return total, pks
+
+
+class PostgresSearchBackend(BasicSearchBackend):
+    """
+    Searches a weighted tsvector expression that has a GIN index on
+    app_restaurant, so the index never needs to be written to by hand.
+    """
+
+    @staticmethod
+    def vector_expression():
+        weights = 'ABC'
+        return ' || '.join(
+            f"setweight(to_tsvector('simple', {field}), '{weight}')"
+            for field, weight in zip(SEARCH_FIELDS, weights)
+        )
+
+    def search(self, query, offset, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        vector = self.vector_expression()
+        table = Restaurant._meta.db_table
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f"SELECT id, COUNT(*) OVER () FROM {table} "
+                f"WHERE {vector} @@ to_tsquery('simple', %s) "
+                f"ORDER BY ts_rank({vector}, to_tsquery('simple', %s)) DESC, id LIMIT %s OFFSET %s",
+                [tsquery, tsquery, limit, offset]
+            )
+            rows = cursor.fetchall()
+        if not rows:
+            # Past the last page the window count isn't available
+            return (self._count(tsquery) if offset else 0), []
+        return rows[0][1], [row[0] for row in rows]
+
+    def _count(self, tsquery):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {Restaurant._meta.db_table} "
+                f"WHERE {self.vector_expression()} @@ to_tsquery('simple', %s)",
+                [tsquery]
+            )
+            return cursor.fetchone()[0]
+
+
+_backends = {}
+
+
+def get_backend(using='default'):
+    if using not in _backends:
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            backend = PostgresSearchBackend(using)
+        elif connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+            backend = SQLiteSearchBackend(using)
+        else:
+            backend = BasicSearchBackend(using)
+        _backends[using] = backend
+    return _backends[using]
+
+
+def search_restaurants(query, page=1, page_size=20):
+    """
+    Return (total, restaurants) for one page of ranked matches. Every token
+    is treated as a prefix and all of them must match.
+    """
+    offset = (page - 1) * page_size
+    # On a replica when the view reads from one
+    using = router.db_for_read(Restaurant)
+    total, pks = get_backend(using).search(query, offset, page_size)
+    restaurants = Restaurant.objects.using(using).in_bulk(pks)
+    return total, [restaurants[pk] for pk in pks if pk in restaurants]
+
+
+async def asearch_restaurants(query, page=1, page_size=20):
+    # Picking a backend and searching both use raw connections, which have no async API
+    offset = (page - 1) * page_size
+    using = router.db_for_read(Restaurant)
+    total, pks = await sync_to_async(lambda: get_backend(using).search(query, offset, page_size))()
+    restaurants = await Restaurant.objects.using(using).ain_bulk(pks)
+    return total, [restaurants[pk] for pk in pks if pk in restaurants]
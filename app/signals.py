@@ -0,0 +1,143 @@
+from django.contrib.auth.models import Group
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import caching, menus, search, stats
+from .instrumentation import record_query
+from .models import RejectionMessage, Report, Restaurant, RestaurantRequest, Review, User
+from .notifications import messages_changed
+from .permissions import user_groups_version
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=Report)
+def record_rating_saved(sender, instance, created, raw=False, **kwargs):
+    # Fixtures are loaded raw; run rebuild_restaurant_stats afterwards
+    if raw:
+        return
+    stats.record_save(instance, created)
+
+
+def is_restaurant_delete(origin):
+    # Rows cascading from a deleted restaurant take its totals, baselines and rollups with them
+    return isinstance(origin, Restaurant) or (isinstance(origin, QuerySet) and origin.model is Restaurant)
+
+
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=Report)
+def record_rating_deleted(sender, instance, origin=None, **kwargs):
+    if is_restaurant_delete(origin):
+        return
+    stats.record_delete(instance)
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_restaurant_map(sender, **kwargs):
+    caching.bump_version(caching.RESTAURANT_MAP)
+
+
+@receiver(post_save, sender=Restaurant)
+def invalidate_moved_restaurant_locations(sender, instance, created, **kwargs):
+    location = (instance.latitude, instance.longitude)
+    if not created and getattr(instance, '_location_snapshot', None) == location:
+        return
+    instance._location_snapshot = location
+    caching.bump_version(caching.RESTAURANT_LOCATIONS)
+
+
+@receiver(post_delete, sender=Restaurant)
+def invalidate_restaurant_locations(sender, **kwargs):
+    caching.bump_version(caching.RESTAURANT_LOCATIONS)
+
+
+def get_cache_tags(instance):
+    """Return the version tags a write to instance invalidates."""
+    if isinstance(instance, Restaurant):
+        restaurant_id, user_id = instance.pk, None
+    elif isinstance(instance, RestaurantRequest):
+        restaurant_id, user_id = instance.corresponding_restaurant_id, instance.requester_id
+    else:
+        restaurant_id, user_id = instance.restaurant_id, instance.user_id
+    tags = [caching.model_version(type(instance))]
+    if restaurant_id is not None:
+        tags.append(caching.restaurant_version(restaurant_id))
+    if user_id is not None:
+        tags.append(caching.user_version(user_id))
+    return tags
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=Report)
+@receiver(post_delete, sender=Report)
+@receiver(post_save, sender=RestaurantRequest)
+@receiver(post_delete, sender=RestaurantRequest)
+def invalidate_cache_tags(sender, instance, **kwargs):
+    caching.bump_versions(get_cache_tags(instance))
+
+
+@receiver(post_save, sender=Restaurant)
+def index_restaurant(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and not set(update_fields) & set(search.SEARCH_FIELDS)):
+        return
+    search.get_backend(kwargs['using']).index([instance])
+
+
+@receiver(post_save, sender=Restaurant)
+def index_menu(sender, instance, created, raw=False, **kwargs):
+    if raw or (not created and getattr(instance, '_menu_snapshot', None) == instance.menu_text):
+        return
+    menus.index_menus([instance])
+
+
+@receiver(post_delete, sender=Restaurant)
+def unindex_restaurant(sender, instance, **kwargs):
+    search.get_backend(kwargs['using']).remove([instance.pk])
+
+
+def invalidate_admin_scopes(user_ids):
+    for user_id in user_ids:
+        caching.bump_version(user_groups_version(user_id))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # user.groups.add/remove/clear
+        if action.startswith('post_'):
+            invalidate_admin_scopes([instance.pk])
+    elif action == 'pre_clear':
+        # group.user_set.clear() doesn't say which users it removed
+        instance._cleared_user_ids = list(instance.user_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        invalidate_admin_scopes(getattr(instance, '_cleared_user_ids', []))
+    elif action.startswith('post_'):
+        invalidate_admin_scopes(pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, created=False, raw=False, **kwargs):
+    # A renamed or deleted group changes the scope of everyone in it
+    if created or raw:
+        return
+    invalidate_admin_scopes(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=RejectionMessage)
+@receiver(post_delete, sender=RejectionMessage)
+def invalidate_unread_count(sender, instance, **kwargs):
+    messages_changed([instance.recipient_id])
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
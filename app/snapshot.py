@@ -0,0 +1,213 @@
+"""
+Prebuilt map snapshot: every restaurant's marker data as one columnar JSON
+file with a content-hashed name, precompressed and served by WhiteNoise
+with far-future cache headers. Pages link to the current file, so browsers
+and CDNs only fetch it again when its content changes.
+
+Pages never wait for a build: they link to the last snapshot written, and
+when it is out of date a background thread rebuilds it. Before the first
+build, pages load markers from the map endpoint instead.
+
+Snapshots are on each web dyno's own disk, so a page rendered on one can
+link a file another doesn't have, or that a restart wiped. Those requests
+are answered with the current restaurants, uncached, and start a build.
+"""
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import caching
+from .models import Restaurant
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MANIFEST_NAME = 'map-snapshot.json'
+SNAPSHOT_PREFIX = 'restaurants.'
+# Older snapshots stay around so pages rendered just before a rebuild still work
+KEEP_SNAPSHOTS = 5
+
+_manifest = {'key': None, 'value': None}
+# Held while this process has a rebuild running
+_rebuilding = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def get_snapshot_dir():
+    directory = Path(settings.MAP_SNAPSHOT_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def serialize_snapshot(restaurants):
+    columns = {'id': [], 'name': [], 'address': [], 'contact_info': [], 'lat': [], 'lng': [], 'rating': []}
+    for restaurant in restaurants:
+        columns['id'].append(restaurant.pk)
+        columns['name'].append(restaurant.name)
+        columns['address'].append(restaurant.address)
+        columns['contact_info'].append(restaurant.contact_info)
+        columns['lat'].append(restaurant.latitude)
+        columns['lng'].append(restaurant.longitude)
+        columns['rating'].append(restaurant.get_average_rating())
+    return json.dumps(columns, separators=(',', ':')).encode()
+
+
+def _write(path, data):
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_bytes(data)
+    os.replace(temporary, path)
+
+
+def get_snapshot_data():
+    return serialize_snapshot(Restaurant.objects.only(
+        'pk', 'name', 'address', 'contact_info', 'latitude', 'longitude', 'review_count', 'review_sum'
+    ).order_by('pk'))
+
+
+def build_snapshot():
+    """Write a snapshot of the current restaurants and point the manifest at it. Returns the manifest."""
+    directory = get_snapshot_dir()
+    # Read before the data, so a change made during the build triggers another one
+    version = caching.get_version(caching.RESTAURANT_MAP)
+    data = get_snapshot_data()
+    name = f'{SNAPSHOT_PREFIX}{hashlib.sha256(data).hexdigest()[:16]}.json'
+
+    path = directory / name
+    if not path.exists():
+        # Compressed variants first, so WhiteNoise never sees the file without them
+        _write(path.with_name(name + '.gz'), gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(path.with_name(name + '.br'), brotli.compress(data))
+        _write(path, data)
+
+    manifest = {'name': name, 'version': version, 'built_at': time.time()}
+    _write(directory / MANIFEST_NAME, json.dumps(manifest).encode())
+    _prune(directory, name)
+    return manifest
+
+
+def _prune(directory, current):
+    snapshots = sorted(directory.glob(SNAPSHOT_PREFIX + '*.json'), key=lambda path: path.stat().st_mtime)
+    for path in snapshots[:-KEEP_SNAPSHOTS]:
+        if path.name == current:
+            continue
+        for variant in (path, path.with_name(path.name + '.gz'), path.with_name(path.name + '.br')):
+            variant.unlink(missing_ok=True)
+
+
+def read_manifest():
+    path = get_snapshot_dir() / MANIFEST_NAME
+    try:
+        key = (path, path.stat().st_mtime_ns)
+    except FileNotFoundError:
+        return None
+    if _manifest['key'] != key:
+        _manifest['value'] = json.loads(path.read_bytes())
+        _manifest['key'] = key
+    return _manifest['value']
+
+
+def rebuild_snapshot():
+    """Build a snapshot unless another process is already building one."""
+    directory = get_snapshot_dir()
+    with open(directory / 'build.lock', 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            return build_snapshot()
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _rebuild_in_background():
+    try:
+        rebuild_snapshot()
+    except Exception:
+        logger.exception('Map snapshot rebuild failed')
+    finally:
+        connections.close_all()
+        _rebuilding.release()
+
+
+def start_rebuild():
+    """Rebuild the snapshot in a background thread. Returns the thread, or None if one is already running."""
+    if not _rebuilding.acquire(blocking=False):
+        return None
+    thread = threading.Thread(target=_rebuild_in_background, name='map-snapshot', daemon=True)
+    thread.start()
+    return thread
+
+
+def get_snapshot_url():
+    """
+    Return the URL of the last snapshot built, or None before the first one.
+    Changes to restaurants or ratings start a rebuild at most once every
+    MAP_SNAPSHOT_DEBOUNCE seconds.
+    """
+    manifest = read_manifest()
+    outdated = manifest is None or (
+        manifest['version'] != caching.get_version(caching.RESTAURANT_MAP)
+        and time.time() - manifest['built_at'] >= settings.MAP_SNAPSHOT_DEBOUNCE
+    )
+    if outdated and settings.MAP_SNAPSHOT_AUTO_REBUILD:
+        start_rebuild()
+    if manifest is None:
+        return None
+    return settings.MAP_SNAPSHOT_URL + manifest['name']
+
+
+class SnapshotWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, plus map snapshots that are written after startup. Their
+    names are content hashes, so they are cached forever.
+    """
+
+    def __call__(self, request):
+        path = request.path_info
+        if not path.startswith(settings.MAP_SNAPSHOT_URL):
+            return super().__call__(request)
+        name = path[len(settings.MAP_SNAPSHOT_URL):]
+        if '/' in name or not name.startswith(SNAPSHOT_PREFIX) or not name.endswith('.json'):
+            return self.get_response(request)
+        file_path = Path(settings.MAP_SNAPSHOT_DIR) / name
+        if not file_path.exists():
+            # Built on another dyno, or pruned or wiped here
+            self.files.pop(path, None)
+            if settings.MAP_SNAPSHOT_AUTO_REBUILD:
+                start_rebuild()
+            response = HttpResponse(get_snapshot_data(), content_type='application/json')
+            patch_cache_control(response, no_cache=True)
+            return response
+        if path not in self.files:
+            self._forget_pruned()
+            self.add_file_to_dictionary(path, str(file_path))
+        return self.serve(self.files[path], request)
+
+    def _forget_pruned(self):
+        directory = Path(settings.MAP_SNAPSHOT_DIR)
+        for path in [path for path in self.files if path.startswith(settings.MAP_SNAPSHOT_URL)]:
+            if not (directory / path[len(settings.MAP_SNAPSHOT_URL):]).exists():
+                del self.files[path]
+
+    def immutable_file_test(self, path, url):
+        if url.startswith(settings.MAP_SNAPSHOT_URL):
+            return True
+        return super().immutable_file_test(path, url)
@@ -0,0 +1,125 @@
+import heapq
+import math
+import threading
+
+from . import caching
+from .models import Restaurant
+from .routing import reads_from_primary
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_unit_vector(latitude, longitude):
+    lat = math.radians(latitude)
+    lng = math.radians(longitude)
+    return (math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat))
+
+
+def chord_to_km(chord_squared):
+    # Straight-line distance through the sphere -> great-circle (haversine) distance
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+
+
+class SphereKDTree:
+    """
+    Static 3-d tree over points on the unit sphere. Chord length is monotonic
+    in great-circle distance, so plain Euclidean nearest neighbours in 3-d are
+    the nearest neighbours on the globe.
+    """
+
+    def __init__(self, points):
+        # points is a list of (key, latitude, longitude)
+        self.keys = [key for key, _, _ in points]
+        vectors = [to_unit_vector(latitude, longitude) for _, latitude, longitude in points]
+        self.xs = [v[0] for v in vectors]
+        self.ys = [v[1] for v in vectors]
+        self.zs = [v[2] for v in vectors]
+        # Node at position mid of a (lo, hi) range holds point order[mid] and splits on axes[mid]
+        self.order = list(range(len(points)))
+        self.axes = [0] * len(points)
+        self._build(0, len(points))
+
+    def _build(self, lo, hi):
+        stack = [(lo, hi)]
+        coordinates = (self.xs, self.ys, self.zs)
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= 1:
+                continue
+            indexes = self.order[lo:hi]
+            # Split on the axis with the widest spread
+            spreads = [max(c[i] for i in indexes) - min(c[i] for i in indexes) for c in coordinates]
+            axis = spreads.index(max(spreads))
+            values = coordinates[axis]
+            indexes.sort(key=values.__getitem__)
+            self.order[lo:hi] = indexes
+            mid = (lo + hi) // 2
+            self.axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def nearest(self, latitude, longitude, k):
+        """Return [(key, distance_km), ...] for the k nearest points, closest first."""
+        if k <= 0 or not self.keys:
+            return []
+        query = to_unit_vector(latitude, longitude)
+        qx, qy, qz = query
+        xs, ys, zs, order, axes = self.xs, self.ys, self.zs, self.order, self.axes
+        coordinates = (xs, ys, zs)
+
+        best = []  # max-heap of (-distance_squared, point)
+        stack = [(0, len(order), 0.0)]
+        while stack:
+            lo, hi, bound = stack.pop()
+            if lo >= hi or (len(best) == k and bound >= -best[0][0]):
+                continue
+            mid = (lo + hi) // 2
+            point = order[mid]
+            dx = xs[point] - qx
+            dy = ys[point] - qy
+            dz = zs[point] - qz
+            distance = dx * dx + dy * dy + dz * dz
+            if len(best) < k:
+                heapq.heappush(best, (-distance, point))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, point))
+
+            axis = axes[mid]
+            diff = query[axis] - coordinates[axis][point]
+            if diff < 0:
+                near, far = (lo, mid), (mid + 1, hi)
+            else:
+                near, far = (mid + 1, hi), (lo, mid)
+            # Visit the near side first; the far side only if the split plane is close enough
+            stack.append((far[0], far[1], diff * diff))
+            stack.append((near[0], near[1], 0.0))
+
+        return [(self.keys[point], chord_to_km(-negative)) for negative, point in sorted(best, reverse=True)]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_nearest_index():
+    """
+    Return the process-wide tree of restaurant locations, rebuilding it when
+    the restaurant set has changed since it was built.
+    """
+    global _index, _index_version
+    version = caching.get_version(caching.RESTAURANT_LOCATIONS)
+    if _index_version != version:
+        with _index_lock:
+            if _index_version != version:
+                with reads_from_primary():
+                    points = list(Restaurant.objects.values_list('pk', 'latitude', 'longitude').iterator(
+                        chunk_size=2000
+                    ))
+                _index = SphereKDTree(points)
+                _index_version = version
+    return _index
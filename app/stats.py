@@ -0,0 +1,309 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FloatField, Sum, Value
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+from django.utils import timezone
+
+from . import caching, rollups
+from .models import (
+    CROWDEDNESS_HALF_LIFE, RATING_PRIOR_MEAN, RATING_PRIOR_WEIGHT, CrowdednessBaseline, Report, ReportRollup,
+    Restaurant, crowdedness_decay, get_hour_of_week,
+)
+
+CROWDEDNESS = Report.ReportType.CROWDEDNESS
+
+
+def get_stat_prefix(report_type):
+    # Reviews are tracked with a report type of None
+    if report_type is None:
+        return 'review'
+    return Restaurant.REPORT_STAT_PREFIXES[report_type]
+
+
+def _score_expression(prefix, count, total):
+    # Computed from the pre-update totals plus the change, in the same UPDATE
+    prior = Value(RATING_PRIOR_WEIGHT * RATING_PRIOR_MEAN, output_field=FloatField())
+    return (prior + F(prefix + '_sum') + total) / (RATING_PRIOR_WEIGHT + F(prefix + '_count') + count)
+
+
+def apply_deltas(deltas, loaded_restaurants=()):
+    """
+    Apply {(restaurant_id, report_type): (count, total)} to the running totals
+    and leaderboard scores with one F() UPDATE per restaurant.
+    """
+    updates = defaultdict(dict)
+    for (restaurant_id, report_type), (count, total) in deltas.items():
+        if count == 0 and total == 0:
+            continue
+        prefix = get_stat_prefix(report_type)
+        updates[restaurant_id][prefix] = (count, total)
+
+    for restaurant_id, changes in updates.items():
+        values = {}
+        for prefix, (count, total) in changes.items():
+            values[prefix + '_count'] = F(prefix + '_count') + count
+            values[prefix + '_sum'] = F(prefix + '_sum') + total
+            values[prefix + '_score'] = _score_expression(prefix, count, total)
+        Restaurant.objects.filter(pk=restaurant_id).update(**values)
+
+    # Keep already loaded restaurants in step so they can be read straight away
+    for restaurant in loaded_restaurants:
+        for prefix, (count, total) in updates.get(restaurant.pk, {}).items():
+            setattr(restaurant, prefix + '_count', getattr(restaurant, prefix + '_count') + count)
+            setattr(restaurant, prefix + '_sum', getattr(restaurant, prefix + '_sum') + total)
+        if restaurant.pk in updates:
+            restaurant.update_scores()
+
+
+def apply_crowdedness_points(restaurant_id, points):
+    """
+    Add (timestamp, rating, sign) crowdedness reports to a restaurant's
+    decayed state. A sign of -1 takes back a report that was added earlier,
+    which is exact because every report's decay factor is known.
+    """
+    with transaction.atomic():
+        state = Restaurant.objects.select_for_update().filter(pk=restaurant_id).values_list(
+            'crowdedness_decayed_sum', 'crowdedness_decayed_weight', 'crowdedness_decayed_at'
+        ).first()
+        if state is None:
+            return
+        total, weight, decayed_at = state
+
+        # Move the state forward to the newest timestamp involved, then decay each point to it
+        timestamps = [timestamp for timestamp, _, _ in points]
+        if decayed_at is not None:
+            timestamps.append(decayed_at)
+        latest = max(timestamps)
+        if decayed_at is not None:
+            decay = crowdedness_decay(latest - decayed_at)
+            total *= decay
+            weight *= decay
+        for timestamp, rating, sign in points:
+            decay = crowdedness_decay(latest - timestamp)
+            total += sign * rating * decay
+            weight += sign * decay
+        # Taking back every report leaves floating point dust behind
+        if weight <= 1e-9:
+            total = weight = 0.0
+
+        Restaurant.objects.filter(pk=restaurant_id).update(
+            crowdedness_decayed_sum=total, crowdedness_decayed_weight=weight, crowdedness_decayed_at=latest,
+        )
+
+
+def apply_baseline_deltas(deltas):
+    """Apply {(restaurant_id, hour_of_week): (count, total)} to the baselines."""
+    for (restaurant_id, hour_of_week), (count, total) in deltas.items():
+        if count == 0 and total == 0:
+            continue
+        baselines = CrowdednessBaseline.objects.filter(restaurant_id=restaurant_id, hour_of_week=hour_of_week)
+        if baselines.update(count=F('count') + count, sum=F('sum') + total) or count < 0:
+            continue
+        try:
+            with transaction.atomic():
+                CrowdednessBaseline.objects.create(
+                    restaurant_id=restaurant_id, hour_of_week=hour_of_week, count=count, sum=total
+                )
+        except IntegrityError:
+            # Another report created the row first
+            baselines.update(count=F('count') + count, sum=F('sum') + total)
+
+
+def _record_crowdedness(instance, keys_and_signs):
+    points = defaultdict(list)
+    baseline_deltas = {}
+    hour_of_week = get_hour_of_week(instance.timestamp)
+    for (restaurant_id, report_type, rating), sign in keys_and_signs:
+        if report_type != CROWDEDNESS:
+            continue
+        points[restaurant_id].append((instance.timestamp, rating, sign))
+        count, total = baseline_deltas.get((restaurant_id, hour_of_week), (0, 0))
+        baseline_deltas[(restaurant_id, hour_of_week)] = (count + sign, total + sign * rating)
+    for restaurant_id, restaurant_points in points.items():
+        apply_crowdedness_points(restaurant_id, restaurant_points)
+    apply_baseline_deltas(baseline_deltas)
+
+
+def _current_baselines(now, restaurant_ids):
+    baselines = CrowdednessBaseline.objects.filter(hour_of_week=get_hour_of_week(now or timezone.now()))
+    if restaurant_ids is not None:
+        baselines = baselines.filter(restaurant__in=restaurant_ids)
+    return baselines
+
+
+def get_current_baselines(now=None, restaurant_ids=None):
+    """Return {restaurant_id: CrowdednessBaseline} for the current hour of the week."""
+    return {baseline.restaurant_id: baseline for baseline in _current_baselines(now, restaurant_ids)}
+
+
+async def aget_current_baselines(now=None, restaurant_ids=None):
+    return {baseline.restaurant_id: baseline async for baseline in _current_baselines(now, restaurant_ids)}
+
+
+def _add_delta(deltas, key, sign):
+    restaurant_id, report_type, rating = key
+    count, total = deltas.get((restaurant_id, report_type), (0, 0))
+    deltas[(restaurant_id, report_type)] = (count + sign, total + sign * rating)
+
+
+def _loaded_restaurants(instance):
+    if instance._meta.get_field('restaurant').is_cached(instance):
+        return [instance.restaurant]
+    return []
+
+
+def record_save(instance, created):
+    new_key = instance.get_stats_key()
+    old_key = None if created else getattr(instance, '_stats_snapshot', None)
+
+    if not created and old_key is None:
+        # Saved without ever being loaded, so there is nothing to diff against
+        rebuild_restaurant_stats([instance.restaurant_id])
+    elif old_key != new_key:
+        deltas = {}
+        if old_key is not None:
+            _add_delta(deltas, old_key, -1)
+        _add_delta(deltas, new_key, 1)
+        apply_deltas(deltas, _loaded_restaurants(instance))
+        if isinstance(instance, Report):
+            keys_and_signs = [(old_key, -1), (new_key, 1)] if old_key is not None else [(new_key, 1)]
+            _record_crowdedness(instance, keys_and_signs)
+            rollups.record_change(instance, keys_and_signs)
+
+    instance._stats_snapshot = new_key
+
+
+def record_delete(instance):
+    key = getattr(instance, '_stats_snapshot', None) or instance.get_stats_key()
+    deltas = {}
+    _add_delta(deltas, key, -1)
+    apply_deltas(deltas, _loaded_restaurants(instance))
+    if isinstance(instance, Report):
+        _record_crowdedness(instance, [(key, -1)])
+        rollups.record_change(instance, [(key, -1)])
+
+
+def record_bulk_create(reports):
+    """
+    Account for reports inserted with bulk_create, which skips the signals,
+    with one update per restaurant for the whole batch.
+    """
+    deltas = {}
+    points = defaultdict(list)
+    baseline_deltas = {}
+    for report in reports:
+        key = report.get_stats_key()
+        _add_delta(deltas, key, 1)
+        report._stats_snapshot = key
+        if report.report_type == CROWDEDNESS:
+            points[report.restaurant_id].append((report.timestamp, report.rating, 1))
+            baseline_key = (report.restaurant_id, get_hour_of_week(report.timestamp))
+            count, total = baseline_deltas.get(baseline_key, (0, 0))
+            baseline_deltas[baseline_key] = (count + 1, total + report.rating)
+
+    apply_deltas(deltas)
+    for restaurant_id, restaurant_points in points.items():
+        apply_crowdedness_points(restaurant_id, restaurant_points)
+    apply_baseline_deltas(baseline_deltas)
+    caching.bump_versions([
+        caching.model_version(Report),
+        *{caching.restaurant_version(report.restaurant_id) for report in reports},
+        *{caching.user_version(report.user_id) for report in reports},
+    ])
+
+
+def rebuild_restaurant_stats(restaurant_ids=None, batch_size=500):
+    """
+    Recompute the running totals from the Review table, and from the report
+    rollups plus the reports that haven't been rolled up yet, since rolled
+    up reports may have been compacted away. Returns the number of
+    restaurants that were rewritten.
+    """
+    watermark = rollups.get_watermark()
+    restaurants = Restaurant.objects.only('pk').with_report_summary(reports_after=watermark).order_by('pk')
+    if restaurant_ids is not None:
+        restaurants = restaurants.filter(pk__in=restaurant_ids)
+    rolled_up = rollups.get_rollup_totals(restaurant_ids) if watermark else {}
+
+    rebuilt = 0
+    batch = []
+    for restaurant in restaurants.iterator(chunk_size=batch_size):
+        for name in Restaurant.TOTAL_FIELDS:
+            setattr(restaurant, name, getattr(restaurant, 'summary_' + name))
+        for report_type, prefix in Restaurant.REPORT_STAT_PREFIXES.items():
+            count, total = rolled_up.get((restaurant.pk, report_type), (0, 0))
+            setattr(restaurant, prefix + '_count', getattr(restaurant, prefix + '_count') + count)
+            setattr(restaurant, prefix + '_sum', getattr(restaurant, prefix + '_sum') + total)
+        batch.append(restaurant)
+        if len(batch) >= batch_size:
+            _write_totals(batch)
+            rebuilt += len(batch)
+            batch = []
+    if batch:
+        _write_totals(batch)
+        rebuilt += len(batch)
+    return rebuilt
+
+
+def _write_totals(restaurants):
+    for restaurant in restaurants:
+        restaurant.update_scores()
+    Restaurant.objects.bulk_update(restaurants, Restaurant.TOTAL_FIELDS + Restaurant.SCORE_FIELDS)
+    caching.bump_versions([
+        caching.model_version(Restaurant), *(caching.restaurant_version(restaurant.pk) for restaurant in restaurants),
+    ])
+
+
+def rebuild_crowdedness(restaurant_ids=None, now=None):
+    """
+    Recompute the hour-of-week baselines from the hourly report rollups and
+    the reports that haven't been rolled up yet, and the decayed live state
+    from the Report table. Reports older than 20 half-lives no longer matter
+    to the live state, so only recent ones are replayed.
+    """
+    now = now or timezone.now()
+    watermark = rollups.get_watermark()
+    reports = Report.objects.filter(report_type=CROWDEDNESS)
+    hourly_rollups = ReportRollup.objects.filter(report_type=CROWDEDNESS, period=ReportRollup.Period.HOUR)
+    baselines = CrowdednessBaseline.objects.all()
+    restaurants = Restaurant.objects.all()
+    if restaurant_ids is not None:
+        reports = reports.filter(restaurant__in=restaurant_ids)
+        hourly_rollups = hourly_rollups.filter(restaurant__in=restaurant_ids)
+        baselines = baselines.filter(restaurant__in=restaurant_ids)
+        restaurants = restaurants.filter(pk__in=restaurant_ids)
+
+    totals = defaultdict(lambda: [0, 0])
+    hourly = reports.filter(pk__gt=watermark).annotate(
+        weekday=ExtractIsoWeekDay('timestamp'), hour=ExtractHour('timestamp')
+    ).values('restaurant', 'weekday', 'hour').annotate(count=Count('pk'), total=Sum('rating')).order_by()
+    for row in hourly:
+        key = (row['restaurant'], (row['weekday'] - 1) * 24 + row['hour'])
+        totals[key][0] += row['count']
+        totals[key][1] += row['total']
+    if watermark:
+        for restaurant_id, start, count, total in hourly_rollups.values_list(
+            'restaurant', 'start', 'count', 'sum'
+        ).iterator():
+            key = (restaurant_id, get_hour_of_week(start))
+            totals[key][0] += count
+            totals[key][1] += total
+    with transaction.atomic():
+        baselines.delete()
+        CrowdednessBaseline.objects.bulk_create([
+            CrowdednessBaseline(restaurant_id=restaurant_id, hour_of_week=hour_of_week, count=count, sum=total)
+            for (restaurant_id, hour_of_week), (count, total) in totals.items() if count
+        ], batch_size=500)
+
+    states = defaultdict(lambda: [0.0, 0.0])
+    recent = reports.filter(timestamp__gte=now - 20 * CROWDEDNESS_HALF_LIFE)
+    for restaurant_id, timestamp, rating in recent.values_list('restaurant', 'timestamp', 'rating').iterator():
+        decay = crowdedness_decay(now - timestamp)
+        states[restaurant_id][0] += rating * decay
+        states[restaurant_id][1] += decay
+    restaurants.update(crowdedness_decayed_sum=0, crowdedness_decayed_weight=0, crowdedness_decayed_at=None)
+    for restaurant_id, (total, weight) in states.items():
+        Restaurant.objects.filter(pk=restaurant_id).update(
+            crowdedness_decayed_sum=total, crowdedness_decayed_weight=weight, crowdedness_decayed_at=now,
+        )
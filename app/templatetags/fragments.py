@@ -0,0 +1,42 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from app import caching
+
+register = template.Library()
+
+
+class RestaurantFragmentNode(template.Node):
+    def __init__(self, nodelist, fragment_name, restaurant_id, vary_on):
+        self.nodelist = nodelist
+        self.fragment_name = fragment_name
+        self.restaurant_id = restaurant_id
+        self.vary_on = vary_on
+
+    def render(self, context):
+        restaurant_id = self.restaurant_id.resolve(context)
+        vary_on = [restaurant_id] + [var.resolve(context) for var in self.vary_on]
+        key = make_template_fragment_key(self.fragment_name, vary_on)
+        return caching.get_fragment(
+            caching.restaurant_version(restaurant_id), key, lambda: self.nodelist.render(context)
+        )
+
+
+@register.tag
+def restaurantfragment(parser, token):
+    """
+    Cache the enclosed template until the restaurant changes:
+
+        {% restaurantfragment "menu" restaurant.pk [vary_on ...] %}
+            ...
+        {% endrestaurantfragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment name and a restaurant id")
+    fragment_name = bits[1].strip('"\'')
+    nodelist = parser.parse(('endrestaurantfragment',))
+    parser.delete_first_token()
+    return RestaurantFragmentNode(
+        nodelist, fragment_name, parser.compile_filter(bits[2]), [parser.compile_filter(bit) for bit in bits[3:]]
+    )
@@ -1,8 +1,48 @@
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
 from django.forms import ValidationError
-from django.test import TestCase, Client
+from django.core.management import call_command
+from django.core.cache import cache, caches
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, Client, override_settings
+from django.db import connection, router
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
+from allauth.socialaccount.models import SocialApp
+from django.contrib.sites.models import Site
+
+from app import bench, caching, leaderboard, rollups, snapshot, writebehind
+from app.caching import get_fragment_stats
+from app.duplicates import find_duplicates, get_duplicates
+from app.geo import encode_geohash
+from app.instrumentation import RequestTimingMiddleware
+from app.menus import search_dishes
 from app.models import *
+from app.notifications import get_unread_count, mark_read
+from app.pagination import encode_cursor
+from app.permissions import get_admin_scope
+from app.routing import PIN_COOKIE, read_database, read_from_replica
+from app.search import search_restaurants
+from app.stats import rebuild_crowdedness, rebuild_restaurant_stats
+from app.views import REQUEST_PAGE_SIZE
+
+
+def create_google_app():
+    # base.html renders the Google sign in link for anonymous visitors
+    google = SocialApp.objects.create(provider='google', name='Google', client_id='id', secret='secret')
+    google.sites.add(Site.objects.get_current())
 
 
 class RestaurantMenuTestCase(TestCase):
@@ -68,6 +108,50 @@ class RestaurantRequestTestCase(TestCase):
             RestaurantRequest.objects.get(name="RequestedRestaurant")
 
 
+class DuplicateDetectionTests(TestCase):
+    def setUp(self):
+        create_google_app()
+        self.bodos = Restaurant.objects.create(name="Bodo's Bagels", address='A', latitude=38.0340, longitude=-78.5000)
+        Restaurant.objects.create(name='The Bodos Bagel Bakery', address='B', latitude=38.0350, longitude=-78.5000)
+        Restaurant.objects.create(name='Crozet Pizza', address='C', latitude=38.0340, longitude=-78.5001)
+        # Same name, but a few kilometres away
+        Restaurant.objects.create(name='Bodos Bagels', address='D', latitude=38.0700, longitude=-78.5000)
+
+    def new_request(self, name, latitude=38.0341, longitude=-78.5000):
+        return RestaurantRequest(name=name, address='E', latitude=latitude, longitude=longitude)
+
+    def test_ranks_nearby_similar_names(self):
+        matches = find_duplicates(self.new_request('BODOS BAGELS'))
+        self.assertEqual([match.name for match in matches], ["Bodo's Bagels", 'The Bodos Bagel Bakery'])
+        self.assertEqual(matches[0].similarity, 1.0)
+        self.assertEqual(find_duplicates(self.new_request('Sushi Bar')), [])
+
+    def test_one_query_for_a_page_of_requests(self):
+        requests = [
+            RestaurantRequest.objects.create(name='Bodos', address='E', latitude=38.0341, longitude=-78.5),
+            RestaurantRequest.objects.create(name='Kiosk', address='F', latitude=-10, longitude=179.9999),
+            RestaurantRequest.objects.create(name='Crozet Pizza', address='G', latitude=38.0341, longitude=-78.5),
+        ]
+        Restaurant.objects.create(name='Kiosk', address='H', latitude=-10, longitude=-179.9999)
+        with self.assertNumQueries(1):
+            duplicates = get_duplicates(requests)
+        self.assertEqual([m.name for m in duplicates[requests[0].pk]], ["Bodo's Bagels", 'The Bodos Bagel Bakery'])
+        # Across the antimeridian
+        self.assertEqual([m.name for m in duplicates[requests[1].pk]], ['Kiosk'])
+        self.assertEqual([m.name for m in duplicates[requests[2].pk]], ['Crozet Pizza'])
+
+    def test_submission_warns_before_saving_a_duplicate(self):
+        self.client.force_login(User.objects.create(email='test_user@email.com'))
+        data = {'name': 'Bodos Bagels', 'address': 'E', 'latitude': 38.0341, 'longitude': -78.5, 'contact_info': 'x'}
+        response = self.client.post(reverse('app:create_request'), data)
+        self.assertContains(response, 'might already be on HoosHungry')
+        self.assertFalse(RestaurantRequest.objects.exists())
+
+        response = self.client.post(reverse('app:create_request'), {**data, 'confirm_new': '1'})
+        self.assertRedirects(response, reverse('app:create_request') + '?success=True', fetch_redirect_response=False)
+        self.assertTrue(RestaurantRequest.objects.exists())
+
+
 class ReviewTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create(email='test_user@email.com')
@@ -102,6 +186,39 @@ class ReviewTestCase(TestCase):
         self.review.delete()
         self.assertEqual(self.restaurant.get_average_rating(), 1)
 
+    def test_edited_review_updates_stats(self):
+        review = Review.objects.get(pk=self.review.pk)
+        review.rating = 3
+        review.save()
+        restaurant = Restaurant.objects.get(pk=self.restaurant.pk)
+        self.assertEqual((restaurant.review_count, restaurant.review_sum), (1, 3))
+
+        other = Restaurant.objects.create(
+            name='Other Restaurant',
+            address='Other Address',
+            latitude=40.0000,
+            longitude=-75.0000,
+            contact_info='2222222222'
+        )
+        review.restaurant = other
+        review.save()
+        self.assertEqual(Restaurant.objects.get(pk=self.restaurant.pk).get_average_rating(), "N/A")
+        self.assertEqual(Restaurant.objects.get(pk=other.pk).get_average_rating(), 3)
+
+    def test_restaurant_save_keeps_stats(self):
+        stale = Restaurant.objects.get(pk=self.restaurant.pk)
+        Review.objects.create(user=self.user, restaurant=self.restaurant, rating=1, review_text='Meh')
+        stale.name = 'Renamed Restaurant'
+        stale.save()
+        restaurant = Restaurant.objects.get(pk=self.restaurant.pk)
+        self.assertEqual(restaurant.name, 'Renamed Restaurant')
+        self.assertEqual((restaurant.review_count, restaurant.review_sum), (2, 6))
+
+    def test_rebuild_restaurant_stats(self):
+        Restaurant.objects.filter(pk=self.restaurant.pk).update(review_count=0, review_sum=0)
+        call_command('rebuild_restaurant_stats', stdout=StringIO())
+        self.assertEqual(Restaurant.objects.get(pk=self.restaurant.pk).get_average_rating(), 5)
+
 
 class ReportTestCase(TestCase):
     def setUp(self):
@@ -142,6 +259,24 @@ class ReportTestCase(TestCase):
         self.report.delete()
         self.assertEqual(self.restaurant.get_average_cleanliness(), 1)
 
+    def test_report_summary(self):
+        Report.objects.create(
+            user=self.user,
+            restaurant=self.restaurant,
+            rating=2,
+            report_type=Report.ReportType.CROWDEDNESS,
+        )
+        Review.objects.create(user=self.user, restaurant=self.restaurant, rating=4, review_text='Good')
+        summary = Restaurant.objects.get(pk=self.restaurant.pk).get_report_summary()
+        self.assertEqual((summary.cleanliness, summary.cleanliness_count), (5, 1))
+        self.assertEqual((summary.crowdedness, summary.crowdedness_count), (2, 1))
+        self.assertEqual(summary.friendliness, "N/A")
+        self.assertEqual((summary.rating, summary.rating_count), (4, 1))
+
+        with self.assertNumQueries(1):
+            live = Restaurant.objects.with_report_summary().get(pk=self.restaurant.pk).get_report_summary()
+        self.assertEqual(live, summary)
+
 
 class ReadMessagesTests(TestCase):
 
@@ -164,3 +299,1119 @@ class ReadMessagesTests(TestCase):
         # Verify that all messages are now read
         messages = RejectionMessage.objects.filter(recipient=self.user)
         self.assertTrue(all(message.read for message in messages))
+
+    def test_unread_count_is_cached_until_messages_change(self):
+        cache.clear()
+        self.assertEqual(get_unread_count(self.user), 2)
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count(user), 2)
+        RejectionMessage.objects.create(recipient=self.user, message="Message 4")
+        self.assertEqual(get_unread_count(self.fresh_user()), 3)
+        mark_read(self.user)
+        self.assertEqual(get_unread_count(self.fresh_user()), 0)
+
+    def fresh_user(self):
+        # get_unread_count also memoises on the user object, like request.user for one request
+        return get_user_model().objects.get(pk=self.user.pk)
+
+    def test_inbox_pages_and_reads_one_message(self):
+        other = get_user_model().objects.create_user(email='other@example.com', password='test')
+        not_mine = RejectionMessage.objects.create(recipient=other, message="Not mine")
+        self.client.login(email='test@example.com', password='test')
+
+        with mock.patch('app.views.INBOX_PAGE_SIZE', 2):
+            response = self.client.get(reverse('app:inbox'))
+            self.assertEqual([str(message) for message in response.context['inbox']], ['Message 3', 'Message 2'])
+            response = self.client.get(response.context['next_url'])
+            self.assertEqual([str(message) for message in response.context['inbox']], ['Message 1'])
+            self.assertIsNone(response.context['next_url'])
+
+        message = RejectionMessage.objects.get(message="Message 1")
+        response = self.client.post(reverse('app:read_message', args=[message.pk]))
+        self.assertRedirects(response, reverse('app:inbox'))
+        self.assertTrue(RejectionMessage.objects.get(pk=message.pk).read)
+        self.assertEqual(self.client.get(reverse('app:inbox')).context['unread_count'], 1)
+        self.assertEqual(self.client.post(reverse('app:read_message', args=[not_mine.pk])).status_code, 404)
+
+    def test_requesters_hear_about_approvals(self):
+        restaurant_request = RestaurantRequest.objects.create(
+            requester=self.user, name='Newcomb', address='A', latitude=38, longitude=-78
+        )
+        restaurant_request.approve()
+        message = RejectionMessage.objects.get(recipient=self.user, for_what='Newcomb')
+        self.assertEqual(message.outcome, RejectionMessage.Outcome.APPROVED)
+
+
+class RestaurantMapEndpointTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='test')
+        self.restaurant = Restaurant.objects.create(
+            name='Test Restaurant',
+            address='Test Address',
+            latitude=38.0,
+            longitude=-78.5,
+            contact_info='1111111111'
+        )
+
+    def test_geojson_payload(self):
+        response = self.client.get(reverse('app:restaurants_json'))
+        self.assertEqual(response.status_code, 200)
+        feature = response.json()['features'][0]
+        self.assertEqual(feature['geometry']['coordinates'], [-78.5, 38.0])
+        self.assertEqual(feature['properties']['name'], 'Test Restaurant')
+        self.assertEqual(feature['properties']['avg_rating'], "N/A")
+
+    def test_conditional_get(self):
+        etag = self.client.get(reverse('app:restaurants_json'))['ETag']
+        response = self.client.get(reverse('app:restaurants_json'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Review.objects.create(user=self.user, restaurant=self.restaurant, rating=4, review_text='Good')
+        response = self.client.get(reverse('app:restaurants_json'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['features'][0]['properties']['avg_rating'], 4)
+
+    def test_bbox_filter(self):
+        Restaurant.objects.create(
+            name='Far Away Restaurant',
+            address='Far Address',
+            latitude=51.5,
+            longitude=-0.1,
+            contact_info='3333333333'
+        )
+        response = self.client.get(reverse('app:restaurants_json'), {'bbox': '-79,37.5,-78,38.5'})
+        self.assertEqual([f['properties']['name'] for f in response.json()['features']], ['Test Restaurant'])
+
+        # Crossing the antimeridian covers -180..-78 and 170..180
+        response = self.client.get(reverse('app:restaurants_json'), {'bbox': '170,30,-78,39'})
+        self.assertEqual([f['properties']['name'] for f in response.json()['features']], ['Test Restaurant'])
+
+        response = self.client.get(reverse('app:restaurants_json'), {'bbox': '1,2,3'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_geohash_kept_in_sync(self):
+        self.restaurant.latitude = 51.5
+        self.restaurant.longitude = -0.1
+        self.restaurant.save()
+        self.assertEqual(Restaurant.objects.get(pk=self.restaurant.pk).geohash, encode_geohash(51.5, -0.1))
+        self.assertTrue(encode_geohash(57.64911, 10.40744).startswith('u4pruydqq'))
+
+
+class NearestRestaurantsTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='test@example.com', password='test')
+        for name, latitude, longitude in [
+            ('Newcomb', 38.0359, -78.5067),
+            ('Runk', 38.0297, -78.5202),
+            ('OHill', 38.0348, -78.5150),
+            ('Far Away', 51.5, -0.1),
+        ]:
+            Restaurant.objects.create(
+                name=name, address='Address', latitude=latitude, longitude=longitude, contact_info='1111111111'
+            )
+
+    def test_nearest(self):
+        Review.objects.create(
+            user=self.user, restaurant=Restaurant.objects.get(name='OHill'), rating=4, review_text='Good'
+        )
+        response = self.client.get(reverse('app:nearest_restaurants'), {'lat': 38.0350, 'lng': -78.5140, 'k': 2})
+        results = response.json()['results']
+        self.assertEqual([result['name'] for result in results], ['OHill', 'Newcomb'])
+        self.assertLess(results[0]['distance_km'], 0.1)
+        self.assertEqual(results[0]['avg_rating'], 4)
+
+    def test_index_rebuilt_after_change(self):
+        self.client.get(reverse('app:nearest_restaurants'), {'lat': 51.5, 'lng': -0.1, 'k': 1})
+        Restaurant.objects.create(
+            name='Closer', address='Address', latitude=51.5001, longitude=-0.1001, contact_info='1111111111'
+        )
+        response = self.client.get(reverse('app:nearest_restaurants'), {'lat': 51.5001, 'lng': -0.1001, 'k': 1})
+        self.assertEqual(response.json()['results'][0]['name'], 'Closer')
+
+    def test_index_only_rebuilt_when_locations_change(self):
+        restaurant = Restaurant.objects.get(name='Runk')
+        version = caching.get_version(caching.RESTAURANT_LOCATIONS)
+        restaurant.name = 'Runk Dining Hall'
+        restaurant.save()
+        self.assertEqual(caching.get_version(caching.RESTAURANT_LOCATIONS), version)
+        restaurant.latitude = 38.03
+        restaurant.save()
+        self.assertNotEqual(caching.get_version(caching.RESTAURANT_LOCATIONS), version)
+
+    def test_invalid_parameters(self):
+        response = self.client.get(reverse('app:nearest_restaurants'), {'lat': 'north'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RestaurantSearchTests(TestCase):
+    def setUp(self):
+        self.bagels = Restaurant.objects.create(
+            name='Bodo\'s Bagels', address='Emmet St', latitude=38.04, longitude=-78.50,
+            contact_info='1111111111', menu_text='Bagels, lox, coffee'
+        )
+        self.coffee = Restaurant.objects.create(
+            name='Grit Coffee', address='Elliewood Ave', latitude=38.03, longitude=-78.50,
+            contact_info='1111111111', menu_text='Espresso and bagels'
+        )
+
+    def search(self, query, **params):
+        return self.client.get(reverse('app:search'), {'q': query, **params}).json()
+
+    def test_prefix_and_ranking(self):
+        data = self.search('bag')
+        self.assertEqual(data['total'], 2)
+        # A name match outranks a menu match
+        self.assertEqual([r['name'] for r in data['results']], ["Bodo's Bagels", 'Grit Coffee'])
+        self.assertEqual([r['name'] for r in self.search('coff elli')['results']], ['Grit Coffee'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.coffee.menu_text = 'Espresso and croissants'
+        self.coffee.save()
+        self.assertEqual([r['name'] for r in self.search('bagel')['results']], ["Bodo's Bagels"])
+        self.bagels.delete()
+        self.assertEqual(self.search('bagel')['total'], 0)
+
+    def test_pagination(self):
+        data = self.search('bagel', page=2)
+        self.assertEqual((data['total'], data['results'], data['has_next']), (2, [], False))
+        self.assertEqual(self.client.get(reverse('app:search'), {'q': 'x', 'page': 'two'}).status_code, 400)
+
+    def test_searches_the_database_reads_are_routed_to(self):
+        with mock.patch('app.search.get_backend') as get_backend:
+            get_backend.return_value.search.return_value = (0, [])
+            token = read_database.set('replica_1')
+            try:
+                search_restaurants('bagel')
+            finally:
+                read_database.reset(token)
+            search_restaurants('bagel')
+        self.assertEqual(get_backend.call_args_list, [mock.call('replica_1'), mock.call('default')])
+
+
+class ReviewFeedTests(TestCase):
+    def setUp(self):
+        create_google_app()
+        self.restaurant = Restaurant.objects.create(
+            name='Test Restaurant', address='Test Address', latitude=40.0, longitude=-75.0,
+            contact_info='1111111111'
+        )
+        for i in range(30):
+            user = get_user_model().objects.create(email=f'user{i}@example.com')
+            Review.objects.create(user=user, restaurant=self.restaurant, rating=i % 5 + 1, review_text=f'Review {i}')
+
+    def collect(self, sort):
+        seen = []
+        url = reverse('app:restaurant_reviews', args=[self.restaurant.pk]) + f'?sort={sort}'
+        while url:
+            response = self.client.get(url)
+            seen.extend(review.pk for review in response.context['reviews'])
+            url = response.context['next_reviews_url']
+        return seen
+
+    def test_keyset_pages_cover_every_review_once(self):
+        newest = self.collect('newest')
+        self.assertEqual(newest, list(Review.objects.order_by('-timestamp', '-id').values_list('pk', flat=True)))
+        by_rating = self.collect('rating')
+        self.assertEqual(by_rating, list(
+            Review.objects.order_by('-rating', '-timestamp', '-id').values_list('pk', flat=True)
+        ))
+
+    def test_detail_page_queries_do_not_grow_with_reviews(self):
+        url = reverse('app:restaurant_detail', args=[self.restaurant.pk])
+        cache.clear()
+        # Restaurant, crowdedness baseline, one page of reviews with their users,
+        # and the sign in link's SocialApp
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['reviews']), 12)
+        self.assertContains(response, 'user29@example.com')
+
+    def test_detail_page_fragments_are_cached_until_a_write(self):
+        url = reverse('app:restaurant_detail', args=[self.restaurant.pk])
+        cache.clear()
+        self.client.get(url)
+        # The reviews and report averages come from the fragment cache
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(response, 'user29@example.com')
+        self.assertEqual(get_fragment_stats(), {'hit': 4, 'stale': 0, 'miss': 4})
+
+        Review.objects.create(user=get_user_model().objects.first(), restaurant=self.restaurant, rating=1, review_text='Fresh review')
+        self.assertContains(self.client.get(url), 'Fresh review')
+
+    def test_stale_fragment_is_served_while_another_worker_rebuilds(self):
+        cache.clear()
+        version = caching.restaurant_version(self.restaurant.pk)
+        self.assertEqual(caching.get_fragment(version, 'key', lambda: 'old'), 'old')
+        caching.bump_version(version)
+        cache.add('fragment:key:lock', 1)
+        self.assertEqual(caching.get_fragment(version, 'key', lambda: 'new'), 'old')
+        cache.delete('fragment:key:lock')
+        self.assertEqual(caching.get_fragment(version, 'key', lambda: 'new'), 'new')
+        self.assertEqual(get_fragment_stats(), {'hit': 0, 'stale': 1, 'miss': 2})
+
+    def test_cold_miss_builds_without_caching_while_another_worker_does(self):
+        cache.clear()
+        version = caching.restaurant_version(self.restaurant.pk)
+        cache.add('fragment:key:lock', 1)
+        self.assertEqual(caching.get_fragment(version, 'key', lambda: 'mine'), 'mine')
+        self.assertIsNone(cache.get('fragment:key'))
+        cache.delete('fragment:key:lock')
+        self.assertEqual(caching.get_fragment(version, 'key', lambda: 'cached'), 'cached')
+        self.assertEqual(caching.get_fragment(version, 'key', lambda: 'new'), 'cached')
+        self.assertEqual(get_fragment_stats(), {'hit': 1, 'stale': 0, 'miss': 2})
+
+    def test_invalid_cursor(self):
+        url = reverse('app:restaurant_reviews', args=[self.restaurant.pk])
+        self.assertEqual(self.client.get(url, {'cursor': 'garbage'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'sort': 'oldest'}).status_code, 400)
+
+    def test_badly_typed_cursors(self):
+        url = reverse('app:restaurant_reviews', args=[self.restaurant.pk])
+        for values in (['abc', 1], [1, 2], ['2023-10-01T12:00:00', 1], [None, 1], ['2023-10-01T12:00:00+00:00', [1]]):
+            self.assertEqual(self.client.get(url, {'cursor': encode_cursor(values)}).status_code, 400, values)
+        response = self.client.get(url, {'cursor': encode_cursor(['2023-10-01T12:00:00+00:00', 1])})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, {'sort': 'rating', 'cursor': encode_cursor(['high', '2023-10-01', 1])})
+        self.assertEqual(response.status_code, 400)
+
+
+class CacheTagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='test_user@email.com')
+        self.newcomb = Restaurant.objects.create(name='Newcomb', address='A', latitude=38, longitude=-78)
+        self.ohill = Restaurant.objects.create(name='O-Hill', address='B', latitude=38, longitude=-78)
+        self.calls = []
+
+        @caching.cached(lambda restaurant: [caching.restaurant_version(restaurant.pk)], key=lambda r: r.pk)
+        def review_count(restaurant):
+            self.calls.append(restaurant.name)
+            return Review.objects.filter(restaurant=restaurant).count()
+
+        self.review_count = review_count
+
+    def test_writes_bump_only_their_tags(self):
+        self.assertEqual([self.review_count(self.newcomb), self.review_count(self.ohill)], [0, 0])
+        Review.objects.create(user=self.user, restaurant=self.newcomb, rating=5, review_text='Great')
+        self.assertEqual([self.review_count(self.newcomb), self.review_count(self.ohill)], [1, 0])
+        self.assertEqual(self.calls, ['Newcomb', 'O-Hill', 'Newcomb'])
+
+        user_reports = caching.cached([caching.user_version(self.user.pk)])(
+            lambda: list(Report.objects.filter(user=self.user).values_list('rating', flat=True))
+        )
+        self.assertEqual(user_reports(), [])
+        Report.objects.create(user=self.user, restaurant=self.ohill, rating=2, report_type='CL')
+        self.assertEqual(user_reports(), [2])
+
+    def test_coherent_across_processes_with_the_file_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+            with override_settings(CACHES={'default': backend}):
+                self.review_count(self.newcomb)
+                # Another worker, with its own connection to the same cache
+                other_worker = caches.create_connection('default')
+                version_key = 'version:' + caching.restaurant_version(self.newcomb.pk)
+                version = other_worker.get(version_key)
+                Review.objects.create(user=self.user, restaurant=self.newcomb, rating=5, review_text='Great')
+                self.assertNotEqual(other_worker.get(version_key), version)
+                self.assertEqual(self.review_count(self.newcomb), 1)
+
+    def test_cached_none_is_a_hit(self):
+        calls = []
+        build = lambda: calls.append(1)
+        self.assertIsNone(caching.get_cached([caching.model_version(Review)], 'nothing', build))
+        self.assertIsNone(caching.get_cached([caching.model_version(Review)], 'nothing', build))
+        self.assertEqual(calls, [1])
+
+    def test_views_need_a_key_function(self):
+        view = caching.cached([caching.model_version(Restaurant)])(lambda request: HttpResponse())
+        with self.assertRaises(TypeError):
+            view(RequestFactory().get('/'))
+        view = caching.cached([caching.model_version(Restaurant)], key=lambda request: request.get_full_path())(
+            lambda request: 'page'
+        )
+        self.assertEqual(view(RequestFactory().get('/?page=2')), 'page')
+
+
+class LiveCrowdednessTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='test@example.com')
+        self.restaurant = Restaurant.objects.create(
+            name='Newcomb', address='Address', latitude=38.0, longitude=-78.5, contact_info='1111111111'
+        )
+        self.now = timezone.now()
+        # Usually quiet at this hour
+        CrowdednessBaseline.objects.create(
+            restaurant=self.restaurant, hour_of_week=get_hour_of_week(self.now), count=10, sum=10
+        )
+
+    def live(self, now=None):
+        restaurant = Restaurant.objects.get(pk=self.restaurant.pk)
+        baseline = CrowdednessBaseline.objects.get(restaurant=restaurant, hour_of_week=get_hour_of_week(self.now))
+        return restaurant.get_live_crowdedness(baseline, now=now)
+
+    def report(self, rating):
+        return Report.objects.create(
+            user=self.user, restaurant=self.restaurant, rating=rating, report_type=Report.ReportType.CROWDEDNESS
+        )
+
+    def test_recent_reports_outweigh_baseline_then_decay(self):
+        self.assertEqual(self.live(), 1)
+        self.report(5)
+        self.report(5)
+        baseline_average = 20 / 12
+        self.assertGreater(self.live(), 3.5)
+        self.assertAlmostEqual(self.live(now=self.now + timedelta(hours=12)), baseline_average, places=2)
+
+    def test_delete_takes_report_back(self):
+        report = self.report(5)
+        report.delete()
+        restaurant = Restaurant.objects.get(pk=self.restaurant.pk)
+        self.assertEqual(restaurant.crowdedness_decayed_weight, 0)
+        self.assertEqual(self.live(), 1)
+
+    def test_rebuild_matches_incremental(self):
+        self.report(4)
+        self.report(2)
+        incremental = self.live()
+        CrowdednessBaseline.objects.all().delete()
+        rebuild_crowdedness()
+        baseline = CrowdednessBaseline.objects.get(restaurant=self.restaurant)
+        self.assertEqual((baseline.count, baseline.sum), (2, 6))
+        restaurant = Restaurant.objects.get(pk=self.restaurant.pk)
+        self.assertAlmostEqual(restaurant.crowdedness_decayed_weight, 2, places=3)
+        self.assertNotEqual(incremental, restaurant.get_live_crowdedness(baseline))
+        self.assertAlmostEqual(restaurant.get_live_crowdedness(baseline), 3, places=2)
+
+    def test_exposed_on_map_api(self):
+        self.report(5)
+        response = self.client.get(reverse('app:restaurants_json'))
+        self.assertGreater(response.json()['features'][0]['properties']['crowdedness_now'], 1)
+
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='test_user@email.com')
+        self.one_review = Restaurant.objects.create(name='One Review', address='A', latitude=38, longitude=-78)
+        self.many_reviews = Restaurant.objects.create(name='Many Reviews', address='B', latitude=38, longitude=-78)
+        self.unrated = Restaurant.objects.create(name='Unrated', address='C', latitude=38, longitude=-78)
+        Review.objects.create(user=self.user, restaurant=self.one_review, rating=5, review_text='Great')
+        for _ in range(10):
+            Review.objects.create(user=self.user, restaurant=self.many_reviews, rating=4, review_text='Good')
+
+    def test_ranks_by_bayesian_average(self):
+        response = self.client.get(reverse('app:leaderboard'), {'restaurant': self.one_review.pk})
+        data = response.json()
+        self.assertEqual([entry['name'] for entry in data['results']], ['Many Reviews', 'One Review'])
+        self.assertEqual(data['results'][0]['score'], round((15 + 40) / 15, 3))
+        self.assertEqual(data['restaurant']['rank'], 2)
+        self.assertIsNone(leaderboard.get_rank(self.unrated))
+
+    def test_scores_follow_writes_and_match_a_rebuild(self):
+        self.assertEqual([r.name for r in leaderboard.get_top()], ['Many Reviews', 'One Review'])
+        with self.assertNumQueries(0):
+            leaderboard.get_top()
+        review = Review.objects.create(user=self.user, restaurant=self.one_review, rating=5, review_text='Again')
+        self.assertEqual([(r.name, r.review_count) for r in leaderboard.get_top()], [('Many Reviews', 10), ('One Review', 2)])
+        Report.objects.create(user=self.user, restaurant=self.unrated, rating=5, report_type=Report.ReportType.CLEANLINESS)
+        self.assertEqual([r.name for r in leaderboard.get_top('CL')], ['Unrated'])
+        review.delete()
+
+        scores = list(Restaurant.objects.order_by('pk').values_list(*Restaurant.SCORE_FIELDS))
+        rebuild_restaurant_stats()
+        self.assertEqual(scores, list(Restaurant.objects.order_by('pk').values_list(*Restaurant.SCORE_FIELDS)))
+
+    def test_unknown_type(self):
+        self.assertEqual(self.client.get(reverse('app:leaderboard'), {'type': 'XX'}).status_code, 400)
+
+    def test_deleting_a_restaurant_skips_per_row_stats(self):
+        for restaurant in (self.one_review, self.many_reviews):
+            Report.objects.create(user=self.user, restaurant=restaurant, rating=3, report_type='CR')
+        with CaptureQueriesContext(connection) as few:
+            self.one_review.delete()
+        with CaptureQueriesContext(connection) as many:
+            self.many_reviews.delete()
+        self.assertEqual(len(few), len(many))
+        self.unrated.refresh_from_db()
+        self.assertEqual(self.unrated.review_count, 0)
+
+
+
+class MenuItemTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(
+            name='Bodo\'s', address='A', latitude=38, longitude=-78,
+            menu_text='Everything Bagel $3.50 (vegan, gf), Pizza Slice 2.75; Pho 24\nCoffee',
+        )
+
+    def test_menu_text_is_parsed(self):
+        items = [(item.name, item.price, item.tags) for item in self.restaurant.menu_items.all()]
+        self.assertEqual(items, [
+            ('Everything Bagel', Decimal('3.50'), 'vegan gf'),
+            ('Pizza Slice', Decimal('2.75'), ''),
+            ('Pho 24', None, ''),
+            ('Coffee', None, ''),
+        ])
+
+    def test_dish_search_matches_prefixes_across_restaurants(self):
+        other = Restaurant.objects.create(name='Bagel Bar', address='B', latitude=38, longitude=-78,
+                                          menu_text='Plain bagel')
+        self.assertEqual([item.name for item in search_dishes('bag')], ['Everything Bagel', 'Plain bagel'])
+        self.assertEqual([item.name for item in search_dishes('veg bag')], ['Everything Bagel'])
+        Restaurant.objects.create(name='Café', address='C', latitude=38, longitude=-78, menu_text='Café au lait; Bah mi')
+        self.assertEqual([item.name for item in search_dishes('caf')], ['Café au lait'])
+        self.assertEqual([item.name for item in search_dishes('bag')], ['Everything Bagel', 'Plain bagel'])
+
+        response = self.client.get(reverse('app:dish_search'), {'q': 'plain'})
+        self.assertEqual(response.json()['results'][0]['restaurant']['pk'], other.pk)
+
+    def test_menus_follow_edits_and_approvals(self):
+        item_ids = list(self.restaurant.menu_items.values_list('pk', flat=True))
+        restaurant = Restaurant.objects.get(pk=self.restaurant.pk)
+        restaurant.name = 'Bodos'
+        restaurant.save()
+        self.assertEqual(list(restaurant.menu_items.values_list('pk', flat=True)), item_ids)
+
+        RestaurantRequest.objects.create(corresponding_restaurant=restaurant, menu_text='Bagel sandwich').approve()
+        self.assertEqual([item.name for item in search_dishes('sand')], ['Bagel sandwich'])
+        self.assertEqual(search_dishes('pizza'), [])
+
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='test_user@email.com')
+        self.staff = User.objects.create(email='staff@email.com', is_staff=True)
+        self.newcomb = Restaurant.objects.create(name='Newcomb', address='A', latitude=38, longitude=-78)
+        self.ohill = Restaurant.objects.create(name='O-Hill', address='B', latitude=38, longitude=-78)
+        for restaurant, report_type in ((self.newcomb, 'CR'), (self.newcomb, 'CL'), (self.ohill, 'CR')):
+            self.report(restaurant, report_type, 3)
+
+    def report(self, restaurant, report_type, rating, age=timedelta(minutes=5)):
+        # Old enough to be exported
+        return Report.objects.create(
+            user=self.user, restaurant=restaurant, rating=rating, report_type=report_type,
+            timestamp=timezone.now() - age,
+        )
+
+    def export(self, **query):
+        response = self.client.get(reverse('app:export_reports'), query)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get(reverse('app:export_reviews')).status_code, 302)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('app:export_reviews')).status_code, 302)
+
+    def test_filtered_csv(self):
+        self.client.force_login(self.staff)
+        response, content = self.export(restaurant=self.newcomb.pk, type='CR')
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0], ['id', 'restaurant_id', 'user_id', 'report_type', 'rating', 'timestamp'])
+        self.assertEqual([(row[1], row[3]) for row in rows[1:]], [(str(self.newcomb.pk), 'CR')])
+        self.assertEqual(self.client.get(reverse('app:export_reports'), {'since': 'yesterday'}).status_code, 400)
+
+    def test_cursor_only_returns_new_rows(self):
+        self.client.force_login(self.staff)
+        response, content = self.export(format='ndjson')
+        self.assertEqual(len(content.splitlines()), 3)
+        self.report(self.ohill, 'FR', 5)
+
+        response, content = self.export(format='ndjson', cursor=response['X-Export-Cursor'])
+        row, = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual((row['report_type'], row['rating']), ('FR', 5))
+
+    def test_recent_rows_wait_for_the_next_export(self):
+        self.client.force_login(self.staff)
+        response, content = self.export(format='ndjson')
+        # A transaction still open could yet commit an id below a row this new
+        recent = self.report(self.ohill, 'FR', 5, age=timedelta(0))
+        response, content = self.export(format='ndjson', cursor=response['X-Export-Cursor'])
+        self.assertEqual(content, '')
+
+        Report.objects.filter(pk=recent.pk).update(timestamp=timezone.now() - timedelta(minutes=5))
+        response, content = self.export(format='ndjson', cursor=response['X-Export-Cursor'])
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], [recent.pk])
+
+    async def test_streams_asynchronously_under_asgi(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.staff)
+        response = await client.get(reverse('app:export_reports'), {'format': 'ndjson'})
+        self.assertTrue(response.is_async)
+        self.assertEqual(len([line async for line in response.streaming_content]), 3)
+
+    def test_command_keeps_its_cursor(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cursor_file = os.path.join(directory, 'cursor')
+            # A header, then the rows added since the last run
+            for expected in (4, 2):
+                stdout = StringIO()
+                call_command('export_data', 'reports', cursor_file=cursor_file, stdout=stdout, stderr=StringIO())
+                self.assertEqual(len(stdout.getvalue().splitlines()), expected)
+                self.report(self.ohill, 'FR', 5)
+
+
+class ReportRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='test_user@email.com')
+        self.newcomb = Restaurant.objects.create(name='Newcomb', address='A', latitude=38, longitude=-78)
+        self.old = timezone.now() - timedelta(days=10)
+        for rating in (1, 4, 4):
+            self.report(rating, self.old)
+
+    def report(self, rating, timestamp=None):
+        return Report.objects.create(
+            user=self.user, restaurant=self.newcomb, rating=rating, report_type='CR',
+            timestamp=timestamp or timezone.now(),
+        )
+
+    def day_rollup(self, timestamp):
+        return ReportRollup.objects.get(period='D', start=timestamp.replace(hour=0, minute=0, second=0, microsecond=0))
+
+    def test_resumes_from_the_watermark_without_double_counting(self):
+        self.assertEqual(rollups.roll_up(batch_size=2), 3)
+        self.assertEqual(rollups.roll_up(), 0)
+        self.report(5, self.old)
+        self.assertEqual(rollups.roll_up(), 1)
+        rollup = self.day_rollup(self.old)
+        self.assertEqual((rollup.count, rollup.sum, rollup.rated_1, rollup.rated_4), (4, 14, 1, 2))
+        self.assertEqual(ReportRollup.objects.get(period='H').count, 4)
+
+    def test_ids_committed_out_of_order_are_not_skipped(self):
+        late = self.report(3)
+        newer = self.report(5)
+        # The later id commits first, so the earlier one isn't visible yet
+        Report.objects.filter(pk=late.pk)._raw_delete(connection.alias)
+        self.assertEqual(rollups.roll_up(), 3)
+        self.assertLess(rollups.get_watermark(), late.pk)
+
+        Report.objects.bulk_create([late])
+        Report.objects.filter(pk__in=[late.pk, newer.pk]).update(timestamp=self.old)
+        self.assertEqual(rollups.roll_up(), 2)
+        self.assertEqual(self.day_rollup(self.old).count, 5)
+
+    def test_edits_after_rolling_up_adjust_the_rollups(self):
+        rollups.roll_up()
+        report = Report.objects.filter(rating=1).get()
+        report.rating = 5
+        report.save()
+        Report.objects.filter(rating=4).first().delete()
+        rollup = self.day_rollup(self.old)
+        self.assertEqual((rollup.count, rollup.sum, rollup.rated_1, rollup.rated_5), (2, 9, 0, 1))
+
+    def test_compaction_keeps_averages_exact(self):
+        self.report(2)
+        call_command('rollup_reports', compact_days=1, stdout=StringIO())
+        self.assertEqual(Report.objects.count(), 1)
+        self.newcomb.refresh_from_db()
+        self.assertEqual((self.newcomb.crowdedness_count, self.newcomb.crowdedness_sum), (4, 11))
+
+        totals = Restaurant.objects.values_list(*Restaurant.TOTAL_FIELDS).get()
+        baselines = list(CrowdednessBaseline.objects.order_by('hour_of_week').values_list('hour_of_week', 'count', 'sum'))
+        rebuild_restaurant_stats()
+        rebuild_crowdedness()
+        self.assertEqual(Restaurant.objects.values_list(*Restaurant.TOTAL_FIELDS).get(), totals)
+        self.assertEqual(
+            list(CrowdednessBaseline.objects.order_by('hour_of_week').values_list('hour_of_week', 'count', 'sum')),
+            baselines,
+        )
+
+    def test_deleting_a_rolled_up_restaurant(self):
+        rollups.roll_up()
+        self.newcomb.delete()
+        self.assertFalse(ReportRollup.objects.exists())
+        # A delta for a rollup that is already gone doesn't recreate it with a negative count
+        rollups.apply_deltas({(self.newcomb.pk, 'CR', 'D', self.old): {'count': -1, 'sum': -4, 'rated_4': -1}})
+        self.assertFalse(ReportRollup.objects.exists())
+
+    def test_trend_reads_the_rollups(self):
+        rollups.roll_up()
+        self.report(5)
+        url = reverse('app:restaurant_trend', args=[self.newcomb.pk])
+        results = self.client.get(url, {'type': 'CR'}).json()['results']
+        self.assertEqual(
+            [(entry['count'], entry['average'], entry['histogram']) for entry in results],
+            [(3, 3.0, [1, 0, 0, 2, 0])],
+        )
+        self.assertEqual(self.client.get(url, {'period': 'week'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('app:restaurant_trend', args=[0])).status_code, 404)
+
+
+class ImportRestaurantsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as source:
+            source.write(text)
+        return path
+
+    def test_import_and_upsert(self):
+        path = self.write('restaurants.csv', (
+            "name,address,latitude,longitude,contact_info,menu_text\n"
+            "Newcomb,Newcomb Rd,38.0359,-78.5067,newcomb.com,Pizza\n"
+            "Runk,Runk Rd,38.0297,-78.5202,runk.com,Salads\n"
+            "Broken,Nowhere,100,0,,\n"
+        ))
+        stderr = StringIO()
+        call_command('import_restaurants', path, '--chunk-size', '1', stdout=StringIO(), stderr=stderr)
+        self.assertIn('Row 3', stderr.getvalue())
+        newcomb = Restaurant.objects.get(name='Newcomb')
+        self.assertEqual(newcomb.admin_group.name, f'{newcomb.pk} admin')
+        self.assertEqual(newcomb.geohash, encode_geohash(38.0359, -78.5067))
+        self.assertEqual(search_restaurants('pizza')[0], 1)
+
+        path = self.write('update.jsonl', (
+            '{"name": "Newcomb", "address": "Newcomb Rd", "latitude": 38.0, "longitude": -78.5, "menu_text": "Tacos"}\n'
+            '\n'
+            'not json\n'
+        ))
+        call_command('import_restaurants', path, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Restaurant.objects.count(), 2)
+        self.assertEqual(Restaurant.objects.get(pk=newcomb.pk).menu_text, 'Tacos')
+
+    def test_resume_from_checkpoint(self):
+        path = self.write('restaurants.jsonl', ''.join(
+            json.dumps({'name': f'R{i}', 'address': 'A', 'latitude': 38, 'longitude': -78}) + '\n' for i in range(5)
+        ))
+        with open(path + '.checkpoint', 'w') as checkpoint:
+            checkpoint.write('3')
+        call_command('import_restaurants', path, stdout=StringIO())
+        self.assertEqual(sorted(Restaurant.objects.values_list('name', flat=True)), ['R3', 'R4'])
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+
+class BulkModerationTests(TestCase):
+    def setUp(self):
+        create_google_app()
+        self.admin = User.objects.create(email='admin@email.com')
+        self.admin.groups.add(Group.objects.create(name="admin of everything"))
+        self.requester = User.objects.create(email='requester@email.com')
+        self.restaurant = Restaurant.objects.create(name="Old", address="A", latitude=38, longitude=-78)
+        self.admin.groups.add(self.restaurant.admin_group)
+        self.client.force_login(self.admin)
+
+    def moderate(self, action, requests, **data):
+        return self.client.post(reverse('app:bulk_moderate_requests'), {
+            'action': action, 'request_ids': [r.pk for r in requests], **data,
+        })
+
+    def test_bulk_approve(self):
+        new_requests = [
+            RestaurantRequest.objects.create(name=f"New {i}", address="B", latitude=38, longitude=-78)
+            for i in range(3)
+        ]
+        edits = [
+            RestaurantRequest.objects.create(corresponding_restaurant=self.restaurant, name=name)
+            for name in ("First", "Second")
+        ]
+        response = self.moderate('approve', new_requests + edits)
+        self.assertRedirects(response, reverse('app:new_restaurant'), fetch_redirect_response=False)
+        self.assertFalse(RestaurantRequest.objects.exists())
+        self.assertEqual(Restaurant.objects.get(pk=self.restaurant.pk).name, "Second")
+        created = Restaurant.objects.get(name="New 0")
+        self.assertEqual(created.admin_group.name, f'{created.pk} admin')
+
+    def test_bulk_reject(self):
+        requests = [
+            RestaurantRequest.objects.create(requester=self.requester, name=f"New {i}", latitude=38, longitude=-78)
+            for i in range(3)
+        ]
+        self.moderate('reject', requests, rejection_message="Duplicate")
+        self.assertFalse(RestaurantRequest.objects.exists())
+        self.assertEqual(
+            list(RejectionMessage.objects.filter(recipient=self.requester).values_list('message', flat=True)),
+            ["Duplicate"] * 3
+        )
+
+    def test_requires_admin_of_restaurant(self):
+        other = Restaurant.objects.create(name="Other", address="C", latitude=38, longitude=-78)
+        request = RestaurantRequest.objects.create(corresponding_restaurant=other, name="Hijack")
+        self.moderate('approve', [request])
+        self.assertTrue(RestaurantRequest.objects.filter(pk=request.pk).exists())
+        self.assertEqual(Restaurant.objects.get(pk=other.pk).name, "Other")
+
+    def test_queue_is_keyset_paginated(self):
+        RestaurantRequest.objects.bulk_create([
+            RestaurantRequest(name=f"New {i}", latitude=38, longitude=-78) for i in range(REQUEST_PAGE_SIZE + 5)
+        ])
+        response = self.client.get(reverse('app:new_restaurant'))
+        self.assertEqual(len(response.context['new_restaurants_list']), REQUEST_PAGE_SIZE)
+        response = self.client.get(reverse('app:new_restaurant'), {'cursor': response.context['next_cursor']})
+        self.assertEqual(len(response.context['new_restaurants_list']), 5)
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertEqual(self.client.get(reverse('app:new_restaurant'), {'cursor': '!'}).status_code, 400)
+
+    def test_duplicates_are_only_found_for_moderators(self):
+        RestaurantRequest.objects.create(name="New", latitude=38, longitude=-78)
+        with mock.patch('app.views.get_duplicates', return_value={}) as get_duplicates:
+            self.client.get(reverse('app:new_restaurant'))
+            get_duplicates.assert_called_once()
+            self.client.force_login(self.requester)
+            self.client.get(reverse('app:new_restaurant'))
+            get_duplicates.assert_called_once()
+
+
+class RevokedAdminTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(email='admin@email.com')
+        self.admin.groups.add(Group.objects.create(name="admin of everything"))
+        self.restaurant_request = RestaurantRequest.objects.create(name="New", address="B", latitude=38, longitude=-78)
+        self.client.force_login(self.admin)
+
+    def test_moderation_rechecks_group_membership(self):
+        self.assertTrue(get_admin_scope(User.objects.get(pk=self.admin.pk)).is_global)
+        # Revoked on another dyno, whose version bump never reached this cache
+        User.groups.through.objects.filter(user=self.admin)._raw_delete(connection.alias)
+        self.assertTrue(get_admin_scope(User.objects.get(pk=self.admin.pk)).is_global)
+
+        self.client.post(reverse('app:bulk_moderate_requests'), {
+            'action': 'approve', 'request_ids': [self.restaurant_request.pk],
+        })
+        url = reverse('app:approve_request', args=[self.restaurant_request.pk])
+        self.assertEqual(self.client.post(url).status_code, 403)
+        url = reverse('app:reject_request', args=[self.restaurant_request.pk])
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.assertTrue(RestaurantRequest.objects.filter(pk=self.restaurant_request.pk).exists())
+
+
+class AdminScopeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='admin@email.com')
+        self.restaurant = Restaurant.objects.create(name="Newcomb", address="A", latitude=38, longitude=-78)
+
+    def test_scope_follows_group_changes(self):
+        self.assertFalse(get_admin_scope(User.objects.get(pk=self.user.pk)).administers(self.restaurant.pk))
+        self.user.groups.add(self.restaurant.admin_group)
+        scope = get_admin_scope(User.objects.get(pk=self.user.pk))
+        self.assertEqual(scope.restaurant_ids, {self.restaurant.pk})
+        self.assertFalse(scope.is_global)
+
+        everything = Group.objects.create(name="admin of everything")
+        everything.user_set.add(self.user)
+        self.assertTrue(get_admin_scope(User.objects.get(pk=self.user.pk)).is_global)
+        everything.user_set.clear()
+        self.assertFalse(get_admin_scope(User.objects.get(pk=self.user.pk)).is_global)
+
+    def test_cached_scope_costs_no_queries(self):
+        self.user.groups.add(self.restaurant.admin_group)
+        get_admin_scope(User.objects.get(pk=self.user.pk))
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(get_admin_scope(user).administers(self.restaurant.pk))
+
+    def test_templates_show_admin_links_from_the_scope(self):
+        create_google_app()
+        update_url = reverse('app:restaurant_update', args=[self.restaurant.pk])
+        self.client.force_login(self.user)
+        self.assertNotContains(self.client.get(reverse('app:restaurant_detail', args=[self.restaurant.pk])), update_url)
+        self.user.groups.add(self.restaurant.admin_group)
+        self.assertContains(self.client.get(reverse('app:restaurant_detail', args=[self.restaurant.pk])), update_url)
+        self.assertNotContains(self.client.get(reverse('app:restaurants')), reverse('app:new_restaurant'))
+
+
+class AsyncReadPathTests(TestCase):
+    def setUp(self):
+        create_google_app()
+        self.restaurant = Restaurant.objects.create(
+            name='Newcomb', address='Newcomb Rd', latitude=38.0359, longitude=-78.5067, menu_text='Pizza'
+        )
+
+    async def test_read_views_under_asgi(self):
+        client = AsyncClient()
+        response = await client.get(reverse('app:restaurants_json'), {'bbox': '-79,37,-78,39'})
+        self.assertEqual(response.json()['features'][0]['properties']['name'], 'Newcomb')
+        response = await client.get(reverse('app:search'), {'q': 'pizza'})
+        self.assertEqual(response.json()['total'], 1)
+        response = await client.get(reverse('app:nearest_restaurants'), {'lat': 38.03, 'lng': -78.5})
+        self.assertEqual(response.json()['results'][0]['pk'], self.restaurant.pk)
+        response = await client.get(reverse('app:restaurant_detail', args=[self.restaurant.pk]))
+        self.assertContains(response, 'Newcomb Rd')
+        response = await client.get(reverse('app:restaurant_detail', args=[self.restaurant.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+        response = await client.get(reverse('app:index'))
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.routed = []
+
+    def record_routing(self, request):
+        self.routed.append((router.db_for_read(Restaurant), router.db_for_read(User)))
+        return HttpResponse()
+
+    def test_reads_go_to_a_replica_unless_pinned(self):
+        view = read_from_replica(self.record_routing)
+        pinned = self.factory.get('/')
+        pinned.COOKIES[PIN_COOKIE] = '1'
+        for request in (self.factory.get('/'), pinned, self.factory.post('/')):
+            view(request)
+        self.assertEqual(self.routed, [('replica_1', 'default'), ('default', 'default'), ('default', 'default')])
+        self.assertEqual(router.db_for_read(Restaurant), 'default')
+
+    async def test_routing_follows_async_views_into_threads(self):
+        @read_from_replica
+        async def view(request):
+            return await sync_to_async(self.record_routing)(request)
+
+        await view(self.factory.get('/'))
+        self.assertEqual(self.routed, [('replica_1', 'default')])
+
+    def test_versioned_entries_are_built_on_the_primary(self):
+        cache.clear()
+        built_on = []
+
+        def build():
+            built_on.append(router.db_for_read(Restaurant))
+            return 'value'
+
+        token = read_database.set('replica_1')
+        try:
+            caching.get_cached([caching.model_version(Restaurant)], 'key', build)
+            caching.get_fragment(caching.model_version(Restaurant), 'key', build)
+        finally:
+            read_database.reset(token)
+        self.assertEqual(built_on, ['default', 'default'])
+        # Rendered on a replica, so the fragment may hold replica rows and is kept for at most the lag
+        _, expires, _ = cache.get('fragment:key')
+        self.assertLessEqual(expires, time.time() + settings.REPLICA_PIN_SECONDS)
+
+    def test_posting_a_report_pins_the_user_to_the_primary(self):
+        user = User.objects.create(email='test_user@email.com')
+        restaurant = Restaurant.objects.create(name='Newcomb', address='A', latitude=38, longitude=-78)
+        self.client.force_login(user)
+        response = self.client.post(reverse('app:report_create'), {
+            'restaurant': restaurant.pk, 'report_type': 'CR', 'rating': 3,
+        })
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+        with override_settings(DATABASE_REPLICAS=[]):
+            response = self.client.post(reverse('app:report_create'), {
+                'restaurant': restaurant.pk, 'report_type': 'CR', 'rating': 3,
+            })
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+class ReportWriteBehindTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(REPORT_WRITE_BEHIND=True, REPORT_SPOOL_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.spool = os.path.join(directory.name, 'reports.jsonl')
+
+        self.user = User.objects.create(email='test_user@email.com')
+        self.restaurant = Restaurant.objects.create(name='Newcomb', address='A', latitude=38, longitude=-78)
+        self.client.force_login(self.user)
+
+    def submit(self, rating, report_type=Report.ReportType.CROWDEDNESS):
+        response = self.client.post(reverse('app:report_create'), {
+            'restaurant': self.restaurant.pk, 'report_type': report_type, 'rating': rating,
+        })
+        self.assertRedirects(response, reverse('app:report_create') + '?success=True', fetch_redirect_response=False)
+
+    def test_reports_are_spooled_then_flushed_in_one_batch(self):
+        for rating in (1, 3, 5):
+            self.submit(rating)
+        self.submit(4, Report.ReportType.CLEANLINESS)
+        self.assertFalse(Report.objects.exists())
+        self.assertEqual(writebehind.count_pending(), 4)
+
+        # Lookups, one INSERT, and one set of aggregate updates for the whole batch
+        with self.assertNumQueries(15):
+            call_command('flush_reports', '--once', stdout=StringIO())
+        restaurant = Restaurant.objects.get(pk=self.restaurant.pk)
+        self.assertEqual(Report.objects.count(), 4)
+        self.assertEqual((restaurant.crowdedness_count, restaurant.crowdedness_sum), (3, 9))
+        self.assertEqual(restaurant.get_average_cleanliness(), 4)
+        self.assertEqual(CrowdednessBaseline.objects.get(restaurant=restaurant).count, 3)
+        self.assertEqual(writebehind.count_pending(), 0)
+
+    def test_replay_after_crash_does_not_duplicate(self):
+        self.submit(2)
+        self.submit(4)
+        # Die after the batch committed but before its file was removed
+        with mock.patch('app.writebehind.os.remove', side_effect=OSError("crashed")):
+            with self.assertRaises(OSError):
+                writebehind.flush()
+        # A torn final line is never acknowledged to anyone, so it's skipped
+        batch, = [name for name in os.listdir(os.path.dirname(self.spool)) if name.startswith('reports-')]
+        with open(os.path.join(os.path.dirname(self.spool), batch), 'a') as spool:
+            spool.write('{"submission_id": "12')
+        self.submit(5)
+
+        self.assertEqual(writebehind.flush(), 1)
+        restaurant = Restaurant.objects.get(pk=self.restaurant.pk)
+        self.assertEqual(Report.objects.count(), 3)
+        self.assertEqual((restaurant.crowdedness_count, restaurant.crowdedness_sum), (3, 11))
+
+    def test_full_spool_falls_back_to_direct_insert(self):
+        with override_settings(REPORT_SPOOL_MAX_BYTES=10):
+            self.submit(3)
+        self.assertEqual(Report.objects.count(), 1)
+        self.assertFalse(os.path.exists(self.spool))
+
+    def test_pending_count_only_reads_appended_lines(self):
+        pending = writebehind.PendingCounter()
+        self.submit(1)
+        self.submit(2)
+        self.assertEqual(pending.count(), 2)
+        # Nothing appended, so nothing is read
+        with mock.patch('app.writebehind.open', create=True, side_effect=AssertionError):
+            self.assertEqual(pending.count(), 2)
+        self.submit(3)
+        self.assertEqual(pending.count(), 3)
+        self.assertEqual(pending.offset, os.path.getsize(self.spool))
+        writebehind.rotate()
+        self.assertEqual(pending.count(), 0)
+        self.submit(4)
+        self.assertEqual(pending.count(), 1)
+
+
+
+class MapSnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            MAP_SNAPSHOT_DIR=directory.name, MAP_SNAPSHOT_DEBOUNCE=0, MAP_SNAPSHOT_AUTO_REBUILD=True,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Rebuild in the test's own thread, which can see its data
+        self.rebuild_inline = mock.patch('app.snapshot.start_rebuild', side_effect=snapshot.rebuild_snapshot)
+        self.start_rebuild = self.rebuild_inline.start()
+        self.addCleanup(mock.patch.stopall)
+        self.directory = directory.name
+        create_google_app()
+        self.restaurant = Restaurant.objects.create(name='Newcomb', address='A', latitude=38, longitude=-78)
+
+    def test_snapshot_is_hashed_and_precompressed(self):
+        # Pages fall back to the map endpoint until the first build is done
+        self.assertIsNone(snapshot.get_snapshot_url())
+        url = snapshot.get_snapshot_url()
+        name = url.rsplit('/', 1)[1]
+        self.assertRegex(name, r'^restaurants\.[0-9a-f]{16}\.json$')
+        with open(os.path.join(self.directory, name), 'rb') as data:
+            self.assertEqual(json.load(data)['name'], ['Newcomb'])
+        self.assertTrue(os.path.exists(os.path.join(self.directory, name + '.gz')))
+        self.assertEqual(self.client.get(reverse('app:index')).context['map_snapshot_url'], url)
+
+    def test_url_changes_with_restaurants(self):
+        snapshot.build_snapshot()
+        url = snapshot.get_snapshot_url()
+        self.assertEqual(snapshot.get_snapshot_url(), url)
+        self.assertEqual(self.start_rebuild.call_count, 0)
+        self.restaurant.name = 'Observatory Hill'
+        self.restaurant.save()
+        # The page that notices the change still gets the last snapshot built
+        self.assertEqual(snapshot.get_snapshot_url(), url)
+        self.assertEqual(self.start_rebuild.call_count, 1)
+        self.assertNotEqual(snapshot.get_snapshot_url(), url)
+
+    def test_served_with_far_future_caching(self):
+        url = '/snapshots/' + snapshot.build_snapshot()['name']
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(self.client.get('/snapshots/other.json').status_code, 404)
+
+    def test_snapshot_missing_on_this_dyno_is_served_live(self):
+        url = '/snapshots/' + snapshot.build_snapshot()['name']
+        self.client.get(url)
+        for name in os.listdir(self.directory):
+            if name.startswith('restaurants.'):
+                os.remove(os.path.join(self.directory, name))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['name'], ['Newcomb'])
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.start_rebuild.call_count, 1)
+
+    def test_pruned_snapshots_are_forgotten(self):
+        middleware = snapshot.SnapshotWhiteNoiseMiddleware(lambda request: HttpResponse(status=404))
+        names = []
+        for name in ('Newcomb', 'Observatory Hill', 'Runk'):
+            self.restaurant.name = name
+            self.restaurant.save()
+            names.append(snapshot.build_snapshot()['name'])
+            if len(names) == 2:
+                os.remove(os.path.join(self.directory, names[0]))
+            middleware(RequestFactory().get('/snapshots/' + names[-1]))
+        self.assertEqual(
+            sorted(path for path in middleware.files if path.startswith('/snapshots/')),
+            sorted('/snapshots/' + name for name in names[1:]),
+        )
+
+
+class QueryScalingTests(TestCase):
+    """Fails when a page's query count starts growing with the amount of data."""
+
+    def count_queries(self, **sizes):
+        bench.clear_bench_data()
+        bench.seed(**sizes)
+        client = bench.get_bench_client('testserver')
+        counts = {}
+        for name, path, query in bench.get_bench_urls():
+            # Measure cold pages so cached fragments don't hide queries
+            cache.clear()
+            result = bench.measure(client, path, query, repeat=1)
+            self.assertEqual(result['status'], 200, name)
+            counts[name] = result['queries']
+        return counts
+
+    def test_query_counts_do_not_grow_with_data(self):
+        small = self.count_queries(restaurants=3, users=3, reviews=6, reports=6, requests=2)
+        large = self.count_queries(restaurants=30, users=20, reviews=300, reports=300, requests=40, seed=1)
+        self.assertEqual(small, large)
+
+
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(name='Newcomb', address='A', latitude=38, longitude=-78)
+        self.staff = User.objects.create(email='staff@email.com', is_staff=True)
+
+    def test_server_timing_header_is_only_for_staff(self):
+        with self.assertLogs('app.requests', 'INFO'):
+            response = self.client.get(reverse('app:search'), {'q': 'newcomb'})
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.client.force_login(self.staff)
+        timing = self.client.get(reverse('app:search'), {'q': 'newcomb'})['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertIn('view;dur=', timing)
+
+    async def test_server_timing_header_async(self):
+        client = AsyncClient()
+        response = await client.get(reverse('app:nearest_restaurants'), {'lat': 38, 'lng': -78})
+        self.assertFalse(response.has_header('Server-Timing'))
+        await sync_to_async(client.force_login)(self.staff)
+        response = await client.get(reverse('app:nearest_restaurants'), {'lat': 38, 'lng': -78})
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+    def test_repeated_queries_are_flagged(self):
+        def n_plus_one(request):
+            for _ in range(settings.N_PLUS_ONE_THRESHOLD + 1):
+                Restaurant.objects.filter(pk=self.restaurant.pk).exists()
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.user = self.staff
+        with self.assertLogs('app.requests', 'WARNING') as logs:
+            response = RequestTimingMiddleware(n_plus_one)(request)
+        event = json.loads(logs.records[0].getMessage())
+        self.assertEqual(event['event'], 'n_plus_one')
+        self.assertEqual(event['count'], settings.N_PLUS_ONE_THRESHOLD + 1)
+        self.assertIn(f'desc="{settings.N_PLUS_ONE_THRESHOLD + 1} queries"', response['Server-Timing'])
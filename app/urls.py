@@ -9,10 +9,18 @@ urlpatterns = [
     path("", views.index, name="index"),
     path("logout", LogoutView.as_view(), name="logout"),
     path("restaurants", views.RestaurantListView.as_view(), name="restaurants"),
-    path("restaurants/<int:pk>", views.RestaurantView.as_view(), name="restaurant_detail"),
+    path("api/restaurants.json", views.restaurants_json, name="restaurants_json"),
+    path("api/restaurants/nearest", views.nearest_restaurants, name="nearest_restaurants"),
+    path("api/search", views.search_api, name="search"),
+    path("api/leaderboard", views.leaderboard_api, name="leaderboard"),
+    path("api/dishes", views.dish_search_api, name="dish_search"),
+    path("api/restaurants/<int:pk>/trend", views.restaurant_trend_api, name="restaurant_trend"),
+    path("restaurants/<int:pk>", views.restaurant_detail, name="restaurant_detail"),
+    path("restaurants/<int:pk>/reviews", views.restaurant_reviews, name="restaurant_reviews"),
     path("restaurants/<int:pk>/update", views.RestaurantUpdateView.as_view(), name="restaurant_update"),
     path('restaurant_request/<int:pk>/approve/', views.ApproveRequestView.as_view(), name='approve_request'),
     path('restaurant_request/<int:pk>/reject/', views.RejectRequestView.as_view(), name='reject_request'),
+    path('restaurant_request/bulk/', views.BulkModerateRequestsView.as_view(), name='bulk_moderate_requests'),
     path('restaurant_request/', views.restaurant_request_view, name='create_request'),
     path('restaurant_request/<int:restaurant_id>/', views.restaurant_request_view, name='create_request_filled'),
     path("reviews/<int:pk>", views.ReviewView.as_view(), name="review_detail"),
@@ -22,4 +30,8 @@ urlpatterns = [
     # path('reports/', ReportListView.as_view(), name='report_list'),
     path('reports/create/', ReportCreateView.as_view(), name='report_create'),
     path('read_messages/', views.read_messages, name='read_messages'),
+    path('inbox/', views.inbox, name='inbox'),
+    path('inbox/<int:pk>/read/', views.read_message, name='read_message'),
+    path('export/reviews', views.export_data, {'kind': 'reviews'}, name='export_reviews'),
+    path('export/reports', views.export_data, {'kind': 'reports'}, name='export_reports'),
 ]
@@ -1,110 +1,415 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 import json
+import time
+from datetime import timedelta
 from typing import Any
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.template import loader
 from .models import Review, Restaurant, RestaurantRequest, RejectionMessage
 from django.http import Http404
+from django.core.exceptions import PermissionDenied
 from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.contrib.auth.decorators import login_required
 from django.urls import reverse
 from django.views import generic, View
+from django.views.decorators.http import require_POST
 from django.utils import timezone
 from django.views.generic import UpdateView, ListView, CreateView
 from django.forms import modelformset_factory
 from django.shortcuts import redirect
 from django.core.serializers import serialize
+from django.utils.decorators import method_decorator
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import quote_etag, urlencode
 from .forms import RestaurantRequestForm, ReviewForm, ReportForm
 from .models import Report
+from . import bulk, caching, export, leaderboard, rollups, writebehind
+from .duplicates import find_duplicates, get_duplicates
+from .geo import parse_bbox
+from .menus import asearch_dishes
+from .notifications import INBOX_PAGE_SIZE, get_unread_count, mark_read
+from .pagination import keyset_page
+from .permissions import get_admin_scope, load_admin_scope
+from .routing import pins_primary, read_from_replica
+from .search import asearch_restaurants
+from .snapshot import get_snapshot_url
+from .spatial import get_nearest_index
+from .stats import aget_current_baselines, get_current_baselines
 
 
 # Create your views here.
 
 
-def index(request):
-    # Convert QuerySet to list of dicts
-    restaurants = Restaurant.objects.all()
-    restaurant_list = [{
-        'pk': restaurant.pk,
-        'name': restaurant.name,
-        'address': restaurant.address,
-        'latitude': restaurant.latitude,
-        'longitude': restaurant.longitude,
-        'contact_info': restaurant.contact_info,
-        'avg_rating': restaurant.get_average_rating(),
-        'id': restaurant.id,
-    } for restaurant in restaurants]
-    
-    restaurants_json = json.dumps(restaurant_list)
+async def aget_user(request):
+    # request.user is loaded lazily with the sync ORM, so resolve it in a thread once
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+# Templates can still touch the ORM (the user, allauth's SocialApp), so async
+# views render in the sync thread
+arender = sync_to_async(render)
+
+
+# The rest are in the inbox
+INDEX_MESSAGE_LIMIT = 5
 
-    if request.user.is_authenticated:
-        messages = RejectionMessage.objects.filter(recipient=request.user, read=False)
-    else:
-        messages = []
+
+@read_from_replica
+async def index(request):
+    user = await aget_user(request)
+    messages = []
+    # Only look for messages when the cached count says there are some
+    if await sync_to_async(get_unread_count)(user):
+        messages = [message async for message in RejectionMessage.objects.filter(
+            recipient=user, read=False
+        ).order_by('-id')[:INDEX_MESSAGE_LIMIT]]
 
     context = {
         'google_maps_api_key': settings.GOOGLE_MAPS_API_KEY,
-        'restaurants': restaurants_json,
+        'map_snapshot_url': await sync_to_async(get_snapshot_url)(),
         'messages': messages,
     }
-    return render(request, "app/index.html", context=context)
+    return await arender(request, "app/index.html", context=context)
 
 
-class RestaurantListView(generic.ListView):
-    template_name = "app/restaurantlist.html"
-    context_object_name = "restaurant_list"
+# Live crowdedness drifts as reports age, so the cached map expires on this schedule too
+MAP_LIVE_BUCKET_SECONDS = 300
 
-    def get_queryset(self):
-        return Restaurant.objects.order_by('name')
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['google_maps_api_key'] = settings.GOOGLE_MAPS_API_KEY
+def restaurant_feature(restaurant, baseline=None):
+    return {
+        'type': 'Feature',
+        'id': restaurant.pk,
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [restaurant.longitude, restaurant.latitude],
+        },
+        'properties': {
+            'pk': restaurant.pk,
+            'name': restaurant.name,
+            'address': restaurant.address,
+            'contact_info': restaurant.contact_info,
+            'avg_rating': restaurant.get_average_rating(),
+            'crowdedness_now': restaurant.get_live_crowdedness(baseline),
+        },
+    }
 
-        restaurant_list = [{
+
+def serialize_restaurant_map(restaurants, baselines):
+    return json.dumps({
+        'type': 'FeatureCollection',
+        'features': [restaurant_feature(restaurant, baselines.get(restaurant.pk)) for restaurant in restaurants],
+    }, separators=(',', ':')).encode()
+
+
+def build_restaurant_map():
+    return serialize_restaurant_map(Restaurant.objects.order_by('pk'), get_current_baselines())
+
+
+def get_map_live_bucket():
+    return int(time.time() // MAP_LIVE_BUCKET_SECONDS)
+
+
+def restaurant_map_etag(request):
+    version = f'{caching.get_version(caching.RESTAURANT_MAP)}-{get_map_live_bucket()}'
+    # Viewport responses are only valid for the box they were asked for
+    bbox = request.GET.get('bbox')
+    if bbox:
+        return version + '-' + hashlib.md5(bbox.encode()).hexdigest()
+    return version
+
+
+@read_from_replica
+async def restaurants_json(request):
+    # What @condition does, which only supports sync views in this Django version
+    etag = quote_etag(restaurant_map_etag(request))
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    if 'bbox' in request.GET:
+        try:
+            bbox = parse_bbox(request.GET['bbox'])
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        restaurants = [restaurant async for restaurant in Restaurant.objects.in_bbox(*bbox).order_by('pk')]
+        body = serialize_restaurant_map(restaurants, await aget_current_baselines())
+    else:
+        # The ETag is the map version, so conditional requests never touch the payload
+        body = await sync_to_async(caching.get_versioned)(
+            caching.RESTAURANT_MAP, f'restaurant-map-json:{get_map_live_bucket()}', build_restaurant_map,
+            timeout=MAP_LIVE_BUCKET_SECONDS,
+        )
+    response = HttpResponse(body, content_type='application/geo+json')
+    response.headers['ETag'] = etag
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+NEAREST_DEFAULT_K = 10
+NEAREST_MAX_K = 100
+
+
+@read_from_replica
+async def nearest_restaurants(request):
+    try:
+        latitude = float(request.GET['lat'])
+        longitude = float(request.GET['lng'])
+        k = int(request.GET.get('k', NEAREST_DEFAULT_K))
+    except (KeyError, ValueError):
+        return JsonResponse({'error': "lat and lng are required numbers and k must be an integer"}, status=400)
+    if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
+        return JsonResponse({'error': "lat must be between -90 and 90 and lng between -180 and 180"}, status=400)
+    k = max(1, min(k, NEAREST_MAX_K))
+
+    # Building the index reads every location, so it happens in a thread
+    index = await sync_to_async(get_nearest_index)()
+    nearest = index.nearest(latitude, longitude, k)
+    restaurants = await Restaurant.objects.ain_bulk([pk for pk, _ in nearest])
+    results = []
+    for pk, distance in nearest:
+        # Skip anything deleted since the index was built
+        restaurant = restaurants.get(pk)
+        if restaurant is None:
+            continue
+        results.append({
             'pk': restaurant.pk,
             'name': restaurant.name,
             'address': restaurant.address,
             'latitude': restaurant.latitude,
             'longitude': restaurant.longitude,
-            'contact_info': restaurant.contact_info,
+            'distance_km': round(distance, 3),
             'avg_rating': restaurant.get_average_rating(),
-            'id': restaurant.id,
-        } for restaurant in Restaurant.objects.all()]
-        restaurants_json = json.dumps(restaurant_list)
-        context['restaurants'] = restaurants_json
+            'review_count': restaurant.review_count,
+        })
+    return JsonResponse({'results': results})
 
-        is_admin = self.request.user.groups.filter(name="admin of everything").exists()
-        context["is_admin"] = is_admin
 
-        return context
+SEARCH_PAGE_SIZE = 20
 
 
-class RestaurantView(generic.DetailView):
-    template_name = "app/restaurant.html"
-    model = Restaurant
-    # display various aspects of restaurant info
+@read_from_replica
+async def search_api(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        return JsonResponse({'error': "page must be an integer"}, status=400)
+
+    total, restaurants = await asearch_restaurants(query, page, SEARCH_PAGE_SIZE)
+    return JsonResponse({
+        'query': query,
+        'page': page,
+        'total': total,
+        'has_next': page * SEARCH_PAGE_SIZE < total,
+        'results': [{
+            'pk': restaurant.pk,
+            'name': restaurant.name,
+            'address': restaurant.address,
+            'latitude': restaurant.latitude,
+            'longitude': restaurant.longitude,
+            'avg_rating': restaurant.get_average_rating(),
+            'url': reverse('app:restaurant_detail', args=[restaurant.pk]),
+        } for restaurant in restaurants],
+    })
+
+
+@read_from_replica
+async def leaderboard_api(request):
+    report_type = request.GET.get('type', '')
+    try:
+        prefix = leaderboard.get_board_prefix(report_type)
+        k = max(1, min(int(request.GET.get('k', leaderboard.DEFAULT_K)), leaderboard.MAX_K))
+        restaurant_id = int(request.GET['restaurant']) if request.GET.get('restaurant') else None
+    except ValueError:
+        return JsonResponse({'error': "type must be a report type, and k and restaurant integers"}, status=400)
+
+    def entry(restaurant, rank):
+        count = getattr(restaurant, prefix + '_count')
+        return {
+            'rank': rank,
+            'pk': restaurant.pk,
+            'name': restaurant.name,
+            'score': round(getattr(restaurant, prefix + '_score'), 3),
+            'average': round(getattr(restaurant, prefix + '_sum') / count, 2) if count else None,
+            'count': count,
+            'url': reverse('app:restaurant_detail', args=[restaurant.pk]),
+        }
+
+    top = await sync_to_async(leaderboard.get_top)(report_type, k)
+    data = {'type': report_type, 'results': [entry(restaurant, rank) for rank, restaurant in enumerate(top, 1)]}
+    if restaurant_id is not None:
+        try:
+            restaurant = await Restaurant.objects.aget(pk=restaurant_id)
+        except Restaurant.DoesNotExist:
+            return JsonResponse({'error': "No restaurant found matching the query"}, status=404)
+        rank = await sync_to_async(leaderboard.get_rank)(restaurant, report_type)
+        data['restaurant'] = entry(restaurant, rank)
+    return JsonResponse(data)
+
+
+@read_from_replica
+async def dish_search_api(request):
+    query = request.GET.get('q', '').strip()
+    items = await asearch_dishes(query)
+    return JsonResponse({
+        'query': query,
+        'results': [{
+            'name': item.name,
+            'price': str(item.price) if item.price is not None else None,
+            'tags': item.tags.split(),
+            'restaurant': {
+                'pk': item.restaurant.pk,
+                'name': item.restaurant.name,
+                'url': reverse('app:restaurant_detail', args=[item.restaurant.pk]),
+            },
+        } for item in items],
+    })
+
+
+@read_from_replica
+async def restaurant_trend_api(request, pk):
+    report_type = request.GET.get('type', Report.ReportType.CROWDEDNESS)
+    period = request.GET.get('period', 'day')
+    try:
+        days = max(1, min(int(request.GET.get('days', rollups.DEFAULT_TREND_DAYS)), rollups.MAX_TREND_DAYS))
+    except ValueError:
+        days = None
+    if report_type not in Report.ReportType.values or period not in rollups.TREND_PERIODS or days is None:
+        return JsonResponse({'error': "type must be a report type, period hour or day, and days an integer"}, status=400)
+    if not await Restaurant.objects.filter(pk=pk).aexists():
+        return JsonResponse({'error': "No restaurant found matching the query"}, status=404)
+
+    since = timezone.now() - timedelta(days=days)
+    trend = rollups.get_trend(pk, report_type, rollups.TREND_PERIODS[period], since)
+    return JsonResponse({
+        'type': report_type,
+        'period': period,
+        'results': [{
+            'start': rollup.start.isoformat(),
+            'count': rollup.count,
+            'average': round(rollup.sum / rollup.count, 2) if rollup.count else None,
+            'histogram': [getattr(rollup, name) for name in rollup.HISTOGRAM_FIELDS],
+        } async for rollup in trend],
+    })
+
+
+@method_decorator(read_from_replica, name='dispatch')
+class RestaurantListView(generic.ListView):
+    template_name = "app/restaurantlist.html"
+    context_object_name = "restaurant_list"
+    paginate_by = 50
+
+    def get_queryset(self):
+        return Restaurant.objects.order_by('name')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        is_admin = self.request.user.groups.filter(name=str(self.object.pk) + ' admin').exists()
-        context["is_admin"] = is_admin
+        context['google_maps_api_key'] = settings.GOOGLE_MAPS_API_KEY
+        context['map_snapshot_url'] = get_snapshot_url()
+
         return context
 
 
+REVIEW_PAGE_SIZE = 12
+REVIEW_ORDERINGS = {
+    'newest': ['-timestamp', '-id'],
+    'rating': ['-rating', '-timestamp', '-id'],
+}
+
+
+def get_review_page(restaurant, sort, cursor=None):
+    """
+    Return the context for one page of a restaurant's reviews. Raises
+    ValueError for an unknown sort or a bad cursor.
+    """
+    if sort not in REVIEW_ORDERINGS:
+        raise ValueError("Unknown sort")
+    reviews = Review.objects.filter(restaurant=restaurant).select_related('user')
+    page, next_cursor = keyset_page(reviews, REVIEW_ORDERINGS[sort], cursor, REVIEW_PAGE_SIZE)
+    next_url = None
+    if next_cursor:
+        next_url = reverse('app:restaurant_reviews', args=[restaurant.pk]) + '?' + urlencode({
+            'sort': sort, 'cursor': next_cursor,
+        })
+    return {'reviews': page, 'next_reviews_url': next_url}
+
+
+@read_from_replica
+def restaurant_reviews(request, pk):
+    # HTML fragment for the detail page's infinite scroll
+    restaurant = get_object_or_404(Restaurant, pk=pk)
+    try:
+        context = get_review_page(restaurant, request.GET.get('sort', 'newest'), request.GET.get('cursor'))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid sort or cursor")
+    return render(request, "app/review_cards.html", context)
+
+
+@read_from_replica
+async def restaurant_detail(request, pk):
+    # display various aspects of restaurant info
+    review_sort = request.GET.get('sort', 'newest')
+    if review_sort not in REVIEW_ORDERINGS:
+        return HttpResponseBadRequest("Unknown sort")
+    try:
+        restaurant = await Restaurant.objects.aget(pk=pk)
+    except Restaurant.DoesNotExist:
+        raise Http404("No restaurant found matching the query")
+
+    # Live, so never cached
+    baselines = await aget_current_baselines(restaurant_ids=[pk])
+    context = {
+        'restaurant': restaurant,
+        'object': restaurant,
+        # Only evaluated, during rendering, when the cached fragments that use them are rebuilt
+        'summary': SimpleLazyObject(restaurant.get_report_summary),
+        'review_sort': review_sort,
+        'review_page': SimpleLazyObject(lambda: get_review_page(restaurant, review_sort)),
+        'crowdedness_now': restaurant.get_live_crowdedness(baselines.get(pk)),
+    }
+    return await arender(request, "app/restaurant.html", context)
+
+
+REQUEST_PAGE_SIZE = 50
+
+
+def get_request_page(restaurant_requests, cursor=None):
+    """
+    Return (requests, next_cursor) for one page of a moderation queue,
+    oldest first. Raises ValueError for a bad cursor.
+    """
+    restaurant_requests = restaurant_requests.select_related('requester', 'corresponding_restaurant')
+    return keyset_page(restaurant_requests, ['id'], cursor, REQUEST_PAGE_SIZE)
+
+
 class RestaurantUpdateView(generic.DetailView):
     template_name = "app/restaurant_update.html"
     model = Restaurant
 
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        try:
+            self.restaurant_requests, self.next_cursor = get_request_page(
+                RestaurantRequest.objects.filter(corresponding_restaurant=self.object), request.GET.get('cursor')
+            )
+        except ValueError:
+            return HttpResponseBadRequest("Invalid cursor")
+        return self.render_to_response(self.get_context_data(object=self.object))
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        restaurant_requests = RestaurantRequest.objects.filter(corresponding_restaurant=self.object)
-        context['restaurant_requests'] = restaurant_requests
-
-        is_admin = self.request.user.groups.filter(name=str(self.object.pk) + ' admin').exists()
-        context["is_admin"] = is_admin
+        context['restaurant_requests'] = self.restaurant_requests
+        context['next_cursor'] = self.next_cursor
 
         return context
 
@@ -113,6 +418,8 @@ class ApproveRequestView(View):
     def post(self, request, *args, **kwargs):
         request_id = kwargs.get('pk')
         restaurant_request = get_object_or_404(RestaurantRequest, pk=request_id)
+        if not load_admin_scope(request.user).can_moderate(restaurant_request):
+            raise PermissionDenied
         has_corr = restaurant_request.corresponding_restaurant is not None
         restaurant_request.approve()
 
@@ -126,6 +433,8 @@ class RejectRequestView(View):
     def post(self, request, *args, **kwargs):
         request_id = kwargs.get('pk')
         restaurant_request = get_object_or_404(RestaurantRequest, pk=request_id)
+        if not load_admin_scope(request.user).can_moderate(restaurant_request):
+            raise PermissionDenied
         has_corr = restaurant_request.corresponding_restaurant is not None
 
         rejection_message = request.POST.get('rejection_message', '')
@@ -147,10 +456,50 @@ class RejectRequestView(View):
         return HttpResponseRedirect(reverse('app:new_restaurant'))
 
 
+class BulkModerateRequestsView(View):
+    """
+    Approve or reject every selected request in one transaction. Requests
+    the user can't moderate are ignored.
+    """
+
+    def post(self, request, *args, **kwargs):
+        action = request.POST.get('action')
+        if action not in ('approve', 'reject'):
+            return HttpResponseBadRequest("Unknown action")
+        try:
+            request_ids = [int(pk) for pk in request.POST.getlist('request_ids')]
+        except ValueError:
+            return HttpResponseBadRequest("Invalid request id")
+
+        # Checked against the database, since a cached scope can lag a revoked admin
+        scope = load_admin_scope(request.user)
+        restaurant_requests = [
+            restaurant_request
+            for restaurant_request in RestaurantRequest.objects.filter(pk__in=request_ids).select_related(
+                'corresponding_restaurant'
+            )
+            if scope.can_moderate(restaurant_request)
+        ]
+
+        if action == 'approve':
+            bulk.approve_requests(restaurant_requests)
+        else:
+            rejection_message = request.POST.get('rejection_message', '')
+            if rejection_message == "":
+                rejection_message = "No message provided."
+            bulk.reject_requests(restaurant_requests, rejection_message)
+
+        restaurant_id = request.POST.get('restaurant')
+        if restaurant_id and restaurant_id.isdigit():
+            return HttpResponseRedirect(reverse('app:restaurant_update', args=[int(restaurant_id)]))
+        return HttpResponseRedirect(reverse('app:new_restaurant'))
+
+
 class ReviewView(generic.DetailView):
     template_name = "app/review.html"
     model = Review
 
+@method_decorator(pins_primary, name='dispatch')
 class ReviewFormView(CreateView):
     template_name = "app/review_form.html"
     form_class = ReviewForm
@@ -191,16 +540,20 @@ def restaurant_request_view(request, restaurant_id=None):
 
     form = RestaurantRequestForm(initial=initial_data)
 
+    duplicates = []
     if request.method == 'POST':
         form = RestaurantRequestForm(request.POST)
         if form.is_valid():
             rest_req = form.save(commit=False)
             if not request.user.is_anonymous:
                 rest_req.requester = request.user
-            rest_req.save()
-            return redirect(reverse('app:create_request') + '?success=True')
+            # Point out restaurants that already exist before asking an admin to add them again
+            duplicates = [] if request.POST.get('confirm_new') else find_duplicates(rest_req)
+            if not duplicates:
+                rest_req.save()
+                return redirect(reverse('app:create_request') + '?success=True')
 
-    context = {'form': form}
+    context = {'form': form, 'duplicates': duplicates}
     success_message = request.GET.get('success', 'False') == 'True'
     context['success'] = success_message
 
@@ -211,15 +564,28 @@ class NewRestaurantView(generic.ListView):
     template_name = "app/new_restaurant.html"
     context_object_name = "new_restaurants_list"
 
+    def get(self, request, *args, **kwargs):
+        try:
+            return super().get(request, *args, **kwargs)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid cursor")
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        is_admin = self.request.user.groups.filter(name="admin of everything").exists()
-        context["is_admin"] = is_admin
+        context['next_cursor'] = self.next_cursor
 
         return context
 
     def get_queryset(self):
-        return RestaurantRequest.objects.filter(corresponding_restaurant=None)
+        page, self.next_cursor = get_request_page(
+            RestaurantRequest.objects.filter(corresponding_restaurant=None), self.request.GET.get('cursor')
+        )
+        # Only moderators see the queue and its duplicate warnings
+        if get_admin_scope(self.request.user).is_global:
+            duplicates = get_duplicates(page)
+            for restaurant_request in page:
+                restaurant_request.duplicates = duplicates.get(restaurant_request.pk, [])
+        return page
     
 # class ReportListView(View):
 #     template_name = "app/report_list.html"
@@ -237,20 +603,70 @@ class ReportCreateView(View):
         context = {'form': form, 'success': success_message}
         return render(request, self.template_name, context)
 
+    @method_decorator(pins_primary)
     def post(self, request, *args, **kwargs):
         form = ReportForm(request.POST)  
         if form.is_valid():
             report = form.save(commit=False)
             report.user = request.user  
-            report.save()
+            # Falls back to a direct insert when the spool is full
+            if not (settings.REPORT_WRITE_BEHIND and writebehind.spool_report(report)):
+                report.save()
             return redirect(reverse('app:report_create') + '?success=True')
         else:
             context = {'form': form}
             return render(request, self.template_name, context)   
 
 
+@pins_primary
 def read_messages(request):
     if request.method == 'POST':
-        user = request.user
-        RejectionMessage.objects.filter(recipient=user, read=False).update(read=True)
+        mark_read(request.user)
         return HttpResponseRedirect(reverse('app:index'))
+
+
+@login_required
+def inbox(request):
+    messages = RejectionMessage.objects.filter(recipient=request.user)
+    try:
+        messages, next_cursor = keyset_page(messages, ['-id'], request.GET.get('cursor'), INBOX_PAGE_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor")
+    context = {
+        'inbox': messages,
+        'next_url': f"{reverse('app:inbox')}?{urlencode({'cursor': next_cursor})}" if next_cursor else None,
+    }
+    return render(request, "app/inbox.html", context)
+
+
+@login_required
+@require_POST
+@pins_primary
+def read_message(request, pk):
+    message = get_object_or_404(RejectionMessage, pk=pk, recipient=request.user)
+    mark_read(request.user, [message.pk])
+    return HttpResponseRedirect(reverse('app:inbox'))
+
+
+@staff_member_required
+def export_data(request, kind):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return HttpResponseBadRequest("format must be csv or ndjson")
+    try:
+        fields, rows, next_cursor = export.get_export(
+            kind, request.GET.get('restaurant'), request.GET.get('type'), request.GET.get('since'),
+            request.GET.get('until'), request.GET.get('cursor'),
+        )
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+
+    if isinstance(request, ASGIRequest):
+        content = export.astream_export(fields, rows, fmt)
+    else:
+        content = export.stream_export(fields, rows, fmt)
+    response = StreamingHttpResponse(content, content_type=export.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    # Pass back as ?cursor= to export only what was added after this
+    response['X-Export-Cursor'] = next_cursor
+    return response
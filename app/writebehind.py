@@ -0,0 +1,200 @@
+"""
+Write-behind buffer for report submissions.
+
+With REPORT_WRITE_BEHIND on, ReportCreateView appends each validated report
+to a spool file instead of inserting it, and the flush_reports worker
+inserts spooled reports with bulk_create and updates the running totals
+once per batch.
+
+Crash safety: a report is appended and fsync'd before the user is
+redirected, so once they see the success page it survives the web process
+or the machine going down, as long as the spool directory's disk does. The
+worker renames the spool aside before reading it and only deletes that
+batch file after the transaction inserting it has committed. If it dies in
+between, the next run replays the file, and because every spooled report
+carries a submission_id, reports that already made it in are skipped
+instead of being inserted or counted twice. A line torn by a crash during
+the append was never acknowledged and is skipped.
+
+The spool is local to the machine, so every web host needs its own worker
+or a shared REPORT_SPOOL_DIR.
+"""
+import fcntl
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from . import stats
+from .models import Report, Restaurant
+
+
+SPOOL_NAME = 'reports.jsonl'
+LOCK_NAME = 'reports.lock'
+BATCH_PREFIX = 'reports-'
+
+
+def get_spool_dir():
+    directory = Path(settings.REPORT_SPOOL_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+@contextmanager
+def locked(directory, name=LOCK_NAME, blocking=True):
+    """Hold an exclusive flock on a file in directory. Raises BlockingIOError if not blocking and it's taken."""
+    with open(directory / name, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def spool_report(report):
+    """
+    Durably append an unsaved, validated report to the spool. Returns False,
+    without spooling anything, if the spool is full.
+    """
+    report.submission_id = uuid.uuid4()
+    report.timestamp = timezone.now()
+    line = json.dumps({
+        'submission_id': str(report.submission_id),
+        'user_id': report.user_id,
+        'restaurant_id': report.restaurant_id,
+        'report_type': report.report_type,
+        'rating': report.rating,
+        'timestamp': report.timestamp.isoformat(),
+    }) + '\n'
+
+    directory = get_spool_dir()
+    path = directory / SPOOL_NAME
+    with locked(directory):
+        size = path.stat().st_size if path.exists() else 0
+        if size + len(line) > settings.REPORT_SPOOL_MAX_BYTES:
+            return False
+        with open(path, 'a') as spool:
+            spool.write(line)
+            spool.flush()
+            os.fsync(spool.fileno())
+        if size == 0:
+            # A new file also needs its directory entry on disk
+            descriptor = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+    return True
+
+
+class PendingCounter:
+    """
+    Counts the reports in the spool, reading only what was appended since
+    the last count. The spool is only ever appended to until rotate() moves
+    it aside, which shows up as a different file or a shorter one.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.inode = None
+        self.offset = 0
+        self.pending = 0
+
+    def count(self):
+        path = get_spool_dir() / SPOOL_NAME
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self.reset()
+            return 0
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.reset()
+            self.inode = stat.st_ino
+        if stat.st_size > self.offset:
+            with open(path, 'rb') as spool:
+                spool.seek(self.offset)
+                appended = spool.read(stat.st_size - self.offset)
+            # Up to the last newline, so a line being appended is counted once it's complete
+            complete = appended.rfind(b'\n') + 1
+            self.pending += appended.count(b'\n', 0, complete)
+            self.offset += complete
+        return self.pending
+
+
+def count_pending():
+    return PendingCounter().count()
+
+
+def rotate():
+    """
+    Move the spool aside so it can be flushed while new reports keep being
+    appended. Returns every batch file waiting to be flushed, oldest first.
+    """
+    directory = get_spool_dir()
+    path = directory / SPOOL_NAME
+    with locked(directory):
+        if path.exists() and path.stat().st_size:
+            os.rename(path, directory / f'{BATCH_PREFIX}{time.time_ns()}.jsonl')
+    return sorted(directory.glob(BATCH_PREFIX + '*.jsonl'))
+
+
+def read_batch(path):
+    records = []
+    with open(path) as batch:
+        for line in batch:
+            try:
+                record = json.loads(line)
+                record['submission_id'] = uuid.UUID(record['submission_id'])
+                record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+            except (ValueError, KeyError, TypeError):
+                # Torn by a crash before it was acknowledged
+                continue
+            records.append(record)
+    return records
+
+
+def flush_batch(records):
+    """Insert the records that aren't in the database yet. Returns how many were inserted."""
+    with transaction.atomic():
+        existing = set(Report.objects.filter(
+            submission_id__in=[record['submission_id'] for record in records]
+        ).values_list('submission_id', flat=True))
+        # Anything deleted since the report was spooled can't be referenced any more
+        restaurant_ids = set(Restaurant.objects.filter(
+            pk__in={record['restaurant_id'] for record in records}
+        ).values_list('pk', flat=True))
+        user_ids = set(get_user_model().objects.filter(
+            pk__in={record['user_id'] for record in records}
+        ).values_list('pk', flat=True))
+
+        reports = []
+        for record in records:
+            if (record['submission_id'] in existing or record['restaurant_id'] not in restaurant_ids
+                    or record['user_id'] not in user_ids):
+                continue
+            existing.add(record['submission_id'])
+            reports.append(Report(**record))
+        Report.objects.bulk_create(reports)
+        stats.record_bulk_create(reports)
+    return len(reports)
+
+
+def flush(batch_size=500):
+    """Flush everything spooled so far. Returns the number of reports inserted."""
+    inserted = 0
+    for path in rotate():
+        records = read_batch(path)
+        for start in range(0, len(records), batch_size):
+            inserted += flush_batch(records[start:start + batch_size])
+        os.remove(path)
+    return inserted
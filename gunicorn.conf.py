@@ -0,0 +1,18 @@
+# Read by gunicorn from the working directory, so the Procfile only needs `gunicorn`.
+# SERVER_MODE=asgi serves hooshungry.asgi with uvicorn workers; the async map and
+# API views then hold slow clients without tying up a thread each. It stays opt-in:
+# under uvicorn every sync view and sync_to_async call shares one thread per worker,
+# and `manage.py loadtest` measured WSGI ahead.
+import os
+
+server_mode = os.environ.get('SERVER_MODE', 'wsgi')
+
+if server_mode == 'asgi':
+    wsgi_app = 'hooshungry.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+elif server_mode == 'wsgi':
+    wsgi_app = 'hooshungry.wsgi:application'
+else:
+    raise ValueError("SERVER_MODE must be 'wsgi' or 'asgi'")
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
@@ -62,9 +62,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # outermost, so it times everything below it
+    'app.instrumentation.RequestTimingMiddleware',
     # django middleware
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise, also serving the prebuilt map snapshots
+    'app.snapshot.SnapshotWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.sites.middleware.CurrentSiteMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,7 +83,8 @@ ROOT_URLCONF = 'hooshungry.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for the Server-Timing header
+        'BACKEND': 'app.instrumentation.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'app', 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -89,6 +93,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'app.permissions.admin_scope',
+                'app.notifications.unread_messages',
             ],
         },
     },
@@ -116,6 +122,54 @@ else:
         }
     }
 
+# Read replicas as comma separated database URLs, used by the views in app/routing.py. To try it locally
+# with two SQLite files, set DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3 and copy db.sqlite3 to it.
+DATABASE_REPLICAS = []
+for number, url in enumerate(filter(None, os.getenv("DATABASE_REPLICA_URLS", "").split(',')), 1):
+    alias = f'replica_{number}'
+    DATABASES[alias] = dj_database_url.parse(
+        url.strip(),
+        conn_max_age=600,
+        conn_health_checks=True,
+        ssl_require=IS_HEROKU_APP,
+        # Tests read the rows they write, so a test replica is the test primary
+        test_options={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['app.routing.ReplicaRouter']
+# Seconds a user's reads go to the primary after they post a review or report
+REPLICA_PIN_SECONDS = 10
+
+
+# Cache
+# The versioned keys in app/caching.py are only coherent across gunicorn workers when the cache is shared by
+# them: Redis (REDIS_URL, any Redis-compatible server) is shared by every machine, and files under CACHE_DIR
+# by the workers of one machine or dyno. The local-memory default is per process, so only for development.
+CACHE_MAX_ENTRIES = 10000
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        }
+    }
+elif os.getenv("CACHE_DIR") or IS_HEROKU_APP:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv("CACHE_DIR", '/tmp/hooshungry-cache'),
+            'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+        }
+    }
+
 
 # django-allauth -> https://django-allauth.readthedocs.io/en/latest/installation/quickstart.html
 AUTHENTICATION_BACKENDS = [
@@ -192,6 +246,52 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Map snapshots, see app/snapshot.py
+MAP_SNAPSHOT_DIR = os.getenv("MAP_SNAPSHOT_DIR", BASE_DIR / 'snapshots')
+MAP_SNAPSHOT_URL = '/snapshots/'
+# Seconds a snapshot is kept after the restaurants change before it is rebuilt
+MAP_SNAPSHOT_DEBOUNCE = 30
+# Pages start rebuilds in a background thread; turn off when build_map_snapshot runs on a schedule
+MAP_SNAPSHOT_AUTO_REBUILD = os.getenv("MAP_SNAPSHOT_AUTO_REBUILD", "1") == "1"
+
+TEST_RUNNER = 'hooshungry.test_runner.TestRunner'
+
+
+# Request timing, see app/instrumentation.py
+REQUEST_TIMING = os.getenv("REQUEST_TIMING", "1") == "1"
+SLOW_REQUEST_MS = 500
+# More repeats of one SQL shape than this in a request is logged as a likely N+1
+N_PLUS_ONE_THRESHOLD = 10
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # Every request is logged at INFO, warnings are for N+1s and slow requests
+        'app.requests': {
+            'handlers': ['console'],
+            'level': os.getenv("REQUEST_LOG_LEVEL", "INFO" if IS_HEROKU_APP else "WARNING"),
+            'propagate': False,
+        },
+    },
+}
+
+
+# Report write-behind, see app/writebehind.py. `manage.py flush_reports` must run on the same machine
+# (or against the same REPORT_SPOOL_DIR) as the web process.
+REPORT_WRITE_BEHIND = os.getenv("REPORT_WRITE_BEHIND") == "1"
+REPORT_SPOOL_DIR = os.getenv("REPORT_SPOOL_DIR", BASE_DIR / 'spool')
+# Once the spool is this big, reports are inserted directly again
+REPORT_SPOOL_MAX_BYTES = 16 * 1024 * 1024
+REPORT_FLUSH_BATCH_SIZE = 500
+REPORT_FLUSH_INTERVAL = 5
+# Rolled up reports older than this many days are deleted by `manage.py rollup_reports`, see app/rollups.py
+REPORT_RETENTION_DAYS = int(os.getenv("REPORT_RETENTION_DAYS")) if os.getenv("REPORT_RETENTION_DAYS") else None
+
+
 # ALLAUTH
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -0,0 +1,21 @@
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Keeps the suite's map snapshots out of MAP_SNAPSHOT_DIR, and pages from rebuilding them."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.snapshot_dir = tempfile.TemporaryDirectory()
+        self.snapshot_settings = override_settings(
+            MAP_SNAPSHOT_DIR=self.snapshot_dir.name, MAP_SNAPSHOT_AUTO_REBUILD=False,
+        )
+        self.snapshot_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.snapshot_settings.disable()
+        self.snapshot_dir.cleanup()
+        super().teardown_test_environment(**kwargs)